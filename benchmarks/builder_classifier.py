@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""builder_classifier.py [options]
+
+Times get_platform, get_build_type and get_job_type over report-sized lists of
+rows, comparing the original loop over every pattern with
+buildapi.model.util.Classifier, with and without its memo.
+
+The buildernames come from --corpus, a file with one buildername per line,
+e.g. the output of:
+
+    SELECT DISTINCT buildername FROM buildrequests
+        WHERE submitted_at > UNIX_TIMESTAMP() - 7*86400;
+
+Without --corpus, names shaped like the production ones are made up."""
+import random
+import time
+
+from buildapi.model import util
+
+BRANCHES = ['mozilla-central', 'mozilla-inbound', 'fx-team', 'try',
+            'mozilla-aurora', 'mozilla-beta', 'b2g-inbound', 'ash', 'cedar']
+PLATFORMS = ['Linux', 'Linux x86-64', 'OS X 10.7', 'WINNT 5.2',
+             'Android 2.3 Emulator', 'Android armv7 API 9',
+             'Ubuntu VM 12.04', 'Ubuntu VM 12.04 x64', 'Ubuntu HW 12.04 x64',
+             'Rev5 MacOSX Mountain Lion 10.8', 'Rev5 MacOSX Yosemite 10.10',
+             'Windows XP 32-bit', 'Windows 7 32-bit', 'Windows 8 64-bit']
+JOBS = ['build', 'leak test build', 'nightly', 'l10n nightly',
+        'opt test mochitest-%i', 'debug test mochitest-%i',
+        'opt test reftest-%i', 'debug test crashtest', 'opt test xpcshell',
+        'talos tp5o', 'talos svgr', 'opt test jsreftest']
+
+
+def make_corpus(seed=0):
+    rng = random.Random(seed)
+    names = set()
+    for branch in BRANCHES:
+        for platform in PLATFORMS:
+            for job in JOBS:
+                if '%i' in job:
+                    job = job % rng.randint(1, 5)
+                names.add("%s %s %s" % (platform, branch, job))
+    return sorted(names)
+
+
+def loop_classify(table, name):
+    # What get_platform and friends used to do
+    for key in table:
+        for pat in table[key]:
+            if pat.match(name):
+                return key
+    return None
+
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(__doc__)
+    parser.set_defaults(corpus=None, rows=200000)
+    parser.add_option("--corpus", dest="corpus",
+                      help="file with one buildername per line")
+    parser.add_option("--rows", dest="rows", type="int",
+                      help="number of rows to classify")
+    options, args = parser.parse_args()
+
+    if options.corpus:
+        names = [l.strip() for l in open(options.corpus) if l.strip()]
+    else:
+        names = make_corpus()
+    # A few builders account for most of the rows
+    rng = random.Random(1)
+    rows = [names[min(int(rng.expovariate(10.0 / len(names))),
+                      len(names) - 1)] for i in range(options.rows)]
+
+    tables = [util.PLATFORMS_BUILDERNAME, util.BUILD_TYPE_BUILDERNAME,
+              util.JOB_TYPE_BUILDERNAME]
+    classifiers = [util.Classifier(t) for t in tables]
+
+    for name in names:
+        for table, classifier in zip(tables, classifiers):
+            assert loop_classify(table, name) == classifier.match(name), name
+
+    print "%i distinct buildernames, %i rows" % (len(names), len(rows))
+    for what, func in [
+            ("loop", lambda name: [loop_classify(t, name) for t in tables]),
+            ("combined", lambda name: [c.match(name) for c in classifiers]),
+            ("combined+memo", lambda name: [c(name) for c in classifiers]),
+            ]:
+        start = time.time()
+        for name in rows:
+            func(name)
+        elapsed = time.time() - start
+        print "%-16s %8.3fs %8.2fus/row" % (what, elapsed,
+                                            elapsed / len(rows) * 1e6)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""cache_codecs.py [options]
+
+Compares the size and encode/decode time of the cache codecs on a day's worth
+of builds for a busy branch, shaped like the output of
+buildapi.lib.cache.getBuilds.  Use --builds to change the number of builds in
+the day."""
+import random
+import time
+
+from buildapi.lib import cacher
+
+PLATFORMS = ['Linux', 'Linux x86-64', 'OS X 10.7', 'WINNT 5.2', 'Android']
+JOBS = ['mozilla-inbound build', 'mozilla-inbound leak test build',
+        'mozilla-inbound opt test mochitest-1',
+        'mozilla-inbound opt test mochitest-other',
+        'mozilla-inbound debug test reftest', 'mozilla-inbound talos tp5o',
+        'mozilla-inbound opt test xpcshell',
+        'mozilla-inbound debug test crashtest']
+
+
+def make_request(rng, request_id, buildername, revision, starttime):
+    return {
+        'request_id': request_id,
+        'buildername': buildername,
+        'branch': 'integration/mozilla-inbound',
+        'revision': revision,
+        'submittime': starttime - rng.randint(0, 600),
+        'complete': 1,
+        'complete_at': starttime + rng.randint(600, 7200),
+        'priority': 0,
+        'claimed_at': starttime,
+        'reason': 'scheduler',
+    }
+
+
+def make_day(num_builds, seed=0):
+    rng = random.Random(seed)
+    revisions = ['%040x' % rng.getrandbits(160)
+                 for i in range(num_builds // 40 + 1)]
+    day = []
+    for i in range(num_builds):
+        buildername = "%s %s" % (rng.choice(PLATFORMS), rng.choice(JOBS))
+        revision = rng.choice(revisions)[:12]
+        starttime = 1340000000 + rng.randint(0, 86400)
+        request = make_request(rng, 1000000 + i, buildername, revision,
+                               starttime)
+        if i % 20 == 0:
+            # Pending requests are mixed in with the builds
+            day.append(request)
+            continue
+        day.append({
+            'build_id': 2000000 + i,
+            'requests': [request],
+            'buildnumber': rng.randint(1, 5000),
+            'buildername': buildername,
+            'branch': 'integration/mozilla-inbound',
+            'revision': revision,
+            'starttime': starttime,
+            'endtime': starttime + rng.randint(600, 7200),
+            'status': rng.choice([0, 0, 0, 1, 2]),
+            'claimed_by_name': 'buildbot-master%02i.build.mozilla.org:/builds'
+                               % rng.randint(1, 60),
+        })
+    return day
+
+
+def timeit(func, arg, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        func(arg)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(__doc__)
+    parser.set_defaults(builds=5000, repeat=5)
+    parser.add_option("--builds", dest="builds", type="int",
+                      help="number of builds in the day")
+    parser.add_option("--repeat", dest="repeat", type="int",
+                      help="take the best of this many runs")
+    options, args = parser.parse_args()
+
+    day = make_day(options.builds)
+    print "%i builds" % len(day)
+    print "%-16s %10s %8s %12s %12s" % ("codec", "bytes", "ratio",
+                                         "encode (ms)", "decode (ms)")
+    baseline = None
+    for name in ['json', 'zlib', 'columnar', 'columnar+zlib']:
+        codec = cacher.get_codec(name)
+        data = codec.encode(day)
+        assert cacher.decode(data) == day
+        if baseline is None:
+            baseline = len(data)
+        print "%-16s %10i %8.2f %12.1f %12.1f" % (name, len(data),
+                float(len(data)) / baseline,
+                timeit(codec.encode, day, options.repeat) * 1000,
+                timeit(cacher.decode, data, options.repeat) * 1000)
+
+if __name__ == '__main__':
+    main()
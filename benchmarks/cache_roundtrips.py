@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+"""cache_roundtrips.py [options]
+
+Counts the redis round trips made by the cache layer for a single key lookup,
+for the "is every day in this range cached?" check, and for fetching and
+storing a whole range of days as BuildapiCache.get_builds_for_date_range
+does, comparing the old per-key code paths with the current ones.
+
+By default this runs against an in-process stand-in for redis that just
+counts commands; pass --host to count against a real server instead."""
+from buildapi.lib import cacher
+
+
+class CountingRedis(object):
+    """Minimal redis client stand-in that counts round trips"""
+    def __init__(self):
+        self.data = {}
+        self.round_trips = 0
+
+    def get(self, key):
+        self.round_trips += 1
+        return self.data.get(key)
+
+    def exists(self, key):
+        self.round_trips += 1
+        return key in self.data
+
+    def set(self, key, val, ex=None, nx=False):
+        self.round_trips += 1
+        if nx and key in self.data:
+            return False
+        self.data[key] = val
+        return True
+
+    def setex(self, key, val, expire):
+        return self.set(key, val)
+
+    def mget(self, keys):
+        self.round_trips += 1
+        return [self.data.get(key) for key in keys]
+
+    def delete(self, key):
+        self.round_trips += 1
+        self.data.pop(key, None)
+
+    def pipeline(self, transaction=True):
+        return CountingPipeline(self)
+
+
+class CountingPipeline(object):
+    def __init__(self, r):
+        self.r = r
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+        return queue
+
+    def execute(self):
+        before = self.r.round_trips
+        results = [getattr(self.r, name)(*args, **kwargs)
+                   for (name, args, kwargs) in self.commands]
+        self.r.round_trips = before + 1
+        return results
+
+
+class CountingProxy(object):
+    """Wraps a real redis client, counting round trips"""
+    def __init__(self, r):
+        self._r = r
+        self.round_trips = 0
+
+    def pipeline(self, transaction=True):
+        p = self._r.pipeline(transaction=transaction)
+        proxy = self
+        execute = p.execute
+        def counted_execute():
+            proxy.round_trips += 1
+            return execute()
+        p.execute = counted_execute
+        return p
+
+    def __getattr__(self, name):
+        attr = getattr(self._r, name)
+        def counted(*args, **kwargs):
+            self.round_trips += 1
+            return attr(*args, **kwargs)
+        return counted
+
+
+def old_get(c, key):
+    # What RedisCache._get used to do
+    if not c.has_key(key):
+        return cacher.MISSING
+    return c.r.get(key)
+
+
+def old_has_keys(c, keys):
+    # What get_builds_for_date_range(method=1) used to do
+    return [c.has_key(key) for key in keys]
+
+
+def old_get_many(c, keys):
+    # What get_builds_for_date_range(method=0) used to do for cached days
+    return [old_get(c, key) for key in keys]
+
+
+def old_put_many(c, items):
+    # What get_builds_for_date_range(method=1) used to do after its big query
+    for key, val in items.iteritems():
+        c.put(key, val)
+
+
+def count(c, func, *args):
+    c.r.round_trips = 0
+    func(*args)
+    return c.r.round_trips
+
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(__doc__)
+    parser.set_defaults(host=None, port=6379, days=30)
+    parser.add_option("--host", dest="host", help="redis host to use")
+    parser.add_option("--port", dest="port", type="int")
+    parser.add_option("--days", dest="days", type="int",
+                      help="number of days in the range check")
+    options, args = parser.parse_args()
+
+    c = cacher.RedisCache()
+    if options.host:
+        c.r = CountingProxy(cacher.RedisCache(options.host, options.port).r)
+    else:
+        c.r = CountingRedis()
+
+    keys = ["bench:builds:day%i" % i for i in range(options.days)]
+    for key in keys:
+        c.put(key, [{'buildername': 'x', 'requests': []}])
+
+    print "%-40s %8s %8s" % ("operation", "before", "after")
+    print "%-40s %8i %8i" % ("cache hit",
+            count(c, old_get, c, keys[0]), count(c, c._get, keys[0]))
+    print "%-40s %8i %8i" % ("cache miss",
+            count(c, old_get, c, "bench:missing"),
+            count(c, c._get, "bench:missing"))
+    print "%-40s %8i %8i" % ("%i day range check" % options.days,
+            count(c, old_has_keys, c, keys), count(c, c.has_keys, keys))
+    print "%-40s %8i %8i" % ("%i day range fetch" % options.days,
+            count(c, old_get_many, c, keys), count(c, c.get_many, keys))
+    items = dict((key, c._get(key)) for key in keys)
+    print "%-40s %8i %8i" % ("%i day range store" % options.days,
+            count(c, old_put_many, c, items), count(c, c.put_many, items))
+
+    if options.host:
+        for key in keys:
+            c.r.delete(key)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""report_memory.py [options]
+
+Measures the memory taken by the BuildRequest objects behind a 30 day
+builders report (GetBuildersReport), comparing the slotted BuildRequest with
+an otherwise identical class that keeps its attributes in a __dict__.  Each
+variant is built in its own process, and the growth of its resident set size
+is reported.  Linux only.
+
+The rows are made up, shaped like the rows of BuildersQuery; use --per-day to
+change how many build requests there are per day."""
+import gc
+import os
+import random
+import resource
+import types
+
+from buildapi.model.buildrequest import BuildRequest
+
+PLATFORMS = ['Linux', 'Linux x86-64', 'OS X 10.7', 'WINNT 5.2',
+             'Android 2.3 Emulator', 'Ubuntu VM 12.04 x64',
+             'Windows 7 32-bit']
+JOBS = ['build', 'leak test build', 'opt test mochitest-1',
+        'debug test mochitest-2', 'opt test reftest', 'talos tp5o',
+        'opt test xpcshell']
+
+
+def dict_class(cls):
+    """Returns a copy of cls whose instances have a __dict__ instead of
+    slots"""
+    attrs = dict((k, v) for k, v in cls.__dict__.items()
+                 if k not in ('__slots__', '__dict__', '__weakref__')
+                 and not isinstance(v, types.MemberDescriptorType))
+    return type('Dict' + cls.__name__, (object,), attrs)
+
+
+def make_rows(days, per_day, seed=0):
+    rng = random.Random(seed)
+    start = 1340000000
+    for i in range(days * per_day):
+        submitted_at = start + i * 86400 // per_day
+        start_time = submitted_at + rng.randint(0, 1800)
+        finish_time = start_time + rng.randint(600, 7200)
+        yield {
+            'brid': 1000000 + i,
+            'bid': 2000000 + i,
+            'number': rng.randint(1, 5000),
+            'buildername': "%s mozilla-inbound %s" % (rng.choice(PLATFORMS),
+                                                     rng.choice(JOBS)),
+            'branch': 'integration/mozilla-inbound',
+            'revision': '%040x' % rng.getrandbits(160),
+            'buildsetid': 500000 + i // 20,
+            'submitted_at': submitted_at,
+            'claimed_at': start_time,
+            'claimed_by_name': 'buildbot-master%02i:/builds' % rng.randint(1, 60),
+            'start_time': start_time,
+            'finish_time': finish_time,
+            'complete': 1,
+            'complete_at': finish_time,
+            'results': rng.choice([0, 0, 0, 1, 2]),
+            'reason': 'scheduler',
+            'changeid': 300000 + i // 20,
+            'when_timestamp': submitted_at - 60,
+            'author': 'dev%i@example.com' % rng.randint(1, 200),
+        }
+
+
+def rss():
+    return int(open('/proc/self/statm').read().split()[1]) * \
+        resource.getpagesize()
+
+
+def measure(cls, days, per_day):
+    rows = list(make_rows(days, per_day))
+    gc.collect()
+    before = rss()
+    objs = []
+    for params in rows:
+        br = cls(**params)
+        # Reports look at these for every row
+        br.platform, br.build_type, br.job_type, br.status
+        objs.append(br)
+    gc.collect()
+    return rss() - before
+
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(__doc__)
+    parser.set_defaults(days=30, per_day=5000)
+    parser.add_option("--days", dest="days", type="int",
+                      help="number of days in the report")
+    parser.add_option("--per-day", dest="per_day", type="int",
+                      help="number of build requests per day")
+    options, args = parser.parse_args()
+
+    print "%i build requests" % (options.days * options.per_day)
+    results = {}
+    for cls in [dict_class(BuildRequest), BuildRequest]:
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(r)
+            os.write(w, str(measure(cls, options.days, options.per_day)))
+            os._exit(0)
+        os.close(w)
+        results[cls.__name__] = int(os.read(r, 100))
+        os.close(r)
+        os.waitpid(pid, 0)
+
+    baseline = results['DictBuildRequest']
+    for name in ['DictBuildRequest', 'BuildRequest']:
+        print "%-18s %8.1fMB %6.0f bytes/request %6.2f" % (name,
+            results[name] / 1048576.0,
+            float(results[name]) / (options.days * options.per_day),
+            float(results[name]) / baseline)
+
+if __name__ == '__main__':
+    main()
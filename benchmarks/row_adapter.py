@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""row_adapter.py [options]
+
+Compares the time taken to turn the rows of a builders query (BuildersQuery)
+into BuildRequest objects by rebuilding a dict of keyword arguments for every
+row, as the report builders used to, and with
+buildapi.model.util.adapt_rows.
+
+The rows are made up (see report_memory.py), loaded into a sqlite database
+with the columns of BuildersQuery, and fetched once; only the conversion of
+the fetched rows is timed.  Use --rows to change the number of rows."""
+import os
+import tempfile
+import time
+
+import sqlalchemy as sa
+
+from buildapi.model.buildrequest import BuildRequest
+from buildapi.model.util import adapt_rows
+
+from report_memory import make_rows
+
+COLUMNS = ['bid', 'finish_time', 'number', 'start_time', 'brid',
+           'buildsetid', 'buildername', 'claimed_at', 'claimed_by_name',
+           'complete', 'complete_at', 'results', 'submitted_at', 'reason',
+           'author', 'category', 'changeid', 'comments', 'project',
+           'repository', 'changes_revision', 'revlink', 'when_timestamp',
+           'branch', 'revision', 'ssid']
+
+
+def kwargs_path(rows):
+    for r in rows:
+        params = dict((str(k), v) for (k, v) in dict(r).items())
+        BuildRequest(**params)
+
+
+def adapter_path(rows):
+    for br in adapt_rows(rows, BuildRequest):
+        pass
+
+
+def load_rows(engine, num_rows):
+    meta = sa.MetaData(bind=engine)
+    t = sa.Table('builders', meta,
+                 *[sa.Column(c, sa.String if c in ('buildername',
+                   'claimed_by_name', 'reason', 'author', 'branch',
+                   'revision') else sa.Integer) for c in COLUMNS])
+    meta.create_all()
+    per_day = 5000
+    rows = make_rows(num_rows // per_day + 1, per_day)
+    batch = []
+    for i, row in enumerate(rows):
+        if i == num_rows:
+            break
+        batch.append(dict((c, row.get(c)) for c in COLUMNS))
+        if len(batch) == 10000:
+            t.insert().execute(batch)
+            batch = []
+    if batch:
+        t.insert().execute(batch)
+
+    start = time.time()
+    fetched = t.select().execute().fetchall()
+    return fetched, time.time() - start
+
+
+def timeit(func, arg, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        func(arg)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(__doc__)
+    parser.set_defaults(rows=500000, repeat=3)
+    parser.add_option("--rows", dest="rows", type="int",
+                      help="number of rows in the query")
+    parser.add_option("--repeat", dest="repeat", type="int",
+                      help="take the best of this many runs")
+    options, args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        engine = sa.create_engine("sqlite:///%s" % path)
+        rows, fetch = load_rows(engine, options.rows)
+    finally:
+        os.unlink(path)
+
+    print "%i rows, fetched in %.2fs" % (len(rows), fetch)
+    baseline = None
+    for name, func in [('kwargs', kwargs_path), ('adapt_rows', adapter_path)]:
+        elapsed = timeit(func, rows, options.repeat)
+        if baseline is None:
+            baseline = elapsed
+        print "%-12s %8.2fs %8.2fus/row %6.2f" % (name, elapsed,
+            elapsed * 1e6 / len(rows), elapsed / baseline)
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,5 @@
 """Pylons environment configuration"""
-import os, thread
+import os, re, thread
 
 from mako.lookup import TemplateLookup
 from pylons.configuration import PylonsConfig
@@ -12,6 +12,7 @@ import buildapi.lib.helpers
 from buildapi.config.routing import make_map
 from buildapi.model import init_scheduler_model, init_status_model,\
     init_buildapi_model
+from buildapi.model.replicas import add_replicas
 from buildapi.lib.mq import LoggingJobRequestPublisher, \
     LoggingJobRequestDoneConsumer
 
@@ -27,6 +28,30 @@ def setup_engine(engine):
     if engine.dialect.name == 'mysql':
         sqlalchemy.event.listen(engine.pool, 'checkout', checkout_listener)
 
+def setup_replicas(engine, config, name):
+    """Creates the engines of the read replicas of the name DB configured as
+    sqlalchemy.<name>_replica.*, sqlalchemy.<name>_replica2.*, ..., and
+    routes reads from engine to them"""
+    prefixes = set()
+    for key in config:
+        m = re.match(r'(sqlalchemy\.%s_replica\d*\.)url$' % name, key)
+        if m and config[key]:
+            prefixes.add(m.group(1))
+    if not prefixes:
+        return
+
+    replicas = []
+    for prefix in sorted(prefixes):
+        replica = engine_from_config(config, prefix)
+        setup_engine(replica)
+        replicas.append(replica)
+
+    read_max_lag = config.get('buildapi.replicas.read_max_lag')
+    add_replicas(engine, replicas,
+            report_max_lag=int(config.get('buildapi.replicas.report_max_lag',
+                300)),
+            read_max_lag=int(read_max_lag) if read_max_lag else None)
+
 def load_environment(global_conf, app_conf):
     """Configure the Pylons environment via the ``pylons.config``
     object
@@ -63,10 +88,12 @@ def load_environment(global_conf, app_conf):
     # Setup the SQLAlchemy database engine
     scheduler_engine = engine_from_config(config, 'sqlalchemy.scheduler_db.')
     setup_engine(scheduler_engine)
+    setup_replicas(scheduler_engine, config, 'scheduler_db')
     init_scheduler_model(scheduler_engine)
 
     status_engine = engine_from_config(config, 'sqlalchemy.status_db.')
     setup_engine(status_engine)
+    setup_replicas(status_engine, config, 'status_db')
     init_status_model(status_engine)
 
     buildapi_engine = engine_from_config(config, 'sqlalchemy.buildapi_db.')
@@ -85,6 +112,8 @@ def load_environment(global_conf, app_conf):
         config['pylons.app_globals'].mq_consumer = LoggingJobRequestDoneConsumer(
                 buildapi_engine,
                 config)
+        config['pylons.app_globals'].mq_consumer.buildapi_cache = \
+                config['pylons.app_globals'].buildapi_cache
         thread.start_new_thread(config['pylons.app_globals'].mq_consumer.run, ())
     else:
         config['pylons.app_globals'].mq = None
@@ -66,6 +66,9 @@ def make_map(config):
     map.connect('/reports/waittimes/{pool}', controller='reports', 
         action='waittimes')
 
+    map.connect('cache_stats', '/admin/cache', controller='admin',
+        action='cache')
+
     # BuildAPI
     # Read-write
     map.connect('reprioritize', '/self-serve/{branch}/request/{request_id}', controller='selfserve', action='reprioritize', conditions=dict(method=['PUT']))
@@ -92,6 +95,7 @@ def make_map(config):
     map.connect('revision', '/self-serve/{branch}/rev/{revision}', controller='selfserve', action='revision')
     map.connect('revision_is_done', '/self-serve/{branch}/rev/{revision}/is_done', controller='selfserve', action='revision_is_done')
     map.connect('builders', '/self-serve/{branch}/builders', controller='selfserve', action='builders')
+    map.connect('branch_builds', '/self-serve/{branch}/builds', controller='selfserve', action='branch_builds')
     map.connect('user', '/self-serve/{branch}/user/{user}', controller='selfserve', action='user')
 
     # Redirect /foo/ to /foo
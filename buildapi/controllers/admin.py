@@ -0,0 +1,18 @@
+from pylons import request
+from pylons.controllers.util import abort
+
+from buildapi.lib import cacher
+from buildapi.lib.base import BaseController
+
+class AdminController(BaseController):
+
+    def cache(self):
+        """Returns the cache hit/miss/latency/size counters for this process
+        as JSON, per key family.  POST reset=1 to start counting afresh."""
+        reset = request.params.get('reset') == '1'
+        if reset and request.method != 'POST':
+            abort(405, "Counters can only be reset with a POST")
+        retval = cacher.stats.snapshot()
+        if reset:
+            cacher.stats.reset()
+        return self.jsonify(retval)
@@ -1,4 +1,7 @@
 import formencode
+import functools
+import threading
+import time
 import urllib
 
 from pylons import request, response, session, tmpl_context as c, url
@@ -9,7 +12,7 @@ from buildapi.controllers.validators import PushesSchema, WaittimesSchema, \
 EndtoendSchema, EndtoendRevisionSchema, BuildersSchema, BuilderDetailsSchema, \
 IdleJobsSchema, SlaveDetailsSchema, SlavesSchema, TestRunSchema, \
 StatusBuildersSchema, StatusBuilderDetailsSchema
-from buildapi.lib import helpers as h
+from buildapi.lib import cacher, helpers as h
 from buildapi.lib.base import BaseController, render
 from buildapi.lib.visualization import gviz_pushes, gviz_pushes_intervals, \
 gviz_pushes_daily_intervals, gviz_waittimes, gviz_builders, \
@@ -17,6 +20,7 @@ gviz_slaves, gviz_slaves_busy, gviz_slaves_int_busy, \
 gviz_trychooser_authors, gviz_trychooser_runs, gviz_testruns, gviz_idlejobs, \
 csv_slaves_int_busy_silos, gviz_waittimes
 from buildapi.model.builders import GetBuildersReport, GetBuilderTypeReport
+from buildapi.model.catalog import getBuilderClasses
 from buildapi.model.endtoend import GetEndtoEndTimes, GetBuildRun
 from buildapi.model.idlejobs import GetIdleJobsReport
 from buildapi.model.pushes import GetPushes
@@ -30,6 +34,33 @@ from buildapi.model.waittimes import GetWaitTimes
 import logging
 log = logging.getLogger(__name__)
 
+def report_cache(**kwargs):
+    """Like beaker_cache, but also counts hits, misses and how long reports
+    take to generate in the cache stats, under the 'reports' family"""
+    def decorate(func):
+        local = threading.local()
+
+        @functools.wraps(func)
+        def fill(*args, **kw):
+            local.filled = True
+            start = time.time()
+            retval = func(*args, **kw)
+            cacher.stats.timing('reports', 'fill', time.time() - start)
+            return retval
+        cached = beaker_cache(**kwargs)(fill)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kw):
+            local.filled = False
+            retval = cached(*args, **kw)
+            if local.filled:
+                cacher.stats.incr('reports', 'misses')
+            else:
+                cacher.stats.incr('reports', 'hits')
+            return retval
+        return wrapper
+    return decorate
+
 class ReportsController(BaseController):
 
     def builders(self, branch_name='mozilla-central'):
@@ -49,7 +80,7 @@ class ReportsController(BaseController):
                 ('starttime', 'endtime', 'branch_name',
                 'platform', 'build_type', 'job_type', 'detail_level')])
 
-        @beaker_cache(expire=600, cache_response=False)
+        @report_cache(expire=600, cache_response=False)
         def builders_get_report(**params):
             return GetBuildersReport(**params)
         c.report = builders_get_report(**report_params)
@@ -60,6 +91,7 @@ class ReportsController(BaseController):
             req_id = params['reqid']
             return gviz_builders(c.report, req_id=req_id)
         else:
+            c.builder_classes = getBuilderClasses(params['branch_name'])
             return render('/reports/builders.mako')
 
     def builder_details(self, buildername=None):
@@ -72,7 +104,7 @@ class ReportsController(BaseController):
         report_params = dict([(k, params[k]) for k in 
             ('starttime', 'endtime', 'buildername')])
 
-        @beaker_cache(expire=600, cache_response=False)
+        @report_cache(expire=600, cache_response=False)
         def builder_details_get_report(**params):
             return GetBuilderTypeReport(**params)
         c.report = builder_details_get_report(**report_params)
@@ -92,7 +124,7 @@ class ReportsController(BaseController):
         report_params = dict([(k, params[k]) for k in 
             ('starttime', 'endtime', 'branch_name')])
 
-        @beaker_cache(expire=600, cache_response=False)
+        @report_cache(expire=600, cache_response=False)
         def endtoend_get_report(**params):
             return GetEndtoEndTimes(**params)
         c.report = endtoend_get_report(**report_params)
@@ -115,7 +147,7 @@ class ReportsController(BaseController):
         report_params = dict([(k, params[k]) for k in 
             ('branch_name', 'revision')])
 
-        @beaker_cache(expire=600, cache_response=False)
+        @report_cache(expire=600, cache_response=False)
         def endtoend_revision_get_report(**params):
             return GetBuildRun(**params)
         c.report = endtoend_revision_get_report(**report_params)
@@ -158,7 +190,7 @@ class ReportsController(BaseController):
         report_params = dict([(k, params[k]) for k in 
             ('starttime', 'endtime', 'int_size', 'branches')])
 
-        @beaker_cache(expire=600, cache_response=False)
+        @report_cache(expire=600, cache_response=False)
         def pushes_get_report(**params):
             return GetPushes(**params)
         c.report = pushes_get_report(**report_params)
@@ -185,7 +217,7 @@ class ReportsController(BaseController):
         report_params = dict([(k, params[k]) for k in 
             ('starttime', 'endtime', 'int_size', 'last_int_size')])
 
-        @beaker_cache(expire=600, cache_response=False)
+        @report_cache(expire=600, cache_response=False)
         def slaves_get_report(**params):
             return GetSlavesReport(**params)
         c.report = slaves_get_report(**report_params)
@@ -212,7 +244,7 @@ class ReportsController(BaseController):
         report_params = dict([(k, params[k]) for k in 
             ('slave_id', 'starttime', 'endtime', 'int_size', 'last_int_size')])
 
-        @beaker_cache(expire=600, cache_response=False)
+        @report_cache(expire=600, cache_response=False)
         def slave_details_get_report(**params):
             return GetSlaveDetailsReport(**params)
         c.report = slave_details_get_report(**report_params)
@@ -237,7 +269,7 @@ class ReportsController(BaseController):
         report_params = dict([(k, params[k]) for k in 
             ('starttime', 'endtime')])
 
-        @beaker_cache(expire=600, cache_response=False)
+        @report_cache(expire=600, cache_response=False)
         def status_builders_get_report(**params):
             return GetStatusBuildersReport(**params)
         c.report = status_builders_get_report(**report_params)
@@ -257,7 +289,7 @@ class ReportsController(BaseController):
         report_params = dict([(k, params[k]) for k in 
             ('builder_name', 'starttime', 'endtime')])
 
-        @beaker_cache(expire=600, cache_response=False)
+        @report_cache(expire=600, cache_response=False)
         def status_builder_details_get_report(**params):
             return GetBuilderDetailsReport(**params)
         c.report = status_builder_details_get_report(**report_params)
@@ -318,7 +350,7 @@ class ReportsController(BaseController):
         report_params = dict([(k, params[k]) for k in 
             ('starttime', 'endtime', 'branch_name')])
 
-        @beaker_cache(expire=600, cache_response=False)
+        @report_cache(expire=600, cache_response=False)
         def trychooser_get_report(**params):
             return TryChooserGetEndtoEndTimes(**params)
         c.report = trychooser_get_report(**report_params)
@@ -3,6 +3,7 @@ import logging
 from datetime import datetime
 
 from webhelpers.util import html_escape as e
+from sqlalchemy import and_, or_
 from sqlalchemy.orm.session import Session
 
 from pylons import request, response, tmpl_context as c, config, \
@@ -14,11 +15,13 @@ import formencode
 from formencode import validators
 
 from buildapi.lib.base import BaseController, render
-from buildapi.model.builds import getBuild, getRequest, getBuildsForUser
+from buildapi.model.builds import getBuild, getRequest, getBuildsForUser, \
+    getBuildsPage, addRequestProperties
 from buildapi.model.buildapidb import JobRequest
 from buildapi.lib.helpers import get_builders, url, get_branches, \
     get_completeness
 from buildapi.lib import json, times
+from buildapi.lib.paging import encode_cursor, decode_cursor
 
 log = logging.getLogger(__name__)
 access_log = logging.getLogger("buildapi.access")
@@ -57,6 +60,15 @@ class SelfserveController(BaseController):
     error, the request should be re-submitted at a later time.
 
     Missing or bad parameters for the request type will result in a 400 error.
+
+    Paged Listings
+    --------------
+    Listings that are paged return at most 'num' items at a time, along with
+    a "next" cursor.  Pass it as the 'cursor' query parameter to get the next
+    page.  "next" is null on the last page; 'offset' is ignored when a
+    cursor is given.  Builds are paged by build request, so a build made for
+    several requests may appear, with some of its requests, on two
+    consecutive pages.
     """
     def __before__(self):
         self._branches_cache = get_branches()
@@ -112,6 +124,16 @@ class SelfserveController(BaseController):
             response.status = 503
             return retval
 
+    def _watcher(self, branch, revision=None):
+        """Returns the watch argument for g.mq that has the cached builds for
+        branch and revision invalidated once the job request completes.  g.mq
+        calls it before sending the request, so the job can't finish before
+        it's being watched."""
+        buildapi_cache = g.buildapi_cache
+        def watch(job_id):
+            buildapi_cache.watch_job(job_id, branch, revision)
+        return watch
+
     def _require_auth(self):
         who = None
 
@@ -130,6 +152,29 @@ class SelfserveController(BaseController):
                 request.path_info)
         return who
 
+    def _with_properties(self, builds):
+        """Adds the properties of every request to builds if the properties
+        query parameter is set to 1"""
+        if request.GET.get('properties') == '1':
+            return addRequestProperties(builds)
+        return builds
+
+    def _get_num(self, default):
+        """Returns the num query parameter, the number of items to return"""
+        try:
+            return max(1, IntValidator.to_python(
+                request.GET.get('num', str(default))))
+        except formencode.Invalid:
+            return default
+
+    def _get_cursor(self, count):
+        """Returns the list of count values in the cursor query parameter, or
+        None for the first page.  Raises ValueError for a bad cursor."""
+        cursor = request.GET.get('cursor')
+        if not cursor:
+            return None
+        return decode_cursor(cursor, count)
+
     def _get_stable_delay(self):
         try:
             return IntValidator.to_python(request.GET.get('stableDelay', '180'))
@@ -165,7 +210,8 @@ class SelfserveController(BaseController):
         return self._format(self._branches_cache)
 
     def branch(self, branch):
-        """Return a list of builds running on this branch"""
+        """Return a list of builds running on this branch.  Add properties=1
+        to include the properties of every request."""
         # TODO: start/enddates
 
         if branch not in self._branches_cache:
@@ -181,7 +227,27 @@ class SelfserveController(BaseController):
             c.date = date
             c.today = today
             builds = g.buildapi_cache.get_builds_for_day(date, branch)
-            return self._ok(builds)
+            return self._ok(self._with_properties(builds))
+
+    def branch_builds(self, branch):
+        """Return a page of the running and finished builds on this branch,
+        newest first, as a dictionary of the "builds" and the "next" cursor.
+        Add num=N for N build requests per page (default 100), and
+        properties=1 to include the properties of every request."""
+        if branch not in self._branches_cache:
+            return self._failed("Branch %s not found" % branch, 404)
+
+        try:
+            before = self._get_cursor(1)
+        except ValueError, e:
+            return self._failed(str(e), 400)
+
+        builds, last_id = getBuildsPage(branch, before=before and before[0],
+                limit=self._get_num(100))
+        return self._ok({
+            'builds': self._with_properties(builds),
+            'next': encode_cursor(last_id) if last_id else None,
+            })
 
     def build(self, branch, build_id):
         """Return information about a build"""
@@ -208,7 +274,8 @@ class SelfserveController(BaseController):
         return self._ok(retval)
 
     def revision(self, branch, revision):
-        """Return a list of builds running for this revision"""
+        """Return a list of builds running for this revision.  Add
+        properties=1 to include the properties of every request."""
         stableDelay = self._get_stable_delay()
 
         if branch not in self._branches_cache:
@@ -222,7 +289,7 @@ class SelfserveController(BaseController):
         c.job_status = get_completeness(job_items, stableDelay)
         c.revision = revision
 
-        return self._ok(job_items)
+        return self._ok(self._with_properties(job_items))
 
     def revision_is_done(self, branch, revision):
         """Return a json dictionary with information about whether the job is
@@ -251,15 +318,27 @@ class SelfserveController(BaseController):
 
     @beaker_cache(query_args=True, expire=60)
     def user(self, branch, user):
-        """Return a list of builds for this user"""
+        """Return a list of builds for this user.  Builds are paged, num=N
+        build requests at a time (default 200); pending requests are listed
+        on the first page only."""
         if branch not in self._branches_cache:
             return self._failed("Branch %s not found" % branch, 404)
-        else:
-            builds = getBuildsForUser(branch, user, limit=200)
-            return self._ok(builds)
+
+        try:
+            before = self._get_cursor(1)
+        except ValueError, e:
+            return self._failed(str(e), 400)
+
+        builds = getBuildsForUser(branch, user, limit=self._get_num(200),
+                before=before and before[0])
+        if builds['next']:
+            builds['next'] = encode_cursor(builds['next'])
+        return self._ok(builds)
 
     def jobs(self):
-        """Return a list of past self-serve requests"""
+        """Return a list of past self-serve requests, most recent first.
+        Add paged=1 (or a cursor) to get a page of num=N requests (default
+        100) as a dictionary of the "jobs" and the "next" cursor."""
         s = Session()
         try:
             num_jobs = IntValidator.to_python(request.GET.get('num', '100'))
@@ -267,9 +346,32 @@ class SelfserveController(BaseController):
         except formencode.Invalid:
             num_jobs = 100
             offset = 0
-        jobs = s.query(JobRequest).order_by(JobRequest.when.desc()).limit(num_jobs).offset(offset)
-
-        return self._ok([j.asDict() for j in jobs])
+        try:
+            after = self._get_cursor(2)
+        except ValueError, e:
+            return self._failed(str(e), 400)
+
+        jobs = s.query(JobRequest).order_by(JobRequest.when.desc(),
+                JobRequest.id.desc())
+        if after:
+            when, job_id = after
+            jobs = jobs.filter(and_(JobRequest.when <= when,
+                or_(JobRequest.when < when, JobRequest.id < job_id)))
+        elif offset:
+            jobs = jobs.offset(offset)
+        jobs = jobs.limit(num_jobs).all()
+
+        if not after and request.GET.get('paged') != '1':
+            return self._ok([j.asDict() for j in jobs])
+
+        c.num_jobs = num_jobs
+        next_cursor = None
+        if len(jobs) == num_jobs:
+            next_cursor = encode_cursor(int(jobs[-1].when), jobs[-1].id)
+        return self._ok({
+            'jobs': [j.asDict() for j in jobs],
+            'next': next_cursor,
+            })
 
     def job_status(self, job_id):
         """Return information about a job request"""
@@ -321,10 +423,8 @@ class SelfserveController(BaseController):
             access_log.info("%s reprioritize %s %s to %s", who, branch,
                     request_id, priority)
             return self._format_mq_response(g.mq.reprioritizeRequest(who,
-                request_id, priority))
-
-        # TODO: invalidate cache for branch
-        return self._format(retval)
+                request_id, priority,
+                watch=self._watcher(branch, retval['revision'])))
 
     def cancel_request(self, branch, request_id):
         """Cancel the given request"""
@@ -343,9 +443,9 @@ class SelfserveController(BaseController):
             return self._failed("Request %s not found on branch %s" %
                     (request_id, branch), 404)
 
-        # TODO: invalidate cache for branch
         access_log.info("%s cancel_request %s %s", who, branch, request_id)
-        return self._format_mq_response(g.mq.cancelRequest(who, request_id))
+        return self._format_mq_response(g.mq.cancelRequest(who, request_id,
+            watch=self._watcher(branch, retval['revision'])))
 
     def cancel_build(self, branch, build_id):
         """Cancel the given build"""
@@ -365,8 +465,8 @@ class SelfserveController(BaseController):
                     (build_id, branch), 404)
 
         access_log.info("%s cancel_build %s %s", who, branch, build_id)
-        retval = g.mq.cancelBuild(who, build_id)
-        # TODO: invalidate cache for branch
+        retval = g.mq.cancelBuild(who, build_id,
+                watch=self._watcher(branch, retval['revision']))
         return self._format_mq_response(retval)
 
     def rebuild_build(self, branch):
@@ -400,8 +500,8 @@ class SelfserveController(BaseController):
             return self._failed("Build %s not found on branch %s" % (build_id, branch), 404)
 
         access_log.info("%s rebuild_build %s %s %s %s", who, branch, build_id, priority, count)
-        retval = g.mq.rebuildBuild(who, build_id, priority, count)
-        # TODO: invalidate cache for branch
+        retval = g.mq.rebuildBuild(who, build_id, priority, count,
+                watch=self._watcher(branch, retval['revision']))
         return self._format_mq_response(retval)
 
     def rebuild_request(self, branch):
@@ -436,8 +536,8 @@ class SelfserveController(BaseController):
             return self._failed("Request %s not found on branch %s" % (request_id, branch), 404)
 
         access_log.info("%s rebuild_request %s %s %s %s", who, branch, request_id, priority, count)
-        retval = g.mq.rebuildRequest(who, request_id, priority, count)
-        # TODO: invalidate cache for branch
+        retval = g.mq.rebuildRequest(who, request_id, priority, count,
+                watch=self._watcher(branch, retval['revision']))
         return self._format_mq_response(retval)
 
     def cancel_revision(self, branch, revision):
@@ -451,8 +551,8 @@ class SelfserveController(BaseController):
         revision = revision[:12]
 
         access_log.info("%s cancel_revision %s %s", who, branch, revision)
-        retval = g.mq.cancelRevision(who, branch, revision)
-        # TODO: invalidate cache for branch
+        retval = g.mq.cancelRevision(who, branch, revision,
+                watch=self._watcher(branch, revision))
         return self._format_mq_response(retval)
 
     def new_build_at_rev(self, branch, revision):
@@ -463,9 +563,9 @@ class SelfserveController(BaseController):
             return self._failed("Branch %s not found" % branch, 404)
 
         access_log.info("%s new_build of %s %s", who, branch, revision)
-        retval = g.mq.newBuildAtRevision(who, branch, revision)
+        retval = g.mq.newBuildAtRevision(who, branch, revision,
+                watch=self._watcher(branch, revision))
         response.status = 202
-        # TODO: invalidate cache for branch
         return self._format(retval)
 
     def new_pgobuild_at_rev(self, branch, revision):
@@ -483,9 +583,9 @@ class SelfserveController(BaseController):
             return self._failed('Bad priority', 400)
 
         access_log.info("%s new_pgobuild of %s %s", who, branch, revision)
-        retval = g.mq.newPGOBuildAtRevision(who, branch, revision, priority)
+        retval = g.mq.newPGOBuildAtRevision(who, branch, revision, priority,
+                watch=self._watcher(branch, revision))
         response.status = 202
-        # TODO: invalidate cache for branch
         return self._format(retval)
 
     def new_nightly_at_rev(self, branch, revision):
@@ -503,9 +603,9 @@ class SelfserveController(BaseController):
             return self._failed('Bad priority', 400)
 
         access_log.info("%s new_nightly of %s %s", who, branch, revision)
-        retval = g.mq.newNightlyAtRevision(who, branch, revision, priority)
+        retval = g.mq.newNightlyAtRevision(who, branch, revision, priority,
+                watch=self._watcher(branch, revision))
         response.status = 202
-        # TODO: invalidate cache for branch
         return self._format(retval)
 
     def new_build_for_builder(self, branch, builder_name, revision):
@@ -538,11 +638,13 @@ class SelfserveController(BaseController):
             files = []
 
         # Set branch to ${branch}-selfserve to keep schedulers from triggering
+        cached_branch = branch
         branch += "-selfserve"
         access_log.info("%s new_build_for_builder of %s %s %s",
                         who, branch, builder_name, revision)
         retval = g.mq.newBuildForBuilder(
-                        who, branch, revision, priority, builder_name, properties, files)
+                        who, branch, revision, priority, builder_name, properties, files,
+                        watch=self._watcher(cached_branch, revision))
         response.status = 202
 
         return self._format(retval)
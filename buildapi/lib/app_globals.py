@@ -2,6 +2,7 @@
 
 from beaker.cache import CacheManager
 from beaker.util import parse_cache_config_options
+from paste.deploy.converters import asbool
 
 import pytz
 
@@ -29,10 +30,11 @@ class Globals(object):
         self.masters_url = config['masters_url']
         self.branches_url = config['branches_url']
 
+        codec = cacher.get_codec(config.get('buildapi.cache.codec', 'json'))
         if hasattr(cacher, 'RedisCache') and cache_spec.startswith('redis:'):
             # TODO: handle other hosts/ports
             bits = cache_spec.split(':')
-            kwargs = {}
+            kwargs = {'codec': codec}
             if len(bits) >= 2:
                 kwargs['host'] = bits[1]
 
@@ -41,8 +43,32 @@ class Globals(object):
             buildapi_cacher = cacher.RedisCache(**kwargs)
         elif hasattr(cacher, 'MemcacheCache') and cache_spec.startswith('memcached:'):
             hosts = cache_spec[10:].split(',')
-            buildapi_cacher = cacher.MemcacheCache(hosts)
+            buildapi_cacher = cacher.MemcacheCache(hosts, codec=codec)
+        elif cache_spec.startswith('memory:'):
+            if cache_spec[7:]:
+                buildapi_cacher = cacher.LocalCache(int(cache_spec[7:]))
+            else:
+                buildapi_cacher = cacher.LocalCache()
         else:
             raise RuntimeError("invalid cache spec %r" % (cache_spec,))
 
-        self.buildapi_cache = cache.BuildapiCache(buildapi_cacher, tz)
+        # Optionally keep recently used values in this process too
+        local_bytes = int(config.get('buildapi.cache.local_bytes', 0))
+        if local_bytes:
+            buildapi_cacher = cacher.TieredCache(buildapi_cacher,
+                    cacher.LocalCache(local_bytes),
+                    max_local_age=int(config.get(
+                        'buildapi.cache.local_max_age', 5)))
+
+        # Optionally keep the builds for days that won't change any more on
+        # disk too
+        frozen_dir = config.get('buildapi.cache.frozen_dir')
+        if frozen_dir:
+            frozen_store = cacher.DiskStore(frozen_dir)
+        else:
+            frozen_store = None
+
+        self.buildapi_cache = cache.BuildapiCache(buildapi_cacher, tz,
+                incremental=asbool(config.get('buildapi.cache.incremental',
+                    False)),
+                frozen_store=frozen_store)
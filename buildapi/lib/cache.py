@@ -1,23 +1,28 @@
+import threading
 import time
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
 
+from sqlalchemy import or_
+
+from buildapi.lib import cacher
+from buildapi.model import meta
 from buildapi.model.builds import getBuildsQuery, requestFromRow, buildFromRow, \
         getRevision, getPendingQuery
+from buildapi.model.replicas import execute_read
 from buildapi.lib.times import dt2ts, ts2dt, oneday, now
 
 import logging
 log = logging.getLogger(__name__)
 
-def getBuilds(branch, starttime, endtime):
-    log.info("Getting builds on %s between %s and %s", branch, starttime,
-            endtime)
-    build_q = getBuildsQuery(branch, starttime, endtime)
-
+def groupBuilds(rows):
+    """Turns rows from getBuildsQuery into a list of builds"""
     # Elements with the same claimed_by_name, claimed_by_incarnation,
     # claimed_at, buildername, and number are actually the same build and
     # should only be represented once
     builds = {}
     retval = []
-    for build in build_q.execute():
+    for build in rows:
         key = (build.claimed_by_name, build.claimed_by_incarnation,
                 build.claimed_at, build.buildername, build.number)
         if key in builds:
@@ -26,17 +31,120 @@ def getBuilds(branch, starttime, endtime):
         else:
             builds[key] = buildFromRow(build)
             retval.append(builds[key])
+    return retval
 
+def getPending(branch, starttime, endtime):
     q = getPendingQuery(branch, starttime, endtime)
-    for req in q.execute():
-        retval.append(requestFromRow(req))
+    return [requestFromRow(req) for req in execute_read(q)]
 
-    return retval
+def getBuilds(branch, starttime, endtime):
+    log.info("Getting builds on %s between %s and %s", branch, starttime,
+            endtime)
+    build_q = getBuildsQuery(branch, starttime, endtime)
+    return groupBuilds(execute_read(build_q)) + \
+            getPending(branch, starttime, endtime)
+
+def getBuildsIncremental(branch, starttime, endtime, state=None):
+    """
+    Like getBuilds, but returns a (builds, state) tuple.  Passing state back
+    in next time means only the builds that are new, still running, or have
+    completed since then are read from the DB; they're merged with the rest of
+    the builds from last time.
+    """
+    b = meta.scheduler_db_meta.tables['builds']
+    br = meta.scheduler_db_meta.tables['buildrequests']
+
+    build_q = getBuildsQuery(branch, starttime, endtime)
+    if state and state['columns'] != [c.key for c in build_q.inner_columns]:
+        # Saved by a different version of getBuildsQuery
+        state = None
+
+    rows = {}
+    if state:
+        log.info("Getting builds on %s between %s and %s changed since "
+                "build %s / completion at %s", branch, starttime, endtime,
+                state['max_build_id'], state['complete_at'])
+        build_q = build_q.where(or_(
+            b.c.id > state['max_build_id'],
+            br.c.complete == 0,
+            br.c.complete_at >= state['complete_at'],
+            ))
+        i = state['columns'].index('build_id')
+        for row in state['rows']:
+            rows[row[i]] = row
+    else:
+        log.info("Getting builds on %s between %s and %s", branch, starttime,
+                endtime)
+
+    # Deliberately run on the primary rather than with execute_read: state
+    # records the highest build id and completion time seen, and reading
+    # from replicas lagging by different amounts could overwrite a finished
+    # build with an older copy of it that is still running, which would then
+    # never be read again
+    for row in build_q.execute():
+        rows[row.build_id] = list(row)
+
+    # Put the rows back in the order getBuildsQuery returns them, so the
+    # builds come out exactly as getBuilds would have them
+    columns = [c.key for c in build_q.inner_columns]
+    BuildRow = namedtuple('BuildRow', columns, rename=True)
+    merged = [BuildRow(*rows[build_id])
+            for build_id in sorted(rows, reverse=True)]
+
+    state = {
+        'columns': columns,
+        'max_build_id': max(rows) if rows else 0,
+        'complete_at': max([r.complete_at for r in merged
+            if r.complete_at is not None] + [0]),
+        'rows': [list(r) for r in merged],
+    }
+    builds = groupBuilds(merged) + getPending(branch, starttime, endtime)
+    return builds, state
+
+def getRevisions(builds):
+    """Returns the distinct 12 character revisions in builds"""
+    return sorted(set(b['revision'][:12] for b in builds if b.get('revision')))
 
 class BuildapiCache:
-    def __init__(self, cache, timezone):
+    # Builds for days that may still change are recomputed in the background
+    # once they're recent_fresh seconds old; until then, and for up to
+    # recent_expire seconds, the old list is served
+    recent_fresh = 60
+    recent_expire = 900
+    # Once a day is over and nothing has completed for stable_window seconds,
+    # its builds are cached forever
+    stable_window = 3600
+    # How long the builds for a revision are cached, and how long until the
+    # cache warmer refreshes them
+    revision_expire = 120
+    revision_fresh = 60
+    # Prefixes of at least revision_prefix_min characters of the revisions
+    # in the last revision_index_days cached days are resolved to the full
+    # 12 character revision, so that they share its cache entry
+    revision_index_days = 3
+    revision_prefix_min = 7
+    # How many days get_builds_for_date_range(method=2) reads from the DB at
+    # once, across all callers
+    fetch_jobs = 4
+
+    def __init__(self, cache, timezone, incremental=False, frozen_store=None):
         self.cache = cache
         self.timezone = timezone
+        # Refresh recent days by merging in what changed since last time,
+        # rather than reading every build of the day again
+        self.incremental = incremental
+        # Where to keep the builds for days that won't change any more (a
+        # cacher.DiskStore), in case they're dropped from the cache
+        self.frozen_store = frozen_store
+        self._pool = None
+        self._pool_mutex = threading.Lock()
+
+    @property
+    def pool(self):
+        with self._pool_mutex:
+            if self._pool is None:
+                self._pool = ThreadPool(self.fetch_jobs)
+            return self._pool
 
     def build_key_for_day(self, date, branch):
         assert date.tzinfo
@@ -45,11 +153,132 @@ class BuildapiCache:
     def build_key_for_rev(self, branch, rev):
         return "builds:%s:%s" % (branch, rev)
 
-    def get_builds_for_revision(self, branch, revision):
+    def state_key(self, key):
+        return "%s:state" % key
+
+    def revs_key(self, key):
+        return "%s:revs" % key
+
+    def job_key(self, job_id):
+        return "jobs:%s" % job_id
+
+    def watch_job(self, job_id, branch, revision=None):
+        """
+        Remembers which cached builds the self-serve job request job_id
+        affects, so that job_done() can invalidate them once it completes
+        """
+        self.cache.put_many({self.job_key(job_id): [branch, revision]},
+                expire=time.time() + 86400)
+
+    def job_done(self, job_id):
+        """
+        Invalidates the cached builds affected by the job request job_id, if
+        it was registered with watch_job()
+        """
+        key = self.job_key(job_id)
+        found = self.cache.get_many([key])
+        if key not in found:
+            return
+        branch, revision = found[key]
+        log.info("Job %s on %s %s is done; invalidating cached builds",
+                job_id, branch, revision)
+        self.invalidate(branch, revision)
+        self.cache.delete_many([key])
+
+    def invalidate(self, branch, revision=None):
+        """
+        Removes the cached builds for branch that a change to revision may
+        have affected: those for the revision itself, for the days its builds
+        ran on, and for today, when any new builds will show up.
+        """
+        dates = [now(self.timezone)]
+        keys = []
+        if revision:
+            rev_key = self.build_key_for_rev(branch,
+                    self.canonical_revision(branch, revision))
+            keys.append(rev_key)
+            for b in self.cache.get_many([rev_key]).get(rev_key, []):
+                ts = b.get('starttime') or b.get('submittime')
+                if ts:
+                    dates.append(ts2dt(ts, self.timezone))
+        for date in dates:
+            keys.append(self.build_key_for_day(date, branch))
+        self.cache.delete_many(sorted(set(keys)))
+
+    def is_frozen(self, date, builds):
+        """
+        Returns whether builds, the builds for the given date, won't change
+        any more: the day is over, nothing is pending or running, and nothing
+        has completed within the last stable_window seconds.  Days that ended
+        more than three days ago only need nothing to be pending or running;
+        an old day with a pending build must be refreshed until it runs.
+        """
+        t = time.time()
+        endtime = dt2ts(date + oneday)
+        if endtime > t:
+            return False
+
+        last = 0
+        for b in builds:
+            if 'build_id' not in b or b['endtime'] is None:
+                # Pending or running
+                return False
+            last = max(last, b['endtime'])
+            for r in b['requests']:
+                if not r['complete']:
+                    return False
+                last = max(last, r['complete_at'])
+        if endtime < t - 3*86400:
+            return True
+        return last < t - self.stable_window
+
+    def _day_expiry(self, date, ttl):
+        def expire(builds):
+            if self.is_frozen(date, builds):
+                return 0
+            return time.time() + ttl
+        return expire
+
+    def canonical_revision(self, branch, revision):
+        """
+        Returns the 12 character revision that revision, which may be longer
+        or a shorter prefix, refers to.  Prefixes are looked up among the
+        revisions of the recently cached days; if that doesn't find exactly
+        one, the prefix is returned as is.
+        """
         revision = revision[:12]
+        if len(revision) == 12 or len(revision) < self.revision_prefix_min:
+            return revision
+
+        today = now(self.timezone)
+        keys = [self.revs_key(self.build_key_for_day(today - i*oneday, branch))
+                for i in range(self.revision_index_days)]
+        matches = set()
+        for revs in self.cache.get_many(keys).itervalues():
+            matches.update(r for r in revs if r.startswith(revision))
+        if len(matches) == 1:
+            return matches.pop()
+        return revision
+
+    def get_builds_for_revision(self, branch, revision):
+        revision = self.canonical_revision(branch, revision)
         key = self.build_key_for_rev(branch, revision)
         return self.cache.get(key, getRevision, (branch, revision),
-                expire=time.time()+120)
+                expire=time.time() + self.revision_expire)
+
+    def refresh_builds_for_revision(self, branch, revision):
+        """
+        Recomputes and caches the builds for revision, whether or not they're
+        cached already.  Returns the builds.
+        """
+        revision = self.canonical_revision(branch, revision)
+        builds = getRevision(branch, revision)
+        key = self.build_key_for_rev(branch, revision)
+        self.cache.put_many({key: builds},
+                expire=time.time() + self.revision_expire)
+        self.cache.put_many({self.cache.fresh_key(key): True},
+                expire=time.time() + self.revision_fresh)
+        return builds
 
     def get_builds_for_day(self, date, branch):
         """
@@ -57,18 +286,80 @@ class BuildapiCache:
         """
         assert date.tzinfo
         key = self.build_key_for_day(date, branch)
+
+        # Refresh soon, without making anybody wait for it, unless the day is
+        # over and done with
+        return self.cache.get_stale(key, self._fill_day,
+                (key, date, branch),
+                stale_after=self._day_expiry(date, self.recent_fresh),
+                expire=self._day_expiry(date, self.recent_expire))
+
+    def refresh_builds_for_day(self, date, branch):
+        """
+        Recomputes and caches the builds for the given date, whether or not
+        they're cached already.  Returns the builds.
+        """
+        assert date.tzinfo
+        key = self.build_key_for_day(date, branch)
+        builds = self._get_day_builds(key, date, branch)
+        self._put_days(branch, [(date, builds)])
+        return builds
+
+    def _fill_day(self, key, date, branch):
+        builds = self._get_day_builds(key, date, branch)
+        self.cache.put_many({self.revs_key(key): getRevisions(builds)},
+                expire=self._day_expiry(date, self.recent_expire)(builds))
+        return builds
+
+    def _get_day_builds(self, key, date, branch):
+        if self.frozen_store:
+            builds = self.frozen_store.get(key)
+            if builds is not cacher.MISSING:
+                return builds
+
         starttime = dt2ts(date)
         endtime = dt2ts(date + oneday)
-
-        if date - now(self.timezone) < 3*oneday:
-            # Expire soon
-            expire = time.time() + 60
+        if self.incremental:
+            state_key = self.state_key(key)
+            state = self.cache.get_many([state_key]).get(state_key)
+            builds, state = getBuildsIncremental(branch, starttime, endtime,
+                    state)
+            self.cache.put_many({state_key: state},
+                    expire=time.time() + self.recent_expire)
         else:
-            # Don't expire
-            expire = 0
+            builds = getBuilds(branch, starttime, endtime)
+
+        if self.frozen_store and self.is_frozen(date, builds):
+            self.frozen_store.put(key, builds)
+        return builds
 
-        return self.cache.get(key, getBuilds, (branch, starttime, endtime),
-                expire=expire)
+    def _put_days(self, branch, days):
+        """
+        Caches the builds for several days, given as a list of (date, builds)
+        tuples
+        """
+        frozen, recent, fresh = {}, {}, {}
+        for date, builds in days:
+            key = self.build_key_for_day(date, branch)
+            fresh_key = self.cache.fresh_key(key)
+            revs_key = self.revs_key(key)
+            if self.is_frozen(date, builds):
+                frozen[key] = builds
+                frozen[revs_key] = getRevisions(builds)
+                frozen[fresh_key] = True
+                if self.frozen_store:
+                    self.frozen_store.put(key, builds)
+            else:
+                recent[key] = builds
+                recent[revs_key] = getRevisions(builds)
+                fresh[fresh_key] = True
+        if frozen:
+            self.cache.put_many(frozen, expire=0)
+        if recent:
+            self.cache.put_many(recent,
+                    expire=time.time() + self.recent_expire)
+            self.cache.put_many(fresh,
+                    expire=time.time() + self.recent_fresh)
 
     def get_builds_for_date_range(self, starttime, endtime, branch, method=0):
         """
@@ -78,32 +369,55 @@ class BuildapiCache:
         assert starttime.tzinfo
         assert endtime.tzinfo
 
-        # Naive version: grab every day individually
+        days = []
+        d = starttime
+        while d < endtime:
+            days.append(d)
+            d += oneday
+        keys = [self.build_key_for_day(d, branch) for d in days]
+
+        # Fetch every cached day in one round trip to the cache, along with
+        # whether they're still fresh.  Stale days are treated as missing so
+        # that they get refreshed.
+        cached = self.cache.get_many(keys +
+                [self.cache.fresh_key(key) for key in keys])
+        for key in keys:
+            if self.cache.fresh_key(key) not in cached:
+                cached.pop(key, None)
+
+        # Naive version: grab every missing day individually
         if method == 0:
             retval = []
-            d = starttime
-            while d < endtime:
-                builds = self.get_builds_for_day(d, branch)
-                retval.extend(builds)
-                d += oneday
+            for d, key in zip(days, keys):
+                if key in cached:
+                    retval.extend(cached[key])
+                else:
+                    retval.extend(self.get_builds_for_day(d, branch))
+            return retval
+
+        # Fetch the missing days in parallel, each on its own DB connection,
+        # caching each one as it comes in
+        if method == 2:
+            missing = [d for d, key in zip(days, keys) if key not in cached]
+            if missing:
+                fetched = self.pool.map(
+                        lambda d: self.refresh_builds_for_day(d, branch),
+                        missing)
+                for d, builds in zip(missing, fetched):
+                    cached[self.build_key_for_day(d, branch)] = builds
+            retval = []
+            for key in keys:
+                retval.extend(cached[key])
             return retval
 
         # Less naive version? grab the entire date range if anything isn't
         # cached
         if method == 1:
-            d = starttime
-            need_more = False
-            while d < endtime:
-                key = self.build_key_for_day(d, branch)
-                if not self.cache.has_key(key):
-                    need_more = True
-                    break
-                d += oneday
-
-            if not need_more:
-                # Fall back to method 0
-                return self.get_builds_for_date_range(starttime, endtime,
-                        branch, method=0)
+            if all(key in cached for key in keys):
+                retval = []
+                for key in keys:
+                    retval.extend(cached[key])
+                return retval
 
             # Do a big query to get everything
             builds = getBuilds(branch,
@@ -112,23 +426,15 @@ class BuildapiCache:
                     )
             retval = builds
 
-            # And then cache the results by date
+            # And then cache the results by date.  Pending requests don't
+            # have a starttime yet.
             days = {}
             for b in builds:
-                date = ts2dt(b['starttime'], self.timezone)
+                date = ts2dt(b.get('starttime', b.get('submittime')),
+                        self.timezone)
                 date = date.replace(hour=0, minute=0, second=0, microsecond=0)
 
                 days.setdefault(date, []).append(b)
-
-            for date, builds in days.iteritems():
-                if date - now(self.timezone) < 3*oneday:
-                    # Expire soon
-                    expire = time.time() + 60
-                else:
-                    # Expire in half an hour
-                    expire = time.time() + 1800
-                key = self.build_key_for_day(date, branch)
-                self.cache.put(key, builds, expire=expire)
+            self._put_days(branch, days.items())
 
             return retval
-
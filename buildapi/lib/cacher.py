@@ -1,5 +1,13 @@
+import errno
+import os
+import re
+import tempfile
 import threading
 import time
+import urllib
+import uuid
+import zlib
+from collections import OrderedDict
 try:
     import simplejson as json
 except ImportError:
@@ -8,61 +16,720 @@ except ImportError:
 import logging
 log = logging.getLogger(__name__)
 
+# Returned by _get() when a key isn't in the cache.  Using a sentinel rather
+# than None lets us cache None, and means a lookup needs only one round trip
+# to the backend.
+MISSING = object()
+
+def expiry(expire, val):
+    """Expiry times passed to get() and get_stale() may be functions of the
+    value being cached, so callers can decide how long to keep a value once
+    they've seen it"""
+    if callable(expire):
+        return expire(val)
+    return expire
+
+_day_re = re.compile(r'^builds:.*:\d{4}-\d{2}-\d{2}$')
+
+def key_family(key):
+    """Groups keys for CacheStats: builds:<branch>:<day> keys are counted as
+    builds:day, builds:<branch>:<revision> as builds:revision, and anything
+    else by its first component.  The :fresh, :state, :revs and :lock keys
+    that go with a key are counted separately, e.g. as builds:day:fresh."""
+    suffix = ''
+    for s in (':fresh', ':state', ':revs', ':lock'):
+        if key.endswith(s):
+            key = key[:-len(s)]
+            suffix = s
+            break
+    if key.startswith('builds:'):
+        if _day_re.match(key):
+            family = 'builds:day'
+        else:
+            family = 'builds:revision'
+    else:
+        family = key.split(':', 1)[0]
+    return family + suffix
+
+class CacheStats(object):
+    """Counts hits, misses, stale hits, backend errors and bytes read and
+    written per key family, along with histograms of how long lookups and
+    fills take"""
+    # Upper bounds, in seconds, of the histogram buckets
+    buckets = (0.001, 0.01, 0.1, 1, 10, 60)
+    counters = ('hits', 'misses', 'stale', 'errors', 'bytes_read',
+            'bytes_written')
+
+    def __init__(self):
+        self.mutex = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.mutex:
+            self.families = {}
+
+    def _family(self, family):
+        f = self.families.get(family)
+        if f is None:
+            f = self.families[family] = dict.fromkeys(self.counters, 0)
+        return f
+
+    def incr(self, key, counter, n=1):
+        with self.mutex:
+            self._family(key_family(key))[counter] += n
+
+    def timing(self, key, what, seconds):
+        """Records that a lookup (what='get') or fill (what='fill') of key
+        took seconds"""
+        with self.mutex:
+            f = self._family(key_family(key))
+            h = f.get(what)
+            if h is None:
+                h = f[what] = {'count': 0, 'total': 0.0,
+                        'buckets': [0] * (len(self.buckets) + 1)}
+            h['count'] += 1
+            h['total'] += seconds
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    break
+            else:
+                i = len(self.buckets)
+            h['buckets'][i] += 1
+
+    def snapshot(self):
+        """Returns the stats so far as a dictionary of family -> stats,
+        suitable for JSON"""
+        bounds = [str(b) for b in self.buckets] + ['inf']
+        with self.mutex:
+            retval = {}
+            for family, f in self.families.iteritems():
+                retval[family] = d = {}
+                for k, v in f.iteritems():
+                    if isinstance(v, dict):
+                        v = {'count': v['count'], 'total': v['total'],
+                                'buckets': dict(zip(bounds, v['buckets']))}
+                    d[k] = v
+            return retval
+
+# Shared by every cache in this process
+stats = CacheStats()
+
+# Codecs turn values into the strings stored in redis or memcached.  Every
+# codec other than plain JSON tags its output, and decode() looks at the tags,
+# so values written with any codec can always be read back.  That lets the
+# codec be changed without flushing the cache.
+class JsonCodec(object):
+    def encode(self, val):
+        return json.dumps(val)
+
+class ColumnarCodec(object):
+    """Stores each distinct set of dictionary keys once, rather than once per
+    dictionary.  This shrinks lists of builds, which repeat the same keys
+    thousands of times, a lot.
+
+    Dictionaries are encoded as lists whose first element is an index into
+    the table of key sets and whose remaining elements are the values, and
+    lists are encoded as {"l": [items]}, so the two can't be confused."""
+    tag = 'c:'
+
+    def encode(self, val):
+        shapes = {}
+        packed = self.pack(val, shapes)
+        shapes = sorted(shapes, key=shapes.get)
+        return self.tag + json.dumps([shapes, packed], separators=(',', ':'))
+
+    def pack(self, val, shapes):
+        if isinstance(val, dict):
+            keys = tuple(val)
+            shape = shapes.setdefault(keys, len(shapes))
+            return [shape] + [self.pack(val[k], shapes) for k in keys]
+        if isinstance(val, (list, tuple)):
+            return {'l': [self.pack(v, shapes) for v in val]}
+        return val
+
+    def decode(self, data):
+        shapes, packed = json.loads(data)
+        return self.unpack(packed, shapes)
+
+    def unpack(self, val, shapes):
+        if isinstance(val, list):
+            keys = shapes[val[0]]
+            return dict(zip(keys, [self.unpack(v, shapes) for v in val[1:]]))
+        if isinstance(val, dict):
+            return [self.unpack(v, shapes) for v in val['l']]
+        return val
+
+class ZlibCodec(object):
+    """Compresses the output of another codec.  Values that encode to fewer
+    than min_size bytes are left alone, since they don't shrink much."""
+    tag = 'z:'
+
+    def __init__(self, codec=None, level=6, min_size=1024):
+        if codec is None:
+            codec = JsonCodec()
+        self.codec = codec
+        self.level = level
+        self.min_size = min_size
+
+    def encode(self, val):
+        data = self.codec.encode(val)
+        if len(data) < self.min_size:
+            return data
+        return self.tag + zlib.compress(data, self.level)
+
+codecs = {
+    'json': JsonCodec,
+    'columnar': ColumnarCodec,
+    'zlib': ZlibCodec,
+    'columnar+zlib': lambda: ZlibCodec(ColumnarCodec()),
+}
+
+def get_codec(name):
+    try:
+        return codecs[name]()
+    except KeyError:
+        raise RuntimeError("invalid cache codec %r" % (name,))
+
+def decode(data):
+    """Decodes a value stored with any of the codecs"""
+    if data.startswith(ZlibCodec.tag):
+        return decode(zlib.decompress(data[len(ZlibCodec.tag):]))
+    if data.startswith(ColumnarCodec.tag):
+        return ColumnarCodec().decode(data[len(ColumnarCodec.tag):])
+    return json.loads(data)
+
 class BaseCache:
+    # How long (in seconds) a caller that lost the race to fill a key will
+    # wait for the winner before computing the value itself, and how often it
+    # checks for the value while waiting.
+    lock_wait = 10
+    lock_poll = 0.1
+    stats = stats
+
+    def __init__(self):
+        # use a thread-local object for holding locks, so that different
+        # threads can use locks without stepping on feet
+        self.local = threading.local()
+        # keys being refreshed in the background by this process
+        self.refreshing = set()
+        self.refresh_mutex = threading.Lock()
+
     def has_key(self, key):
         raise NotImplementedError()
 
+    def has_keys(self, keys):
+        """Returns a list of booleans saying whether each of keys is in the
+        cache.  Backends override this to check all the keys in one round
+        trip."""
+        return [self.has_key(key) for key in keys]
+
+    def lock_key(self, key):
+        return "%s:lock" % key
+
+    def _acquire_lock(self, lock_key, lock_time):
+        # Backends without a shared lock let every caller fill the key
+        return True
+
+    def _release_lock(self, lock_key):
+        pass
+
     def get(self, key, func, args=None, kwargs=None, expire=0, lock_time=600):
         if args is None:
             args = ()
         if kwargs is None:
             kwargs = {}
 
-        # note that in a "thundering herd" situation, this may generate the
-        # same cached value several times.  That's OK.
+        # In a "thundering herd" situation only the caller holding the fill
+        # lock generates the value; everybody else waits for it to show up in
+        # the cache.  The lock expires after lock_time seconds so a filler
+        # that dies doesn't wedge the key.
         try:
-            try:
-                return self._get(key)
-            except KeyError:
-                retval = func(*args, **kwargs)
-                self._put(key, retval, expire)
+            start = time.time()
+            retval = self._get(key)
+            self.stats.timing(key, 'get', time.time() - start)
+            if retval is not MISSING:
+                self.stats.incr(key, 'hits')
                 return retval
+            self.stats.incr(key, 'misses')
+
+            lock_key = self.lock_key(key)
+            if self._acquire_lock(lock_key, lock_time):
+                return self._fill(key, lock_key, func, args, kwargs, expire)
+            return self._wait_for_fill(key, lock_key, func, args, kwargs,
+                    expire, lock_time)
         except Exception:
             log.exception("Problem with cache!")
+            self.stats.incr(key, 'errors')
             return func(*args, **kwargs)
 
+    def _fill(self, key, lock_key, func, args, kwargs, expire):
+        try:
+            start = time.time()
+            retval = func(*args, **kwargs)
+            self.stats.timing(key, 'fill', time.time() - start)
+            self._put(key, retval, expiry(expire, retval))
+            return retval
+        finally:
+            self._release_lock(lock_key)
+
+    def _wait_for_fill(self, key, lock_key, func, args, kwargs, expire,
+            lock_time):
+        deadline = time.time() + min(lock_time, self.lock_wait)
+        while time.time() < deadline:
+            time.sleep(self.lock_poll)
+            retval = self._get(key)
+            if retval is not MISSING:
+                return retval
+            # The filler may have given up without storing anything, or its
+            # lock may have expired; if so, take over
+            if self._acquire_lock(lock_key, lock_time):
+                return self._fill(key, lock_key, func, args, kwargs, expire)
+
+        log.warning("Timed out waiting for %s to be filled", key)
+        return func(*args, **kwargs)
+
     def put(self, key, val, expire=0):
         return self._put(key, val, expire)
 
+    def fresh_key(self, key):
+        return "%s:fresh" % key
+
+    def get_stale(self, key, func, args=None, kwargs=None, stale_after=0,
+            expire=0, lock_time=600):
+        """Like get(), but once stale_after has passed, callers keep getting
+        the cached value until it expires while a single background thread
+        recomputes it.  Whether a value is fresh is tracked by a separate key
+        that expires at stale_after."""
+        return self.get_stale_status(key, func, args, kwargs, stale_after,
+                expire, lock_time)[0]
+
+    def get_stale_status(self, key, func, args=None, kwargs=None,
+            stale_after=0, expire=0, lock_time=600):
+        """Like get_stale(), but returns (value, fresh), where fresh is False
+        if the value is stale and being recomputed"""
+        if args is None:
+            args = ()
+        if kwargs is None:
+            kwargs = {}
+
+        fresh_key = self.fresh_key(key)
+        start = time.time()
+        found = self.get_many([key, fresh_key], count=False)
+        self.stats.timing(key, 'get', time.time() - start)
+        if key not in found:
+            def fill():
+                retval = func(*args, **kwargs)
+                self.put_many({fresh_key: True}, expiry(stale_after, retval))
+                return retval
+            # get() counts the miss
+            return self.get(key, fill, expire=expire,
+                    lock_time=lock_time), True
+
+        fresh = fresh_key in found
+        if fresh:
+            self.stats.incr(key, 'hits')
+        else:
+            self.stats.incr(key, 'stale')
+            self._start_refresh(key, func, args, kwargs, stale_after, expire,
+                    lock_time)
+        return found[key], fresh
+
+    def _start_refresh(self, key, func, args, kwargs, stale_after, expire,
+            lock_time):
+        with self.refresh_mutex:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+        t = threading.Thread(target=self._refresh, args=(key, func, args,
+            kwargs, stale_after, expire, lock_time))
+        t.daemon = True
+        t.start()
+
+    def _refresh(self, key, func, args, kwargs, stale_after, expire,
+            lock_time):
+        # Other processes may be refreshing the same key; only the one holding
+        # the fill lock does the work
+        try:
+            lock_key = self.lock_key(key)
+            if self._acquire_lock(lock_key, lock_time):
+                try:
+                    start = time.time()
+                    retval = func(*args, **kwargs)
+                    self.stats.timing(key, 'fill', time.time() - start)
+                    self._put(key, retval, expiry(expire, retval))
+                    self._put(self.fresh_key(key), True,
+                            expiry(stale_after, retval))
+                finally:
+                    self._release_lock(lock_key)
+        except Exception:
+            log.exception("Problem refreshing %s", key)
+            self.stats.incr(key, 'errors')
+        finally:
+            with self.refresh_mutex:
+                self.refreshing.discard(key)
+
+    def get_many(self, keys, count=True):
+        """Returns a dictionary of key -> value for those of keys which are in
+        the cache.  Backend errors are logged and treated as misses.  Unless
+        count is False, each key is counted as a hit or a miss."""
+        try:
+            retval = self._get_many(keys)
+        except Exception:
+            log.exception("Problem with cache!")
+            for key in keys:
+                self.stats.incr(key, 'errors')
+            retval = {}
+        if count:
+            for key in keys:
+                self.stats.incr(key, 'hits' if key in retval else 'misses')
+        return retval
+
+    def put_many(self, items, expire=0):
+        """Stores every key -> value in the items dictionary, all with the
+        same expiry time.  Backend errors are logged and ignored."""
+        try:
+            self._put_many(items, expire)
+        except Exception:
+            log.exception("Problem with cache!")
+            for key in items:
+                self.stats.incr(key, 'errors')
+
+    def delete_many(self, keys):
+        """Removes keys from the cache.  Backend errors are logged and
+        ignored."""
+        try:
+            if keys:
+                self._delete_many(keys)
+        except Exception:
+            log.exception("Problem with cache!")
+            for key in keys:
+                self.stats.incr(key, 'errors')
+
+    def _delete_many(self, keys):
+        raise NotImplementedError()
+
+    def _get_many(self, keys):
+        retval = {}
+        for key in keys:
+            val = self._get(key)
+            if val is not MISSING:
+                retval[key] = val
+        return retval
+
+    def _put_many(self, items, expire=0):
+        for key, val in items.iteritems():
+            self._put(key, val, expire)
+
+    def _new_lock_token(self, lock_key):
+        if not hasattr(self.local, 'locks'):
+            self.local.locks = {}
+        token = uuid.uuid4().hex
+        self.local.locks[lock_key] = token
+        return token
+
+    def _pop_lock_token(self, lock_key):
+        return getattr(self.local, 'locks', {}).pop(lock_key, None)
+
+def estimate_size(val, sample=8):
+    """Returns roughly how many bytes the JSON encoding of val takes.  Long
+    lists, such as lists of builds, are measured from a sample of their
+    items rather than encoded whole, so that sizing a value costs much less
+    than decoding it did."""
+    if isinstance(val, dict):
+        return 2 + sum(len(json.dumps(k)) + 4 + estimate_size(v, sample)
+                for (k, v) in val.iteritems())
+    if isinstance(val, (list, tuple)) and len(val) > sample:
+        items = val[::len(val) // sample][:sample]
+        return 2 + (len(json.dumps(items)) - 2) * len(val) // len(items)
+    return len(json.dumps(val))
+
+class LocalCache(BaseCache):
+    """A bounded LRU cache living in this process.  This is the memory:
+    backend, and the in-process tier of TieredCache.
+
+    Values are kept as-is rather than serialized, so callers must not modify
+    what they get back.  The cache holds roughly max_bytes worth of values,
+    measured by the size of their JSON encoding.  Expiry times are absolute
+    timestamps, as for the other caches; 0 means never expire.  Fill locks
+    only cover the threads of this process.  Sizes are estimated (see
+    estimate_size), as encoding every value would cost as much as the
+    decoding this cache saves."""
+    def __init__(self, max_bytes=64*1024*1024):
+        BaseCache.__init__(self)
+        self.max_bytes = max_bytes
+        self.size = 0
+        # key -> (expire, size, value), least recently used first
+        self.items = OrderedDict()
+        # lock key -> (expire, token)
+        self.locks = {}
+        self.mutex = threading.Lock()
+
+    def _get(self, key):
+        with self.mutex:
+            item = self.items.pop(key, None)
+            if item is None:
+                return MISSING
+            expire, size, val = item
+            if expire and expire <= time.time():
+                self.size -= size
+                return MISSING
+            self.items[key] = item
+            return val
+
+    def _put(self, key, val, expire=0):
+        size = estimate_size(val)
+        with self.mutex:
+            old = self.items.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            if size > self.max_bytes:
+                return
+            self.items[key] = (expire, size, val)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, old_size, _) = self.items.popitem(last=False)
+                self.size -= old_size
+
+    def has_key(self, key):
+        return self._get(key) is not MISSING
+
+    def _delete_many(self, keys):
+        with self.mutex:
+            for key in keys:
+                item = self.items.pop(key, None)
+                if item is not None:
+                    self.size -= item[1]
+
+    def _acquire_lock(self, lock_key, lock_time):
+        with self.mutex:
+            lock = self.locks.get(lock_key)
+            if lock is not None and lock[0] > time.time():
+                return False
+            token = self._new_lock_token(lock_key)
+            self.locks[lock_key] = (time.time() + lock_time, token)
+            return True
+
+    def _release_lock(self, lock_key):
+        token = self._pop_lock_token(lock_key)
+        with self.mutex:
+            # Only remove the lock if it's still ours
+            lock = self.locks.get(lock_key)
+            if token is not None and lock is not None and lock[1] == token:
+                del self.locks[lock_key]
+
+class TieredCache(BaseCache):
+    """Serves values out of a LocalCache when possible, and falls through to
+    a shared cache (e.g. RedisCache) on misses.  Values fetched from the
+    shared cache are kept locally until the expiry time given to get().
+
+    Deleting a key only removes it from this process's memory, so builds:
+    keys, which are deleted whenever a job changes them (see
+    BuildapiCache.job_done), are kept locally for at most max_local_age
+    seconds; other processes would otherwise go on serving the old builds
+    until they expire.  Values that never expire (the builds of frozen days)
+    won't change any more, and are kept for as long as there is room."""
+    def __init__(self, shared, memory, max_local_age=5):
+        BaseCache.__init__(self)
+        self.shared = shared
+        self.memory = memory
+        self.max_local_age = max_local_age
+
+    def local_expiry(self, key, expire):
+        """Returns when the copy of key kept in memory should expire"""
+        if self.max_local_age is None or not expire or \
+                not key.startswith('builds:'):
+            return expire
+        return min(expire, time.time() + self.max_local_age)
+
+    def get(self, key, func, args=None, kwargs=None, expire=0, lock_time=600):
+        retval = self.memory._get(key)
+        if retval is not MISSING:
+            self.stats.incr(key, 'hits')
+            return retval
+        retval = self.shared.get(key, func, args, kwargs, expire, lock_time)
+        self.memory._put(key, retval,
+                self.local_expiry(key, expiry(expire, retval)))
+        return retval
+
+    def get_stale_status(self, key, func, args=None, kwargs=None,
+            stale_after=0, expire=0, lock_time=600):
+        # The shared cache takes care of refreshing stale values; we only keep
+        # fresh values, and only until they go stale.  Keeping a stale value
+        # would have us serve it until stale_after has passed again, long
+        # after the shared cache has been refreshed.
+        retval = self.memory._get(key)
+        if retval is not MISSING:
+            self.stats.incr(key, 'hits')
+            return retval, True
+        retval, fresh = self.shared.get_stale_status(key, func, args, kwargs,
+                stale_after, expire, lock_time)
+        if fresh:
+            self.memory._put(key, retval,
+                    self.local_expiry(key, expiry(stale_after, retval)))
+        return retval, fresh
+
+    def _get(self, key):
+        retval = self.memory._get(key)
+        if retval is MISSING:
+            retval = self.shared._get(key)
+        return retval
+
+    def _put(self, key, val, expire=0):
+        self.shared._put(key, val, expire)
+        self.memory._put(key, val, self.local_expiry(key, expire))
+
+    def has_key(self, key):
+        return self.memory.has_key(key) or self.shared.has_key(key)
+
+    def _get_many(self, keys):
+        retval = self.memory._get_many(keys)
+        missing = [key for key in keys if key not in retval]
+        if missing:
+            retval.update(self.shared._get_many(missing))
+        return retval
+
+    def _put_many(self, items, expire=0):
+        self.shared._put_many(items, expire)
+        for key, val in items.items():
+            self.memory._put(key, val, self.local_expiry(key, expire))
+
+    def _delete_many(self, keys):
+        self.shared._delete_many(keys)
+        self.memory._delete_many(keys)
+
+    def has_keys(self, keys):
+        retval = [self.memory.has_key(key) for key in keys]
+        missing = [i for i, found in enumerate(retval) if not found]
+        if missing:
+            shared = self.shared.has_keys([keys[i] for i in missing])
+            for i, found in zip(missing, shared):
+                retval[i] = found
+        return retval
+
+class DiskStore(object):
+    """Keeps values that will never change in files under path, one per key,
+    so that they survive the shared cache being flushed.  Several processes
+    may share the same path."""
+    def __init__(self, path, codec=None):
+        if codec is None:
+            codec = ZlibCodec()
+        self.path = path
+        self.codec = codec
+        try:
+            os.makedirs(path)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def filename(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return os.path.join(self.path, urllib.quote(key, safe=''))
+
+    def get(self, key):
+        try:
+            f = open(self.filename(key), 'rb')
+        except IOError:
+            return MISSING
+        try:
+            try:
+                return decode(f.read())
+            finally:
+                f.close()
+        except Exception:
+            log.exception("Couldn't read %s from %s", key, self.path)
+            return MISSING
+
+    def put(self, key, val):
+        filename = self.filename(key)
+        if os.path.exists(filename):
+            # It can't have changed
+            return
+        # Write to a temporary file first, so readers never see half a value
+        fd, tmp = tempfile.mkstemp(dir=self.path)
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                f.write(self.codec.encode(val))
+            finally:
+                f.close()
+            os.rename(tmp, filename)
+        except Exception:
+            log.exception("Couldn't write %s to %s", key, self.path)
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+
 try:
     import redis.client
     class RedisCache(BaseCache):
-        def __init__(self, host='localhost', port=6379):
+        def __init__(self, host='localhost', port=6379, codec=None):
+            BaseCache.__init__(self)
             self.r = redis.client.Redis(host, port)
-            # use a thread-local object for holding locks, so that different
-            # threads can use locks without stepping on feet
-            self.local = threading.local()
+            self.codec = codec or JsonCodec()
 
         def _get(self, key):
-            if not self.has_key(key):
-                raise KeyError
-
             retval = self.r.get(key)
-            if retval is not None:
-                return json.loads(retval)
-            return None
+            if retval is None:
+                return MISSING
+            self.stats.incr(key, 'bytes_read', len(retval))
+            return decode(retval)
 
         def _put(self, key, val, expire=0):
-            val = json.dumps(val)
+            self._queue_put(self.r, key, val, expire)
+
+        def _queue_put(self, r, key, val, expire):
+            val = self.codec.encode(val)
+            self.stats.incr(key, 'bytes_written', len(val))
             if expire == 0:
-                self.r.set(key, val)
+                r.set(key, val)
             else:
                 expire = int(expire - time.time())
-                self.r.setex(key, val, expire)
+                r.setex(key, val, expire)
+
+        def _get_many(self, keys):
+            if not keys:
+                return {}
+            retval = {}
+            for key, val in zip(keys, self.r.mget(keys)):
+                if val is not None:
+                    self.stats.incr(key, 'bytes_read', len(val))
+                    retval[key] = decode(val)
+            return retval
+
+        def _put_many(self, items, expire=0):
+            p = self.r.pipeline(transaction=False)
+            for key, val in items.iteritems():
+                self._queue_put(p, key, val, expire)
+            p.execute()
 
         def has_key(self, key):
             return self.r.exists(key)
 
+        def _delete_many(self, keys):
+            self.r.delete(*keys)
+
+        def has_keys(self, keys):
+            p = self.r.pipeline(transaction=False)
+            for key in keys:
+                p.exists(key)
+            return [bool(found) for found in p.execute()]
+
+        def _acquire_lock(self, lock_key, lock_time):
+            token = self._new_lock_token(lock_key)
+            if self.r.set(lock_key, token, ex=int(lock_time), nx=True):
+                return True
+            self._pop_lock_token(lock_key)
+            return False
+
+        def _release_lock(self, lock_key):
+            token = self._pop_lock_token(lock_key)
+            # Only remove the lock if it's still ours; it may have expired and
+            # been taken by somebody else in the meantime
+            if token is not None and self.r.get(lock_key) == token:
+                self.r.delete(lock_key)
+
 except ImportError:
     pass
 
@@ -74,18 +741,21 @@ try:
         return s
 
     class MemcacheCache(BaseCache):
-        def __init__(self, hosts=['localhost:11211']):
+        def __init__(self, hosts=['localhost:11211'], codec=None):
+            BaseCache.__init__(self)
             self.m = memcache.Client(hosts)
+            self.codec = codec or JsonCodec()
 
         def _get(self, key):
             retval = self.m.get(utf8(key))
             if retval is None:
-                raise KeyError
-            else:
-                return json.loads(retval)
+                return MISSING
+            self.stats.incr(key, 'bytes_read', len(retval))
+            return decode(retval)
 
         def _put(self, key, val, expire=0):
-            val = json.dumps(val)
+            val = self.codec.encode(val)
+            self.stats.incr(key, 'bytes_written', len(val))
             if expire == 0:
                 self.m.set(utf8(key), val)
             else:
@@ -95,5 +765,48 @@ try:
         def has_key(self, key):
             return self.m.get(utf8(key)) is not None
 
+        def _delete_many(self, keys):
+            self.m.delete_multi([utf8(key) for key in keys])
+
+        def _get_many(self, keys):
+            found = self.m.get_multi([utf8(key) for key in keys])
+            retval = {}
+            for key in keys:
+                val = found.get(utf8(key))
+                if val is not None:
+                    self.stats.incr(key, 'bytes_read', len(val))
+                    retval[key] = decode(val)
+            return retval
+
+        def _put_many(self, items, expire=0):
+            mapping = {}
+            for key, val in items.iteritems():
+                val = self.codec.encode(val)
+                self.stats.incr(key, 'bytes_written', len(val))
+                mapping[utf8(key)] = val
+            if expire == 0:
+                self.m.set_multi(mapping)
+            else:
+                self.m.set_multi(mapping, int(expire - time.time()))
+
+        def has_keys(self, keys):
+            # memcache has no way to test for a key without fetching it, but
+            # at least we can fetch them all at once
+            found = self.m.get_multi([utf8(key) for key in keys])
+            return [utf8(key) in found for key in keys]
+
+        def _acquire_lock(self, lock_key, lock_time):
+            token = self._new_lock_token(lock_key)
+            # add() only succeeds if the key doesn't exist yet
+            if self.m.add(utf8(lock_key), token, int(lock_time)):
+                return True
+            self._pop_lock_token(lock_key)
+            return False
+
+        def _release_lock(self, lock_key):
+            token = self._pop_lock_token(lock_key)
+            if token is not None and self.m.get(utf8(lock_key)) == token:
+                self.m.delete(utf8(lock_key))
+
 except ImportError:
     pass
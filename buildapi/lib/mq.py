@@ -134,7 +134,10 @@ class JobRequestPublisher(ReliablePublisher):
     """For publishing job requests"""
     routing_key = 'requests'
 
-    def send_msg(self, action, who, **kwargs):
+    def send_msg(self, action, who, watch=None, **kwargs):
+        """Sends the job request action for who, with kwargs as its body.
+        Publishers that record requests call watch, if given, with the id of
+        the request before sending it (see LoggingJobRequestPublisher)."""
         msg = {'action': action,
                'who': who,
                'body': kwargs.copy(),
@@ -142,39 +145,40 @@ class JobRequestPublisher(ReliablePublisher):
         log.info("Sending %s", msg)
         self.send(message_data=msg)
 
-    def reprioritizeRequest(self, who, brid, priority):
-        return self.send_msg('reprioritize', who=who, brid=brid, priority=priority)
+    def reprioritizeRequest(self, who, brid, priority, watch=None):
+        return self.send_msg('reprioritize', who=who, brid=brid, priority=priority, watch=watch)
 
-    def cancelRequest(self, who, brid):
-        return self.send_msg('cancel_request', who=who, brid=brid)
+    def cancelRequest(self, who, brid, watch=None):
+        return self.send_msg('cancel_request', who=who, brid=brid, watch=watch)
 
-    def cancelBuild(self, who, bid):
-        return self.send_msg('cancel_build', who=who, bid=bid)
+    def cancelBuild(self, who, bid, watch=None):
+        return self.send_msg('cancel_build', who=who, bid=bid, watch=watch)
 
-    def rebuildBuild(self, who, bid, priority, count):
-        return self.send_msg('rebuild_build', who=who, bid=bid, priority=priority, count=count)
+    def rebuildBuild(self, who, bid, priority, count, watch=None):
+        return self.send_msg('rebuild_build', who=who, bid=bid, priority=priority, count=count, watch=watch)
 
-    def rebuildRequest(self, who, brid, priority, count):
-        return self.send_msg('rebuild_request', who=who, brid=brid, priority=priority, count=count)
+    def rebuildRequest(self, who, brid, priority, count, watch=None):
+        return self.send_msg('rebuild_request', who=who, brid=brid, priority=priority, count=count, watch=watch)
 
-    def cancelRevision(self, who, branch, revision):
-        return self.send_msg('cancel_revision', who=who, branch=branch, revision=revision)
+    def cancelRevision(self, who, branch, revision, watch=None):
+        return self.send_msg('cancel_revision', who=who, branch=branch, revision=revision, watch=watch)
 
-    def newBuildAtRevision(self, who, branch, revision):
-        return self.send_msg('new_build_at_revision', who=who, branch=branch, revision=revision)
+    def newBuildAtRevision(self, who, branch, revision, watch=None):
+        return self.send_msg('new_build_at_revision', who=who, branch=branch, revision=revision, watch=watch)
 
-    def newPGOBuildAtRevision(self, who, branch, revision, priority):
-        return self.send_msg('new_pgobuild_at_revision', who=who, branch=branch, revision=revision, priority=priority)
+    def newPGOBuildAtRevision(self, who, branch, revision, priority, watch=None):
+        return self.send_msg('new_pgobuild_at_revision', who=who, branch=branch, revision=revision, priority=priority, watch=watch)
 
-    def newNightlyAtRevision(self, who, branch, revision, priority):
-        return self.send_msg('new_nightly_at_revision', who=who, branch=branch, revision=revision, priority=priority)
+    def newNightlyAtRevision(self, who, branch, revision, priority, watch=None):
+        return self.send_msg('new_nightly_at_revision', who=who, branch=branch, revision=revision, priority=priority, watch=watch)
 
     def newBuildForBuilder(self, who, branch, revision, priority, builder_name,
-                           properties, files):
+                           properties, files, watch=None):
         return self.send_msg('new_build_for_builder', who=who, branch=branch,
                              revision=revision, priority=priority,
                              builder_name=builder_name, properties=properties,
-                             files=files)
+                             files=files,
+                             watch=watch)
 
 
 class JobRequestConsumer(ReliableConsumer):
@@ -202,11 +206,14 @@ class JobRequestDonePublisher(ReliablePublisher):
 
 class LoggingJobRequestDoneConsumer(JobRequestDoneConsumer):
     """For webapp to get notified that jobs have been completed, and update job
-    status in DB."""
+    status in DB.  If buildapi_cache (a BuildapiCache) is set, the cached
+    builds affected by each completed job are invalidated too."""
 
     # For testing, so we can override what time it is
     _clock = time.time
 
+    buildapi_cache = None
+
     def __init__(self, engine, *args, **kwargs):
         JobRequestDoneConsumer.__init__(self, *args, **kwargs)
         self.engine = engine
@@ -227,6 +234,8 @@ class LoggingJobRequestDoneConsumer(JobRequestDoneConsumer):
                 r.completed_at = now
                 r.complete_data = json.dumps(message_data)
                 s.commit()
+            if self.buildapi_cache:
+                self.buildapi_cache.job_done(message_data['request_id'])
             message.ack()
         except:
             log.exception("Unable to process message %s", message_data)
@@ -243,12 +252,15 @@ class LoggingJobRequestPublisher(JobRequestPublisher):
         self.engine = engine
         self.session = sessionmaker(bind=engine)
 
-    def send_msg(self, action, who, **kwargs):
+    def send_msg(self, action, who, watch=None, **kwargs):
         """Wrap JobRequestPublisher.send_msg by first logging the request in
-        the DB, and then sending the message to the broker."""
+        the DB, and then sending the message to the broker.  watch is called
+        with the request's id in between, so that whatever it sets up is in
+        place before the request can possibly complete."""
         try:
             what = json.dumps(kwargs)
-            when = self._clock()
+            # jobrequests.when is a whole number of seconds
+            when = int(self._clock())
             r = buildapidb.JobRequest(action=action, who=who, when=when, what=what)
             s = self.session()
             s.add(r)
@@ -257,6 +269,12 @@ class LoggingJobRequestPublisher(JobRequestPublisher):
             log.exception("Couldn't create JobRequest row")
             return {"status": "FAILED", "msg": "Couldn't create JobRequest row"}
 
+        if watch:
+            try:
+                watch(r.id)
+            except:
+                log.exception("Couldn't watch JobRequest %s", r.id)
+
         try:
             JobRequestPublisher.send_msg(self, action, who, when=r.when,
                     request_id=r.id, **kwargs)
@@ -0,0 +1,33 @@
+"""Cursors for paging through listings by key (keyset pagination).
+
+A page of a listing sorted on some columns is fetched by asking for the rows
+that sort after the last row of the previous page, rather than by skipping
+an offset's worth of rows, so that the database can go straight to the
+start of the page through an index.  The cursor handed to clients for the
+next page holds the values of the sort columns of the last row; clients
+should treat it as opaque."""
+import base64
+import binascii
+
+from buildapi.lib import json
+
+
+def encode_cursor(*values):
+    """Returns the cursor for a page starting after a row with the sort
+    column values given"""
+    return base64.urlsafe_b64encode(json.dumps(values)).rstrip('=')
+
+
+def decode_cursor(cursor, count):
+    """Returns the list of count sort column values held in cursor.  Raises
+    ValueError if cursor isn't one encode_cursor made out of count values."""
+    try:
+        cursor = str(cursor)
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(data)
+    except (TypeError, ValueError, UnicodeError, binascii.Error):
+        raise ValueError("Bad cursor %r" % cursor)
+    if not isinstance(values, list) or len(values) != count or \
+            not all(isinstance(v, (int, long)) for v in values):
+        raise ValueError("Bad cursor %r" % cursor)
+    return values
@@ -0,0 +1,171 @@
+"""Maps the short branch names used in URLs (e.g. 'mozilla-central') to the
+branch strings the scheduler DB records for them (e.g.
+'mozilla-central', 'mozilla-central-android', 'releases/mozilla-beta').
+
+Matching short names with LIKE '%name' or LIKE '%name%' can't use an index,
+so every query scans the table.  Instead, the distinct branch strings of a
+table are read once, kept up to date by reading only the rows added since,
+and a short name is resolved to the list of matching strings, to be used in
+an IN (...) against the indexed branch column.
+
+Filters for queries about a period the index may not have seen all of (up to
+now, usually) refresh it first, so that a branch string first used seconds
+ago (e.g. the first <branch>-selfserve sourcestamp) isn't left out.  Reading
+the index the first time scans the whole table, so it is done in the
+background; until it's done, and for short names matching nothing, the
+filters fall back to LIKE."""
+import threading
+import time
+
+from sqlalchemy import text, or_
+
+import buildapi.model.meta as meta
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class BranchIndex(object):
+    """The distinct values of the branch column of table, whose
+    monotonically increasing primary key is id_column"""
+    # Look for new branch strings at most this often, in seconds, when
+    # matching without a filter
+    refresh_interval = 30
+    # Forget the memoized matches once there are this many
+    max_memo = 10000
+
+    def __init__(self, bind, table, id_column='id', branch_column='branch'):
+        self.bind = bind
+        self.table = table
+        self.query = text("SELECT %(branch)s, MAX(%(id)s) FROM %(table)s "
+                          "WHERE %(id)s > :last_id GROUP BY %(branch)s" %
+                          dict(table=table, id=id_column,
+                               branch=branch_column))
+        self.names = frozenset()
+        self.last_id = 0
+        # When the last refresh started
+        self.refreshed_at = None
+        self.memo = {}
+        self.lock = threading.Lock()
+        self.loader = None
+        self.loader_lock = threading.Lock()
+
+    def _stale(self):
+        return self.refreshed_at is None or \
+            time.time() - self.refreshed_at >= self.refresh_interval
+
+    def refresh(self, force=True, since=None):
+        """Reads the branch strings of the rows added since the last
+        refresh.  Unless force is set, does nothing if the last refresh
+        was less than refresh_interval seconds ago.  If since is given, does
+        nothing if the last refresh started after since."""
+        with self.lock:
+            if not force and not self._stale():
+                return
+            if since is not None and self.refreshed_at is not None and \
+                    self.refreshed_at > since:
+                return
+            started = time.time()
+            names = set(self.names)
+            last_id = self.last_id
+            for name, max_id in self.bind.execute(self.query,
+                                                  last_id=self.last_id):
+                if name:
+                    names.add(name)
+                last_id = max(last_id, max_id)
+            if names != self.names:
+                self.names = frozenset(names)
+                self.memo = {}
+            self.last_id = last_id
+            self.refreshed_at = started
+
+    def _load(self):
+        try:
+            self.refresh(force=False)
+        except Exception:
+            log.exception("Couldn't read the branches of %s", self.table)
+        finally:
+            self.loader = None
+
+    def ready(self):
+        """Returns whether the index has been read.  If it hasn't, starts
+        reading it in the background."""
+        if self.refreshed_at is not None:
+            return True
+        with self.loader_lock:
+            if self.loader is None:
+                self.loader = threading.Thread(target=self._load)
+                self.loader.daemon = True
+                self.loader.start()
+        return False
+
+    def _match(self, kind, branch, matches):
+        if self._stale():
+            self.refresh(force=False)
+
+        key = (kind, branch)
+        retval = self.memo.get(key)
+        if retval is None:
+            retval = sorted(n for n in self.names if matches(n))
+            if len(self.memo) >= self.max_memo:
+                self.memo = {}
+            self.memo[key] = retval
+        return retval
+
+    def affixed(self, branch):
+        """Returns the branch strings starting or ending with branch, like
+        LIKE 'branch%' OR LIKE '%branch' would match"""
+        return self._match('affixed', branch,
+                lambda n: n.startswith(branch) or n.endswith(branch))
+
+    def containing(self, branch):
+        """Returns the branch strings containing branch, like
+        LIKE '%branch%' would match"""
+        return self._match('containing', branch, lambda n: branch in n)
+
+    def _filter(self, column, names, like, endtime):
+        if not self.ready():
+            return like
+        now = time.time()
+        self.refresh(since=now if endtime is None else min(endtime, now))
+        names = names()
+        if not names:
+            return like
+        return column.in_(names)
+
+    def affixed_filter(self, column, branch, endtime=None):
+        """Returns a filter on column, this table's branch column, for the
+        branch strings starting or ending with branch, in rows added up to
+        endtime (or now)"""
+        return self._filter(column, lambda: self.affixed(branch),
+                or_(column.startswith(branch), column.endswith(branch)),
+                endtime)
+
+    def containing_filter(self, column, branch, endtime=None):
+        """Returns a filter on column, this table's branch column, for the
+        branch strings containing branch, in rows added up to endtime (or
+        now)"""
+        return self._filter(column, lambda: self.containing(branch),
+                column.contains(branch), endtime)
+
+
+# (bind, BranchIndex) per table, replaced when the scheduler DB changes
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def _get_index(table, id_column):
+    bind = meta.scheduler_db_meta.bind
+    with _indexes_lock:
+        entry = _indexes.get(table)
+        if entry is None or entry[0] is not bind:
+            entry = _indexes[table] = (bind, BranchIndex(bind, table,
+                                                         id_column))
+    return entry[1]
+
+def sourcestamp_branches():
+    """Returns the BranchIndex of sourcestamps.branch"""
+    return _get_index('sourcestamps', 'id')
+
+def change_branches():
+    """Returns the BranchIndex of changes.branch"""
+    return _get_index('changes', 'changeid')
@@ -12,6 +12,11 @@ class JobRequest(Base):
             #{},
             #)
 
+    # For paging through the most recent jobs first
+    __table_args__ = (
+            Index('jobrequests_when_id', 'when', 'id'),
+            )
+
     id = Column(Integer, primary_key=True)
 
     action = Column(String(20), nullable=False)
@@ -32,3 +37,21 @@ class JobRequest(Base):
                     completed_at=self.completed_at,
                     complete_data=(json.loads(self.complete_data) if self.complete_data else self.complete_data),
                     what=json.loads(self.what))
+
+class Builder(Base):
+    """A buildername seen in the scheduler DB's buildrequests, and how it
+    classifies.  Kept up to date by buildapi.model.catalog."""
+    __tablename__ = 'builder_catalog'
+
+    id = Column(Integer, primary_key=True)
+
+    buildername = Column(String(255), nullable=False, index=True,
+            unique=True)
+    first_seen = Column(Integer, nullable=False) # epoch timestamp
+    last_seen = Column(Integer, nullable=False) # epoch timestamp
+    # The highest buildrequests.id read for this builder
+    last_brid = Column(Integer, nullable=False)
+
+    platform = Column(String(64))
+    build_type = Column(String(64))
+    job_type = Column(String(64))
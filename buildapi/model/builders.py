@@ -7,7 +7,7 @@ from buildapi.model.util import PENDING, RUNNING, NO_RESULT, SUCCESS, \
 WARNINGS, FAILURE, SKIPPED, EXCEPTION, RETRY
 from buildapi.model.util import BUILDERS_DETAIL_LEVELS
 from buildapi.model.util import get_time_interval, get_platform, \
-get_build_type, get_job_type
+get_build_type, get_job_type, stream_results, adapt_rows
 
 def BuildersQuery(starttime, endtime, branch_name):
     """Constructs the sqlalchemy query for fetching all build requests in the 
@@ -58,16 +58,14 @@ def GetBuildersReport(starttime=None, endtime=None,
     detail_level_no = BUILDERS_DETAIL_LEVELS.index(detail_level) + 1
 
     q = BuildersQuery(starttime, endtime, branch_name)
-    q_results = q.execute()
+    q_results = stream_results(q)
 
     report = BuildersReport(starttime, endtime, branch_name, 
         detail_level=detail_level_no)
     report.set_filters(dict(platform=platform, build_type=build_type, 
         job_type=job_type))
 
-    for r in q_results:
-        params = dict((str(k), v) for (k, v) in dict(r).items())
-        br = BuildRequest(**params)
+    for br in adapt_rows(q_results, BuildRequest):
         report.add(br)
 
     return report
@@ -87,13 +85,11 @@ def GetBuilderTypeReport(starttime=None, endtime=None, buildername=None):
     starttime, endtime = get_time_interval(starttime, endtime)
 
     q = BuildersTypeQuery(starttime, endtime, buildername)
-    q_results = q.execute()
+    q_results = stream_results(q)
 
     report = BuilderTypeReport(buildername=buildername, starttime=starttime, 
         endtime=endtime)
-    for r in q_results:
-        params = dict((str(k), v) for (k, v) in dict(r).items())
-        br = BuildRequest(**params)
+    for br in adapt_rows(q_results, BuildRequest):
         report.add(br)
 
     return report
@@ -5,7 +5,8 @@ from buildapi.model.util import PENDING, RUNNING, COMPLETE, CANCELLED, \
 INTERRUPTED, MISC
 from buildapi.model.util import NO_RESULT
 from buildapi.model.util import get_branch_name, get_platform, get_build_type, \
-get_job_type, get_revision, results_to_str, status_to_str
+get_job_type, get_revision, results_to_str, status_to_str, Record, lazy, \
+stream_results, adapt_rows
 
 def BuildRequestsQuery(revision=None, branch_name=None, starttime=None, 
     endtime=None, changeid_all=False):
@@ -120,22 +121,28 @@ def GetBuildRequests(revision=None, branch_name=None, starttime=None,
 
     q = BuildRequestsQuery(revision=revision, branch_name=branch_name, 
             starttime=starttime, endtime=endtime, changeid_all=changeid_all)
-    q_results = q.execute()
+    q_results = stream_results(q)
 
     build_requests = {}
-    for r in q_results:
-        params = dict((str(k), v) for (k, v) in dict(r).items())
-        brid, bid = params['brid'], params['bid']
+    for br in adapt_rows(q_results, BuildRequest):
+        brid, bid = br.brid, br.bid
 
         if (brid, bid) not in build_requests:
-            build_requests[(brid, bid)] = BuildRequest(**params)
+            build_requests[(brid, bid)] = br
         else:
-            build_requests[(brid, bid)].add_changeid(params['changeid'])
-            build_requests[(brid, bid)].add_author(params['author'])
+            build_requests[(brid, bid)].changeid.update(br.changeid)
+            build_requests[(brid, bid)].authors.update(br.authors)
 
     return build_requests
 
-class BuildRequest(object):
+class BuildRequest(Record):
+    __slots__ = ('number', 'brid', 'bid', 'branch', 'buildername', 'ssid',
+        'revision', 'changes_revision', 'changeid', 'when_timestamp',
+        'submitted_at', 'claimed_at', 'start_time', 'complete_at',
+        'finish_time', 'claimed_by_name', 'complete', 'reason', 'results',
+        'authors', 'comments', 'revlink', 'category', 'repository', 'project',
+        'buildsetid', '_branch_name', '_status', '_platform', '_build_type',
+        '_job_type')
 
     def __init__(self, author=None, bid=None, branch=None, brid=None,
         buildername=None, buildsetid=None, category=None, changeid=None,
@@ -148,7 +155,6 @@ class BuildRequest(object):
         self.brid = brid
         self.bid = bid      # build id
         self.branch = branch
-        self.branch_name = get_branch_name(branch)
         self.buildername = buildername
         self.ssid = ssid
         self.revision = get_revision(revision) # get at most the first 12 chars
@@ -175,11 +181,25 @@ class BuildRequest(object):
         self.project = project
         self.buildsetid = buildsetid
 
-        self.status = self._compute_status()
+    @lazy
+    def branch_name(self):
+        return get_branch_name(self.branch)
 
-        self.platform = get_platform(buildername)
-        self.build_type = get_build_type(buildername) # opt / debug
-        self.job_type = get_job_type(buildername)    # build / unittest / talos
+    @lazy
+    def platform(self):
+        return get_platform(self.buildername)
+
+    @lazy
+    def build_type(self):
+        return get_build_type(self.buildername) # opt / debug
+
+    @lazy
+    def job_type(self):
+        return get_job_type(self.buildername) # build / unittest / talos
+
+    @lazy
+    def status(self):
+        return self._compute_status()
 
     def _compute_status(self):
         # when_timestamp & submitted_at ?
@@ -2,6 +2,9 @@ import time
 
 from sqlalchemy import *
 import buildapi.model.meta as meta
+from buildapi.model.branches import sourcestamp_branches
+from buildapi.model.catalog import getCatalogBuilders
+from buildapi.model.replicas import execute_read
 from buildapi.lib import json
 
 import logging
@@ -41,24 +44,75 @@ def buildFromRow(row, requestProps=False):
         }
     return build
 
-def getRequestProperties(request_id):
-    # Get the properties for this request
+# How many ids to put in each IN (...) clause
+ID_CHUNK_SIZE = 500
+
+def _chunks(ids):
+    ids = list(ids)
+    for i in range(0, len(ids), ID_CHUNK_SIZE):
+        yield ids[i:i+ID_CHUNK_SIZE]
+
+def getRequestsProperties(request_ids):
+    """Returns a dictionary of request id -> properties for each of
+    request_ids, using one query per ID_CHUNK_SIZE requests"""
     br = meta.scheduler_db_meta.tables['buildrequests']
     bs = meta.scheduler_db_meta.tables['buildsets']
     bsp = meta.scheduler_db_meta.tables['buildset_properties']
 
-    props = bsp.select(and_(
-        bsp.c.buildsetid == bs.c.id,
-        bs.c.id == br.c.buildsetid,
-        br.c.id == request_id,
-        )).execute().fetchall()
-    return dict( (p.property_name, json.loads(p.property_value)[0]) for p in props)
+    retval = dict((request_id, {}) for request_id in request_ids)
+    for chunk in _chunks(retval):
+        q = select([br.c.id, bsp.c.property_name, bsp.c.property_value],
+                and_(
+                    bsp.c.buildsetid == bs.c.id,
+                    bs.c.id == br.c.buildsetid,
+                    br.c.id.in_(chunk),
+                    ))
+        for p in execute_read(q):
+            retval[p.id][p.property_name] = json.loads(p.property_value)[0]
+    return retval
+
+def getRequestProperties(request_id):
+    return getRequestsProperties([request_id])[request_id]
+
+def getRequestsBuildIds(request_ids):
+    """Returns a dictionary of request id -> list of the ids of its builds for
+    each of request_ids, using one query per ID_CHUNK_SIZE requests"""
+    b = meta.scheduler_db_meta.tables['builds']
+
+    retval = dict((request_id, []) for request_id in request_ids)
+    for chunk in _chunks(retval):
+        q = select([b.c.brid, b.c.id], b.c.brid.in_(chunk))
+        for row in execute_read(q.order_by(b.c.id)):
+            retval[row.brid].append(row.id)
+    return retval
+
+def addRequestProperties(builds):
+    """Returns a copy of builds, as returned by getBuilds or getRevision, with
+    the properties of every request included.  The builds themselves aren't
+    modified, since they may be shared with the cache."""
+    request_ids = []
+    for build in builds:
+        if 'requests' in build:
+            request_ids.extend(r['request_id'] for r in build['requests'])
+        else:
+            request_ids.append(build['request_id'])
+    props = getRequestsProperties(request_ids)
+
+    retval = []
+    for build in builds:
+        build = dict(build)
+        if 'requests' in build:
+            build['requests'] = [dict(r, properties=props[r['request_id']])
+                    for r in build['requests']]
+        else:
+            build['properties'] = props[build['request_id']]
+        retval.append(build)
+    return retval
 
 def getRequest(branch, request_id):
     br = meta.scheduler_db_meta.tables['buildrequests']
     bs = meta.scheduler_db_meta.tables['buildsets']
     ss = meta.scheduler_db_meta.tables['sourcestamps']
-    b = meta.scheduler_db_meta.tables['builds']
 
     q = select([
         bs.c.id.label('buildset_id'),
@@ -77,23 +131,17 @@ def getRequest(branch, request_id):
         br.c.complete_at,
         ])
     q = q.where(and_(br.c.buildsetid == bs.c.id, bs.c.sourcestampid==ss.c.id))
-    q = q.where(or_(
-            ss.c.branch.startswith(branch),
-            ss.c.branch.endswith(branch),
-    ))
+    q = q.where(sourcestamp_branches().affixed_filter(ss.c.branch, branch))
     q = q.where(br.c.id == request_id)
     q = q.limit(1)
-    req = q.execute().fetchone()
+    req = execute_read(q).fetchone()
     if not req:
         return None
     retval = requestFromRow(req)
 
-    # Get the properties for this request
-    retval['properties'] = getRequestProperties(request_id)
-
-    # Find build ids for this request
-    q = select([b], and_(b.c.brid == req.request_id))
-    retval['build_ids'] = [b.id for b in q.execute()]
+    # Get the properties and builds for this request
+    retval['properties'] = getRequestProperties(req.request_id)
+    retval['build_ids'] = getRequestsBuildIds([req.request_id])[req.request_id]
     return retval
 
 def getBuild(branch, build_id):
@@ -122,13 +170,10 @@ def getBuild(branch, build_id):
         br.c.complete_at,
         ])
     q = q.where(and_(br.c.id == b.c.brid, br.c.buildsetid == bs.c.id, bs.c.sourcestampid==ss.c.id))
-    q = q.where(or_(
-            ss.c.branch.startswith(branch),
-            ss.c.branch.endswith(branch),
-    ))
+    q = q.where(sourcestamp_branches().affixed_filter(ss.c.branch, branch))
     q = q.where(b.c.id == build_id)
     q = q.limit(1)
-    build = q.execute().fetchone()
+    build = execute_read(q).fetchone()
     if not build:
         return None
     return buildFromRow(build, requestProps=True)
@@ -165,10 +210,8 @@ def getBuildsQuery(branch, starttime=None, endtime=None, limit=None):
         bs.c.id == br.c.buildsetid,
         ss.c.id == bs.c.sourcestampid,
         ))
-    q = q.where(or_(
-            ss.c.branch.startswith(branch),
-            ss.c.branch.endswith(branch),
-    ))
+    q = q.where(sourcestamp_branches().affixed_filter(ss.c.branch, branch,
+        endtime))
     if starttime:
         q = q.where(b.c.start_time >= starttime)
     if endtime:
@@ -205,10 +248,8 @@ def getPendingQuery(branch, starttime=None, endtime=None, limit=None):
     q = q.where(and_(br.c.buildsetid == bs.c.id, bs.c.sourcestampid==ss.c.id))
     q = q.where(br.c.claimed_at == 0)
     q = q.where(br.c.complete == 0)
-    q = q.where(or_(
-            ss.c.branch.startswith(branch),
-            ss.c.branch.endswith(branch),
-    ))
+    q = q.where(sourcestamp_branches().affixed_filter(ss.c.branch, branch,
+        endtime))
     if starttime:
         q = q.where(br.c.submitted_at >= starttime)
     if endtime:
@@ -233,7 +274,7 @@ def getBuilds(branch, starttime=None, endtime=None, limit=None):
     # should only be represented once
     builds = {}
     for btype, q in ( ('running', running_builds), ('builds', old_builds) ):
-        for build in q.execute():
+        for build in execute_read(q):
             key = (build.claimed_by_name, build.claimed_by_incarnation, build.claimed_at, build.buildername, build.number)
             if key in builds:
                 request = requestFromRow(build)
@@ -243,7 +284,7 @@ def getBuilds(branch, starttime=None, endtime=None, limit=None):
                 retval[btype].append(builds[key])
 
     q = getPendingQuery(branch, starttime, endtime, limit)
-    for req in q.execute():
+    for req in execute_read(q):
         retval['pending'].append(requestFromRow(req))
 
     return retval
@@ -264,7 +305,7 @@ def getRevision(branch, revision, starttime=None, endtime=None, limit=None):
     # claimed_at, buildername, and number are actually the same build and
     # should only be represented once
     builds = {}
-    for build in build_q.execute():
+    for build in execute_read(build_q):
         key = (build.claimed_by_name, build.claimed_by_incarnation, build.claimed_at, build.buildername, build.number)
         if key in builds:
             request = requestFromRow(build)
@@ -275,7 +316,7 @@ def getRevision(branch, revision, starttime=None, endtime=None, limit=None):
 
     q = getPendingQuery(branch, starttime, endtime, limit)
     q = q.where(ss.c.revision.contains(revision))
-    for req in q.execute():
+    for req in execute_read(q):
         retval.append(requestFromRow(req))
 
     return retval
@@ -283,23 +324,83 @@ def getRevision(branch, revision, starttime=None, endtime=None, limit=None):
 def getBuilders(branch, starttime=None, endtime=None):
     """Returns a lits of builders available on branch between starttime and endtime.
 
-    If starttime and enddtime are None, default to two months ago to now"""
+    If starttime and enddtime are None, default to two months ago to now.
+    The builders come from the builder catalog, or from buildrequests if the
+    catalog hasn't been filled in yet."""
     br = meta.scheduler_db_meta.tables['buildrequests']
 
     if starttime is None and endtime is None:
         starttime = time.time() - 60*24*3600
         endtime = time.time()
 
+    builders = getCatalogBuilders(branch, starttime, endtime)
+    if builders is not None:
+        return builders
+
     q = select([br.c.buildername], and_(
         br.c.buildername.contains(branch),
         br.c.submitted_at >= starttime,
         br.c.submitted_at <= endtime,
         )).distinct()
 
-    return [row[0] for row in q.execute()]
+    return [row[0] for row in execute_read(q)]
 
-def getBuildsForUser(branch, user, starttime=None, endtime=None, limit=None):
-    br = meta.scheduler_db_meta.tables['buildrequests']
+def _pageOfBuilds(q, before=None, limit=None):
+    """Runs q, a getBuildsQuery, for the builds with ids below before, and
+    returns them as a list of running builds, a list of finished builds, and
+    the lowest build id seen if there may be more builds (limit rows came
+    back), None otherwise.
+
+    Pages are cut by builds.id, one row per build request, but rows are
+    grouped into builds by slave, start time, builder and build number.  A
+    build that ran for several requests can therefore have some of its
+    requests at the end of one page and the rest at the start of the next,
+    where it shows up again as a build of its own."""
+    b = meta.scheduler_db_meta.tables['builds']
+    if before:
+        q = q.where(b.c.id < before)
+
+    running, finished = [], []
+    builds = {}
+    rows = 0
+    last_id = None
+    for build in execute_read(q):
+        rows += 1
+        last_id = build.build_id
+        key = (build.claimed_by_name, build.claimed_by_incarnation, build.claimed_at, build.buildername, build.number)
+        if key in builds:
+            request = requestFromRow(build)
+            builds[key]['requests'].append(request)
+        else:
+            builds[key] = buildFromRow(build)
+            if build.complete == 0:
+                running.append(builds[key])
+            else:
+                finished.append(builds[key])
+
+    if not limit or rows < limit:
+        last_id = None
+    return running, finished, last_id
+
+def getBuildsPage(branch, before=None, limit=100):
+    """Returns the running and finished builds on branch, newest first,
+    limit build requests at most, starting with the builds whose ids are
+    below before.  Returns a tuple of the list of builds and the id to pass
+    as before to get the next page, or None on the last page.  A build with
+    several requests may be split across two pages (see _pageOfBuilds)."""
+    running, finished, last_id = _pageOfBuilds(
+            getBuildsQuery(branch, limit=limit), before, limit)
+    return running + finished, last_id
+
+def getBuildsForUser(branch, user, starttime=None, endtime=None, limit=None,
+        before=None):
+    """Returns the builds and pending requests on branch for changes made by
+    user.  Builds are returned newest first, limit build requests at most,
+    starting with the builds whose ids are below before; pending requests are
+    only returned on the first page (when before is None).  If there may be
+    more builds, the result's 'next' is what to pass as before to get them.
+    A build with several requests may be split across two pages (see
+    _pageOfBuilds)."""
     ss = meta.scheduler_db_meta.tables['sourcestamps']
     sc = meta.scheduler_db_meta.tables['sourcestamp_changes']
     c = meta.scheduler_db_meta.tables['changes']
@@ -311,22 +412,10 @@ def getBuildsForUser(branch, user, starttime=None, endtime=None, limit=None):
         sc.c.changeid == c.c.changeid,
         c.c.author == user,
         ))
-    running_builds = build_q.where(br.c.complete == 0)
-    old_builds = build_q.where(br.c.complete != 0)
-
-    # Elements with the same claimed_by_name, claimed_by_incarnation,
-    # claimed_at, buildername, and number are actually the same build and
-    # should only be represented once
-    builds = {}
-    for btype, q in ( ('running', running_builds), ('builds', old_builds) ):
-        for build in q.execute():
-            key = (build.claimed_by_name, build.claimed_by_incarnation, build.claimed_at, build.buildername, build.number)
-            if key in builds:
-                request = requestFromRow(build)
-                builds[key]['requests'].append(request)
-            else:
-                builds[key] = buildFromRow(build)
-                retval[btype].append(builds[key])
+    retval['running'], retval['builds'], retval['next'] = _pageOfBuilds(
+            build_q, before, limit)
+    if before:
+        return retval
 
     q = getPendingQuery(branch, starttime, endtime, limit)
     q = q.where(and_(
@@ -334,7 +423,7 @@ def getBuildsForUser(branch, user, starttime=None, endtime=None, limit=None):
         sc.c.changeid == c.c.changeid,
         c.c.author == user,
         ))
-    for req in q.execute():
+    for req in execute_read(q):
         retval['pending'].append(requestFromRow(req))
 
     return retval
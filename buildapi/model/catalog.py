@@ -0,0 +1,219 @@
+"""The builder catalog: every buildername seen in the scheduler DB's
+buildrequests, when it was first and last submitted, and its platform, build
+type and job type.  It lives in the buildapi DB (buildapidb.Builder), and is
+brought up to date by updateBuilderCatalog, which only reads the
+buildrequests added since its last run (see scripts/builder_catalog.py), so
+that listing a branch's builders doesn't need a DISTINCT over months of
+buildrequests.
+
+The catalog is only used while it is recent: if the newest buildrequest in it
+is more than CATALOG_MAX_AGE seconds old, the updater has probably stopped,
+and builders are looked up in buildrequests again."""
+import threading
+import time
+
+from sqlalchemy import select, and_, func, case
+from sqlalchemy.exc import IntegrityError
+
+import buildapi.model.meta as meta
+from buildapi.model.buildapidb import Builder
+from buildapi.model.util import get_platform, get_build_type, get_job_type
+
+import logging
+log = logging.getLogger(__name__)
+
+# How many buildrequests ids to read at once
+CATALOG_BATCH_SIZE = 100000
+
+# How many buildernames to put in each IN (...) clause
+NAME_CHUNK_SIZE = 500
+
+# How many buildrequests ids below the highest one already read to read
+# again, for buildrequests committed after others with higher ids
+CATALOG_RESCAN = 1000
+
+# How many times to try merging builders that another update is adding too
+MERGE_ATTEMPTS = 3
+
+# Look at how recent the catalog is at most this often, in seconds
+CATALOG_CHECK_INTERVAL = 60
+
+# Don't use the catalog for times more than this many seconds after its
+# newest buildrequest
+CATALOG_MAX_AGE = 6*3600
+
+def _classify(buildername):
+    return {
+        'platform': get_platform(buildername),
+        'build_type': get_build_type(buildername),
+        'job_type': get_job_type(buildername),
+        }
+
+def _least(column, value):
+    return case([(column > value, value)], else_=column)
+
+def _greatest(column, value):
+    return case([(column < value, value)], else_=column)
+
+def _mergeBuildersOnce(rows):
+    bc = Builder.__table__
+    names = [r[0] for r in rows]
+
+    existing = set()
+    for i in range(0, len(names), NAME_CHUNK_SIZE):
+        q = select([bc.c.buildername],
+            bc.c.buildername.in_(names[i:i+NAME_CHUNK_SIZE]))
+        existing.update(row[0] for row in q.execute())
+
+    conn = bc.bind.connect()
+    try:
+        trans = conn.begin()
+        new = []
+        for name, first_seen, last_seen, last_brid in rows:
+            first_seen = int(first_seen or 0)
+            last_seen = int(last_seen or 0)
+            if name not in existing:
+                b = dict(buildername=name, first_seen=first_seen,
+                    last_seen=last_seen, last_brid=last_brid)
+                b.update(_classify(name))
+                new.append(b)
+                continue
+            # Compared in the DB, so that updates running at the same time
+            # don't undo each other
+            conn.execute(bc.update().where(bc.c.buildername == name).values(
+                first_seen=_least(bc.c.first_seen, first_seen),
+                last_seen=_greatest(bc.c.last_seen, last_seen),
+                last_brid=_greatest(bc.c.last_brid, last_brid)))
+        if new:
+            conn.execute(bc.insert(), new)
+        trans.commit()
+    finally:
+        conn.close()
+
+def _mergeBuilders(rows):
+    """Adds rows of (buildername, first submitted_at, last submitted_at, last
+    buildrequests.id) to the catalog.  buildername is unique, so if another
+    update adds one of the new builders first, our insert fails, and we try
+    again, updating that builder instead."""
+    rows = [r for r in rows if r[0]]
+    for attempt in range(MERGE_ATTEMPTS):
+        try:
+            _mergeBuildersOnce(rows)
+            return
+        except IntegrityError:
+            if attempt == MERGE_ATTEMPTS - 1:
+                raise
+            log.debug("Builders were added by another update; trying again")
+
+def updateBuilderCatalog(batch_size=CATALOG_BATCH_SIZE):
+    """Adds the buildrequests made since the last update to the builder
+    catalog, batch_size buildrequests ids at a time.  The last CATALOG_RESCAN
+    ids read before are read again, in case some of them weren't committed
+    yet last time.  Returns the number of buildrequests ids beyond those read
+    before."""
+    global _catalog_state
+    br = meta.scheduler_db_meta.tables['buildrequests']
+    bc = Builder.__table__
+
+    start = select([func.max(bc.c.last_brid)]).scalar() or 0
+    end = select([func.max(br.c.id)]).scalar() or 0
+
+    last_brid = max(start - CATALOG_RESCAN, 0)
+    while last_brid < end:
+        upper = min(last_brid + batch_size, end)
+        q = select([br.c.buildername, func.min(br.c.submitted_at),
+            func.max(br.c.submitted_at), func.max(br.c.id)],
+            and_(br.c.id > last_brid, br.c.id <= upper))
+        q = q.group_by(br.c.buildername)
+        rows = q.execute().fetchall()
+        _mergeBuilders(rows)
+        log.debug("Read buildrequests %i to %i: %i builders", last_brid + 1,
+            upper, len(rows))
+        last_brid = upper
+
+    _catalog_state = None
+    return max(end - start, 0)
+
+def reclassifyBuilders():
+    """Classifies every builder in the catalog again, e.g. after the
+    classification tables in buildapi.model.util changed.  Returns the number
+    of builders that changed."""
+    bc = Builder.__table__
+    changed = 0
+    q = select([bc.c.id, bc.c.buildername, bc.c.platform, bc.c.build_type,
+        bc.c.job_type])
+    for row in q.execute().fetchall():
+        classes = _classify(row.buildername)
+        if all(row[k] == v for (k, v) in classes.items()):
+            continue
+        bc.update().where(bc.c.id == row.id).values(**classes).execute()
+        changed += 1
+    return changed
+
+# (bind, when it was looked at, newest last_seen or None if it's empty)
+_catalog_state = None
+_catalog_state_lock = threading.Lock()
+
+def _catalogHighWater():
+    """Returns the submission time of the newest buildrequest in the
+    catalog, or None if the catalog hasn't been filled in yet.  The catalog
+    is looked at again at most every CATALOG_CHECK_INTERVAL seconds."""
+    global _catalog_state
+    bc = Builder.__table__
+    now = time.time()
+    with _catalog_state_lock:
+        state = _catalog_state
+        if state is None or state[0] is not bc.bind or \
+                now - state[1] >= CATALOG_CHECK_INTERVAL:
+            high_water = select([func.max(bc.c.last_seen)]).scalar()
+            if high_water is not None and \
+                    now - high_water > CATALOG_MAX_AGE:
+                log.warn("The builder catalog has no buildrequests since %s; "
+                    "is buildapi-builder-catalog running?", high_water)
+            state = _catalog_state = (bc.bind, now, high_water)
+    return state[2]
+
+def _catalogCovers(t):
+    """Returns whether the catalog is recent enough to list the builders
+    submitted to up to time t"""
+    high_water = _catalogHighWater()
+    return high_water is not None and t - high_water <= CATALOG_MAX_AGE
+
+def getCatalogBuilders(branch, starttime, endtime):
+    """Returns the names of the builders of branch in the catalog that were
+    submitted to between starttime and endtime (more exactly, whose first
+    and last submissions aren't both outside the same side of the
+    interval), or None if the catalog hasn't been filled in yet or isn't
+    recent enough."""
+    now = time.time()
+    if not _catalogCovers(min(endtime or now, now)):
+        return None
+
+    bc = Builder.__table__
+    q = select([bc.c.buildername], and_(
+        bc.c.buildername.contains(branch),
+        bc.c.last_seen >= starttime,
+        bc.c.first_seen <= endtime,
+        )).order_by(bc.c.buildername)
+    return [row[0] for row in q.execute()]
+
+def getBuilderClasses(branch):
+    """Returns a dictionary of the sorted platforms, build types and job
+    types of the builders of branch in the catalog, or None if the catalog
+    hasn't been filled in yet, isn't recent enough, or has no builders for
+    branch"""
+    if not _catalogCovers(time.time()):
+        return None
+
+    bc = Builder.__table__
+    retval = {}
+    for name in ('platform', 'build_type', 'job_type'):
+        column = bc.c[name]
+        q = select([column], and_(
+            bc.c.buildername.contains(branch),
+            column != None,
+            )).distinct()
+        retval[name] = sorted(row[0] for row in q.execute())
+    if not any(retval.values()):
+        return None
+    return retval
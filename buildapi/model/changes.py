@@ -1,7 +1,8 @@
 from sqlalchemy import or_, select, not_
 
 import buildapi.model.meta as meta
-from buildapi.model.util import get_revision
+from buildapi.model.util import get_revision, Record, adapt_rows, \
+stream_results
 
 def ChangesQuery(revision=None, branch_name=None, starttime=None, endtime=None):
     """Constructs the sqlalchemy query for fetching changes.
@@ -72,16 +73,17 @@ def GetChanges(revision=None, branch_name=None, starttime=None, endtime=None,
     else:
         q = PendingChangesQuery(starttime=starttime, endtime=endtime, 
             branch_name=branch_name, revision=revision)
-    q_results = q.execute()
+    q_results = stream_results(q)
 
     changes = {}
-    for r in q_results:
-        params = dict((str(k), v) for (k, v) in dict(r).items())
-        changes[params['changeid']] = Change(**params)
+    for change in adapt_rows(q_results, Change):
+        changes[change.changeid] = change
 
     return changes
 
-class Change(object):
+class Change(Record):
+    __slots__ = ('changeid', 'revision', 'branch', 'when_timestamp',
+        'ss_revision')
 
     def __init__(self, changeid=None, revision=None, branch=None,
         when_timestamp=None, ss_revision=None):
@@ -1,7 +1,7 @@
 from sqlalchemy import *
 from sqlalchemy.sql import func
 import buildapi.model.meta as meta
-from buildapi.model.util import get_time_interval
+from buildapi.model.util import get_time_interval, stream_results
 from pylons.decorators.cache import beaker_cache
 from decimal import *
 import re, simplejson, datetime
@@ -41,7 +41,7 @@ def GetIdleJobsReport(starttime=None, endtime=None, int_size=0):
     """
     starttime, endtime = get_time_interval(starttime, endtime)
     q = IdleJobsQuery(starttime, endtime)
-    q_results = q.execute()
+    q_results = stream_results(q)
     report = IdleJobsReport(starttime, endtime, int_size)
 
     for r in q_results:
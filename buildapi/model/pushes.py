@@ -3,8 +3,10 @@ import math
 from sqlalchemy import select, and_, or_, not_
 
 import buildapi.model.meta as meta
+from buildapi.model.branches import sourcestamp_branches
 from buildapi.model.reports import IntervalsReport
-from buildapi.model.util import get_time_interval, get_branch_name
+from buildapi.model.util import get_time_interval, get_branch_name, Record, \
+stream_results
 from buildapi.model.util import PUSHES_SOURCESTAMPS_BRANCH_SQL_EXCLUDE
 
 import logging
@@ -45,7 +47,9 @@ def PushesQuery(starttime, endtime, branches=None):
 
     # filter desired branches
     if branches:
-        bexp = [s.c.branch.like('%' + b + '%') for b in branches]
+        index = sourcestamp_branches()
+        bexp = [index.containing_filter(s.c.branch, b, endtime)
+                for b in branches]
         q = q.where(or_(*bexp))
 
     if starttime is not None:
@@ -71,7 +75,7 @@ def GetPushes(starttime=None, endtime=None, int_size=0, branches=None):
     starttime, endtime = get_time_interval(starttime, endtime)
 
     q = PushesQuery(starttime, endtime, branches)
-    q_results = q.execute()
+    q_results = stream_results(q)
 
     report = PushesReport(starttime, endtime, int_size=int_size,
         branches=branches)
@@ -159,7 +163,8 @@ class PushesReport(IntervalsReport):
 
         return json_obj
 
-class Push(object):
+class Push(Record):
+    __slots__ = ('stime', 'branch_name', 'revision')
 
     def __init__(self, stime, branch_name, revision):
         self.stime = stime
@@ -1,27 +1,60 @@
 from sqlalchemy import *
 import buildapi.model.meta as meta
+from buildapi.model.branches import sourcestamp_branches, change_branches
 from buildapi.model.util import get_time_interval
 from buildapi.lib.helpers import get_branches
 from pylons.decorators.cache import beaker_cache
 
 import math, re, time
 
+class BranchNameResolver(object):
+    """Finds the longest of a list of branch names that the last path
+    component of a sourcestamp's branch starts with, or 'Unknown'.  Names are
+    grouped by length, so a lookup costs one set lookup per distinct length
+    rather than a comparison per branch, and results are memoized."""
+    # Forget the memoized results once there are this many
+    max_memo = 10000
+
+    def __init__(self, branches):
+        self.branches = branches
+        self.by_length = {}
+        for branch in branches:
+            if branch:
+                self.by_length.setdefault(len(branch), set()).add(branch)
+        self.lengths = sorted(self.by_length, reverse=True)
+        self.memo = {}
+
+    def resolve(self, longname):
+        retval = self.memo.get(longname)
+        if retval is not None:
+            return retval
+
+        shortname = longname.split('/')[-1]
+        retval = 'Unknown'
+        for length in self.lengths:
+            if shortname[:length] in self.by_length[length]:
+                retval = shortname[:length]
+                break
+
+        if len(self.memo) >= self.max_memo:
+            self.memo = {}
+        self.memo[longname] = retval
+        return retval
+
+# Rebuilt whenever get_branches() returns a new list
+_branch_resolver = None
+
 def GetBranchName(longname):
+    global _branch_resolver
     # nightlies don't have a branch set (bug 570814)
     if not longname:
         return None
 
     allBranches = get_branches()
-    shortname = longname.split('/')[-1]
-    maybeBranch = ''
-    for branch in allBranches:
-        if shortname.startswith(branch):
-            if len(branch) > len(maybeBranch):
-                maybeBranch = branch
-
-    if not maybeBranch:
-        maybeBranch = 'Unknown'
-    return maybeBranch
+    resolver = _branch_resolver
+    if resolver is None or resolver.branches is not allBranches:
+        resolver = _branch_resolver = BranchNameResolver(allBranches)
+    return resolver.resolve(longname)
 
 def GetBuilds(branch=None, type='pending', rev=None):
     b  = meta.scheduler_db_meta.tables['builds']
@@ -81,7 +114,8 @@ def GetBuilds(branch=None, type='pending', rev=None):
                     br.c.results])
 
     if branch is not None:
-      q = q.where(ss.c.branch.like('%' + branch[0] + '%'))
+      q = q.where(sourcestamp_branches().containing_filter(ss.c.branch,
+          branch[0]))
 
     query_results = q.execute()
 
@@ -209,25 +243,30 @@ def GetHistoricBuilds(slave, count=20, greedy=True):
 
     query_results = q.execute()
 
-    q2 = select([p.c.value])
-    q2 = q2.where(and_(bp.c.property_id==p.c.id,
-                       "properties.name='buildername'",
-                       "build_properties.build_id = :x"))
-
     builds = []
     for r in query_results:
         this_result = {}
         for key,value in r.items():
             this_result[str(key)] = value
         this_result['buildername'] = ""
-        if 'id' in this_result:
-            q2_results = q2.execute(x=this_result['id'])
-            one_row = q2_results.fetchone()
-            if one_row and 'value' in one_row:
-                # Properties come wrapped in double-quotes. Strip them.
-                this_result['buildername'] = one_row['value'].strip('"')
         builds.append(this_result)
 
+    # Look up the buildername properties of all the builds at once
+    ids = [build['id'] for build in builds if 'id' in build]
+    if ids:
+        q2 = select([bp.c.build_id, p.c.value])
+        q2 = q2.where(and_(bp.c.property_id==p.c.id,
+                           p.c.name=='buildername',
+                           bp.c.build_id.in_(ids)))
+        buildernames = {}
+        for row in q2.execute():
+            buildernames.setdefault(row.build_id, row.value)
+        for build in builds:
+            value = buildernames.get(build.get('id'))
+            if value is not None:
+                # Properties come wrapped in double-quotes. Strip them.
+                build['buildername'] = value.strip('"')
+
     return builds
 
 def GetPushes(branch, fromtime, totime):
@@ -247,7 +286,8 @@ def GetPushes(branch, fromtime, totime):
     q = q.where(not_(or_(ch.c.branch.like('%unittest'),
                          ch.c.branch.like('%talos'))))
     if branch is not None:
-        q = q.where(ch.c.branch.like('%' + branch + '%'))
+        q = q.where(change_branches().containing_filter(ch.c.branch,
+            branch, totime))
 
     if fromtime is not None:
         q = q.where(ch.c.when_timestamp >= fromtime)
@@ -0,0 +1,121 @@
+"""Routing of read queries to read replicas of the scheduler and status DBs.
+
+Report builders read a lot of rows, and are better off on a replica than
+competing with self-serve and the agent on the primary.  A replica that has
+fallen too far behind its primary isn't used; queries go to the primary
+instead.  Latency-sensitive self-serve reads stay on the primary unless a
+replication lag they can live with is configured.
+
+Replicas are registered against the engine of their primary (see
+config/environment.py), and queries are routed by the engine they are bound
+to, so DBs without replicas are unaffected."""
+import threading
+import time
+
+from sqlalchemy import text
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class ReplicaSet(object):
+    """The read replicas of a primary engine.  Reports use the least behind
+    replica that is at most report_max_lag seconds behind the primary;
+    other reads use one at most read_max_lag seconds behind, or always the
+    primary if read_max_lag is None."""
+    # Measure the lag of each replica at most this often, in seconds
+    lag_check_interval = 30
+
+    def __init__(self, primary, replicas, report_max_lag=300,
+            read_max_lag=None):
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.report_max_lag = report_max_lag
+        self.read_max_lag = read_max_lag
+        # replica -> (time measured, lag)
+        self.lags = {}
+        self.lock = threading.Lock()
+
+    def measure_lag(self, engine):
+        """Returns how many seconds engine is behind the primary.  Replicas
+        that aren't replicating are infinitely behind."""
+        if engine.dialect.name != 'mysql':
+            return 0
+        row = engine.execute(text("SHOW SLAVE STATUS")).first()
+        if row is None or row['Seconds_Behind_Master'] is None:
+            return float('inf')
+        return row['Seconds_Behind_Master']
+
+    def lag(self, engine):
+        """Returns the last measured lag of engine, measuring it again if it
+        is more than lag_check_interval seconds old"""
+        now = time.time()
+        entry = self.lags.get(engine)
+        if entry is not None and now - entry[0] < self.lag_check_interval:
+            return entry[1]
+
+        with self.lock:
+            entry = self.lags.get(engine)
+            if entry is not None and \
+                    now - entry[0] < self.lag_check_interval:
+                return entry[1]
+            try:
+                lag = self.measure_lag(engine)
+            except Exception:
+                log.exception("Couldn't get the replication lag of %s",
+                        engine.url)
+                lag = float('inf')
+            if lag > self.report_max_lag:
+                log.warn("%s is %s seconds behind", engine.url, lag)
+            self.lags[engine] = (now, lag)
+            return lag
+
+    def pick(self, max_lag):
+        """Returns the least behind replica at most max_lag seconds behind,
+        or the primary if there is none (or max_lag is None)"""
+        if max_lag is None:
+            return self.primary
+        best, best_lag = self.primary, None
+        for replica in self.replicas:
+            lag = self.lag(replica)
+            if lag <= max_lag and (best_lag is None or lag < best_lag):
+                best, best_lag = replica, lag
+        return best
+
+    def for_reports(self):
+        return self.pick(self.report_max_lag)
+
+    def for_reads(self):
+        return self.pick(self.read_max_lag)
+
+
+# primary engine -> ReplicaSet
+_replica_sets = {}
+
+def add_replicas(primary, replicas, report_max_lag=300, read_max_lag=None):
+    """Routes the reads from primary to replicas, a list of engines, from
+    now on.  Returns the ReplicaSet."""
+    replica_set = ReplicaSet(primary, replicas, report_max_lag=report_max_lag,
+            read_max_lag=read_max_lag)
+    _replica_sets[primary] = replica_set
+    return replica_set
+
+def report_bind(bind):
+    """Returns the engine to run a report query bound to bind on"""
+    replica_set = _replica_sets.get(bind)
+    if replica_set is None:
+        return bind
+    return replica_set.for_reports()
+
+def read_bind(bind):
+    """Returns the engine to run a latency-sensitive read query bound to bind
+    on"""
+    replica_set = _replica_sets.get(bind)
+    if replica_set is None:
+        return bind
+    return replica_set.for_reads()
+
+def execute_read(q):
+    """Runs q, a query for self-serve, on the primary it is bound to, or a
+    replica recent enough for self-serve reads"""
+    return read_bind(q.bind).execute(q)
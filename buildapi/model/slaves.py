@@ -5,7 +5,8 @@ import time
 
 import buildapi.model.meta as meta
 from buildapi.model.reports import Report, IntervalsReport
-from buildapi.model.util import get_time_interval, get_silos
+from buildapi.model.util import get_time_interval, get_silos, Record, lazy, \
+stream_results, adapt_rows
 from buildapi.model.util import NO_RESULT, SUCCESS, WARNINGS, FAILURE, \
 SKIPPED, EXCEPTION, RETRY, SLAVE_SILOS, BUSY, IDLE
 
@@ -70,11 +71,9 @@ def GetSlavesReport(starttime=None, endtime=None, int_size=0, last_int_size=0):
         last_int_size=last_int_size)
 
     q = BuildsQuery(starttime=starttime_date, endtime=endtime_date)
-    q_results = q.execute()
+    q_results = stream_results(q)
 
-    for r in q_results:
-        params = dict((str(k), v) for (k, v) in dict(r).items())
-        build = Build(**params)
+    for build in adapt_rows(q_results, Build):
         report.add(build)
 
     return report
@@ -103,11 +102,9 @@ def GetSlaveDetailsReport(slave_id=None, starttime=None, endtime=None,
 
     q = BuildsQuery(slave_id=slave_id, get_builder_name=True,
         starttime=starttime_date, endtime=endtime_date)
-    q_results = q.execute()
+    q_results = stream_results(q)
 
-    for r in q_results:
-        params = dict((str(k), v) for (k, v) in dict(r).items())
-        build = Build(**params)
+    for build in adapt_rows(q_results, Build):
         report.add(build)
         if not report.name:
             report.name = build.slave_name
@@ -133,11 +130,9 @@ def GetStatusBuildersReport(starttime=None, endtime=None):
 
     q = BuildsQuery(starttime=starttime_date, endtime=endtime_date,
         get_builder_name=True)
-    q_results = q.execute()
+    q_results = stream_results(q)
 
-    for r in q_results:
-        params = dict((str(k), v) for (k, v) in dict(r).items())
-        build = Build(**params)
+    for build in adapt_rows(q_results, Build):
         report.add(build)
 
     return report
@@ -162,11 +157,9 @@ def GetBuilderDetailsReport(builder_name=None, starttime=None, endtime=None):
 
     q = BuildsQuery(builder_name=builder_name, get_builder_name=True,
         starttime=starttime_date, endtime=endtime_date)
-    q_results = q.execute()
+    q_results = stream_results(q)
 
-    for r in q_results:
-        params = dict((str(k), v) for (k, v) in dict(r).items())
-        build = Build(**params)
+    for build in adapt_rows(q_results, Build):
         report.add(build)
 
     return report
@@ -612,7 +605,10 @@ class BuilderDetailsReport(Report):
 
         return json_obj
 
-class Build(object):
+class Build(Record):
+    __slots__ = ('slave_id', 'slave_name', 'result', 'builder_id',
+        'builder_name', 'starttime', 'endtime', '_duration')
+
     def __init__(self, slave_id=None, slave_name=None, result=None, 
         builder_id=None, builder_name=None, starttime=None, endtime=None):
         self.slave_id = slave_id
@@ -625,8 +621,10 @@ class Build(object):
             if starttime else None
         self.endtime = time.mktime(endtime.timetuple()) if endtime else None
 
+    @lazy
+    def duration(self):
         # some endtimes are like 1970-01-01 00:00:01
-        self.duration = max(0, self.endtime - self.starttime
+        return max(0, self.endtime - self.starttime
             if self.starttime and self.endtime else 0)
 
     def to_dict(self):
@@ -1,7 +1,7 @@
 from sqlalchemy import *
 from sqlalchemy.sql import func
 import buildapi.model.meta as meta
-from buildapi.model.util import get_time_interval
+from buildapi.model.util import get_time_interval, stream_results
 from pylons.decorators.cache import beaker_cache
 
 import re, simplejson, datetime
@@ -159,7 +159,7 @@ def GetTestRuns(starttime=None, endtime=None, int_size=0, category=None, platfor
     """
     starttime, endtime = get_time_interval(starttime, endtime)
     q = TestRunsQuery(starttime, endtime, category=category)
-    q_results = q.execute()
+    q_results = stream_results(q)
     report = TestRunsReport(starttime, endtime, category=category, platform=platform, group=group, btype=btype)
     filtered_results = []
     #filter by platform, build type
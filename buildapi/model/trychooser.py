@@ -1,6 +1,7 @@
 from buildapi.model.buildrequest import BuildRequest, BuildRequestsQuery
 from buildapi.model.endtoend import BuildRun, EndtoEndTimesReport
-from buildapi.model.util import get_time_interval
+from buildapi.model.util import get_time_interval, adapt_rows, \
+stream_results
 
 def TryChooserGetEndtoEndTimes(starttime=None, endtime=None, 
     branch_name='mozilla-central'):
@@ -18,12 +19,10 @@ def TryChooserGetEndtoEndTimes(starttime=None, endtime=None,
 
     q = BuildRequestsQuery(starttime=starttime, endtime=endtime, 
             branch_name=branch_name)
-    q_results = q.execute()
+    q_results = stream_results(q)
 
     report = TryChooserEndtoEndTimesReport(starttime, endtime, branch_name)
-    for r in q_results:
-        params = dict((str(k), v) for (k, v) in dict(r).items())
-        br = BuildRequest(**params)
+    for br in adapt_rows(q_results, BuildRequest):
         report.add_build_request(br)
 
     return report
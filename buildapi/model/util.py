@@ -1,5 +1,11 @@
+import inspect
+import operator
 import re
+import threading
 import time
+from collections import OrderedDict
+
+from buildapi.model.replicas import report_bind
 
 # Masters build pools
 BUILDPOOL = 'buildpool'
@@ -227,6 +233,140 @@ _RESULTS_TO_STR = {
 }
 
 
+class Record(object):
+    """Base class for the objects reports create one of per DB row.
+    Subclasses list their attributes in __slots__, so that instances don't
+    carry a __dict__ each.  Slotted objects can't otherwise be pickled (e.g.
+    by beaker) with the default protocol."""
+    __slots__ = ()
+
+    def __getstate__(self):
+        state = {}
+        for cls in type(self).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                if hasattr(self, name):
+                    state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.iteritems():
+            setattr(self, name, value)
+
+
+class lazy(object):
+    """Decorator for Record methods computing a derived attribute.  The
+    method runs the first time the attribute is read, and the result is kept
+    in the slot named after the method with a leading underscore."""
+    def __init__(self, func):
+        self.func = func
+        self.slot = '_' + func.__name__
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+        try:
+            return getattr(obj, self.slot)
+        except AttributeError:
+            value = self.func(obj)
+            setattr(obj, self.slot, value)
+            return value
+
+
+def row_adapter(cls, keys):
+    """Returns a function creating a cls object out of a DB row with the
+    columns keys, passing each column to the cls constructor argument of the
+    same name.  The position of each argument within the row is worked out
+    once here, so the function returned only has to pick the columns out
+    of each row in order.  Arguments with no matching column get their
+    default value."""
+    keys = [str(k) for k in keys]
+    argspec = inspect.getargspec(cls.__init__)
+    args = argspec.args[1:]
+    defaults = argspec.defaults or ()
+    defaults = dict(zip(args[len(args) - len(defaults):], defaults))
+
+    unexpected = set(keys) - set(args)
+    if unexpected:
+        raise TypeError("%s() got unexpected columns: %s" %
+            (cls.__name__, ', '.join(sorted(unexpected))))
+    missing = [a for a in args if a not in keys]
+    for a in missing:
+        if a not in defaults:
+            raise TypeError("%s() has no column for argument %s" %
+                (cls.__name__, a))
+
+    # Arguments without a column are taken from the end of the row extended
+    # with their defaults
+    extra = tuple(defaults[a] for a in missing)
+    positions = [keys.index(a) if a in keys
+        else len(keys) + missing.index(a) for a in args]
+    if not args:
+        return lambda row: cls()
+    if len(args) == 1:
+        position = positions[0]
+        getter = lambda row: (row[position],)
+    else:
+        getter = operator.itemgetter(*positions)
+    if extra:
+        return lambda row: cls(*getter(tuple(row) + extra))
+    return lambda row: cls(*getter(row))
+
+def adapt_rows(rows, cls):
+    """Yields a cls object for each of the DB rows, as cls(**dict(row))
+    would, only faster.  See row_adapter."""
+    adapt = None
+    for row in rows:
+        if adapt is None:
+            adapt = row_adapter(cls, row.keys())
+        yield adapt(row)
+
+
+STREAM_BATCH_SIZE = 1000
+
+def _server_side_cursorclass(dbapi_conn):
+    """Returns the cursor class to use on dbapi_conn to leave a query's
+    results on the server, or None if there is none (or the driver already
+    honours the stream_results execution option, as psycopg2 does)."""
+    if not type(dbapi_conn).__module__.startswith('MySQLdb'):
+        return None
+    import MySQLdb.cursors
+    return MySQLdb.cursors.SSCursor
+
+def stream_results(q, batch_size=STREAM_BATCH_SIZE):
+    """Executes the select q and yields its rows, fetching them from the
+    database batch_size at a time, so that a report over a large time range
+    doesn't have to hold every row of the result in memory at once.
+
+    The query runs on a connection of its own, to a read replica if the DB
+    has one recent enough (see buildapi.model.replicas), with a server-side
+    cursor where the driver has one.  MySQLdb's server-side cursor ties up the
+    connection until every row has been read, so don't run other queries on
+    that connection while consuming the rows (queries through the bound
+    metadata each check out their own connection)."""
+    conn = report_bind(q.bind).connect()
+    dbapi_conn = conn.connection.connection
+    cursorclass = _server_side_cursorclass(dbapi_conn)
+    if cursorclass is not None:
+        default_cursorclass = dbapi_conn.cursorclass
+        dbapi_conn.cursorclass = cursorclass
+    try:
+        results = conn.execution_options(stream_results=True).execute(q)
+        try:
+            while True:
+                rows = results.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            results.close()
+    finally:
+        if cursorclass is not None:
+            dbapi_conn.cursorclass = default_cursorclass
+        conn.close()
+
+
 def status_to_str(status):
     """Return the status as string.
 
@@ -251,6 +391,67 @@ def results_to_str(results):
     return _RESULTS_TO_STR[results]
 
 
+_unclassified = object()
+
+class Classifier(object):
+    """Finds which key of a table like PLATFORMS_BUILDERNAME (key -> list of
+    compiled patterns) a name belongs to: the first key, in the table's
+    iteration order, with a pattern that matches it, or None.
+
+    All the patterns are combined into a single regular expression, one named
+    group per pattern, so that a name is matched once rather than once per
+    pattern.  The results for the last max_names names classified are
+    remembered."""
+    def __init__(self, table, max_names=10000):
+        self.keys = []
+        self.patterns = []
+        for key in table:
+            for pat in table[key]:
+                self.keys.append(key)
+                self.patterns.append(pat)
+        try:
+            self.combined = re.compile('|'.join('(?P<_%i>%s)' % (i, pat.pattern)
+                for i, pat in enumerate(self.patterns)))
+        except (AssertionError, re.error):
+            # Too many groups for one expression; match one at a time
+            self.combined = None
+        self.max_names = max_names
+        self.names = OrderedDict()
+        self.mutex = threading.Lock()
+
+    def match(self, name):
+        if self.combined is not None:
+            m = self.combined.match(name)
+            if m:
+                return self.keys[int(m.lastgroup[1:])]
+            return None
+        for key, pat in zip(self.keys, self.patterns):
+            if pat.match(name):
+                return key
+        return None
+
+    def __call__(self, name):
+        # Lookups don't take the lock or update the order: keeping track of
+        # recency costs about as much as matching.  The oldest names are
+        # dropped first.
+        retval = self.names.get(name, _unclassified)
+        if retval is not _unclassified:
+            return retval
+
+        retval = self.match(name)
+        with self.mutex:
+            self.names[name] = retval
+            while len(self.names) > self.max_names:
+                self.names.popitem(last=False)
+        return retval
+
+_branch_classifier = Classifier(SOURCESTAMPS_BRANCH)
+_platform_classifier = Classifier(PLATFORMS_BUILDERNAME)
+_build_type_classifier = Classifier(BUILD_TYPE_BUILDERNAME)
+_job_type_classifier = Classifier(JOB_TYPE_BUILDERNAME)
+_silos_classifier = Classifier(SLAVE_SILOS)
+
+
 def get_branch_name(text):
     """Returns the branch name.
 
@@ -262,12 +463,7 @@ def get_branch_name(text):
         return None
 
     text = text.lower()
-    for branch in SOURCESTAMPS_BRANCH:
-        for pat in SOURCESTAMPS_BRANCH[branch]:
-            if pat.match(text):
-                return branch
-
-    return text
+    return _branch_classifier(text) or text
 
 
 def get_platform(buildername):
@@ -283,12 +479,7 @@ def get_platform(buildername):
     if buildername.startswith('TB '):
         buildername = buildername[3:]
 
-    for platform in PLATFORMS_BUILDERNAME:
-        for pat in PLATFORMS_BUILDERNAME[platform]:
-            if pat.match(buildername):
-                return platform
-
-    return 'other'
+    return _platform_classifier(buildername) or 'other'
 
 
 def get_build_type(buildername):
@@ -307,12 +498,7 @@ def get_build_type(buildername):
     if not buildername:
         return None
 
-    for build_type in BUILD_TYPE_BUILDERNAME:
-        for pat in BUILD_TYPE_BUILDERNAME[build_type]:
-            if pat.match(buildername):
-                return build_type
-
-    return None
+    return _build_type_classifier(buildername)
 
 
 def get_job_type(buildername):
@@ -332,12 +518,7 @@ def get_job_type(buildername):
     if not buildername:
         return None
 
-    for job_type in JOB_TYPE_BUILDERNAME:
-        for pat in JOB_TYPE_BUILDERNAME[job_type]:
-            if pat.match(buildername):
-                return job_type
-
-    return None
+    return _job_type_classifier(buildername)
 
 
 def get_revision(revision):
@@ -352,12 +533,7 @@ def get_silos(slave_name):
     if not slave_name:
         return None
 
-    for silos_name in SLAVE_SILOS:
-        for pat in SLAVE_SILOS[silos_name]:
-            if pat.match(slave_name):
-                return silos_name
-
-    return None
+    return _silos_classifier(slave_name)
 
 
 def get_time_interval(starttime, endtime):
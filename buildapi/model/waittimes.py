@@ -4,7 +4,8 @@ from sqlalchemy import outerjoin, and_, not_, or_, func
 from buildapi.lib.helpers import get_masters_for_pool
 import buildapi.model.meta as meta
 from buildapi.model.reports import IntervalsReport
-from buildapi.model.util import get_time_interval, get_platform
+from buildapi.model.util import get_time_interval, get_platform, Record, \
+stream_results
 from buildapi.model.util import WAITTIMES_BUILDSET_REASON_SQL_EXCLUDE, \
 WAITTIMES_BUILDREQUESTS_BUILDERNAME_SQL_EXCLUDE, \
 WAITTIMES_BUILDREQUESTS_BUILDERNAME_EXCLUDE
@@ -91,7 +92,7 @@ def GetWaitTimes(pool='buildpool', mpb=15, starttime=None, endtime=None,
     starttime, endtime = get_time_interval(starttime, endtime)
 
     q = WaitTimesQuery(starttime, endtime, pool)
-    q_results = q.execute()
+    q_results = stream_results(q)
 
     report = WaitTimesReport(pool, starttime, endtime, mpb=mpb, maxb=maxb, 
         int_size = int_size, masters=get_masters_for_pool(pool))
@@ -253,7 +254,9 @@ class WaitTimeIntervals(object):
     def to_dict(self):
         return {'total': self.total, 'intervals': self.intervals}
 
-class WaitTime(object):
+class WaitTime(Record):
+    __slots__ = ('stime', 'etime', 'platform', 'buildername',
+        'has_no_changes')
 
     def __init__(self, stime, etime, platform, buildername=None, 
         has_no_changes=False):
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""builder_catalog.py [options] -f config.ini
+
+Keeps buildapi's builder catalog up to date.  Every interval seconds, the
+buildrequests made since the last update are read from the scheduler DB, and
+the builders they were made for are added to the catalog in the buildapi DB,
+or have their last seen time updated.  The first run reads every
+buildrequest, batch buildrequests at a time.
+
+Every builder in the catalog is classified again on startup, in case the
+classification tables changed.
+
+config.ini is the buildapi web application's configuration file."""
+import os
+import time
+
+import logging as log
+
+from buildapi.model.catalog import updateBuilderCatalog, reclassifyBuilders, \
+    CATALOG_BATCH_SIZE
+
+
+def update(batch_size):
+    start = time.time()
+    try:
+        count = updateBuilderCatalog(batch_size)
+    except Exception:
+        log.exception("Couldn't update the builder catalog")
+        return
+    log.info("Read %i buildrequests in %.2fs", count, time.time() - start)
+
+
+def main():
+    from optparse import OptionParser
+
+    from paste.deploy import appconfig
+    from sqlalchemy import engine_from_config
+
+    from buildapi.model import init_scheduler_model, init_buildapi_model
+
+    parser = OptionParser(__doc__)
+    parser.set_defaults(
+        configfile=None,
+        interval=60,
+        batch=CATALOG_BATCH_SIZE,
+        once=False,
+        verbosity=log.INFO,
+    )
+    parser.add_option("-f", "--config-file", dest="configfile")
+    parser.add_option("-i", "--interval", dest="interval", type="int",
+                      help="seconds between updates")
+    parser.add_option("-b", "--batch", dest="batch", type="int",
+                      help="number of buildrequests to read at once")
+    parser.add_option("--once", dest="once", action="store_true",
+                      help="update the catalog once and exit")
+    parser.add_option("-v", dest="verbosity", action="store_const",
+                      const=log.DEBUG, help="be verbose")
+    parser.add_option("-q", dest="verbosity", action="store_const",
+                      const=log.WARN, help="be quiet")
+
+    options, args = parser.parse_args()
+
+    if not options.configfile or not os.path.exists(options.configfile):
+        parser.error("Config file %s does not exist" % options.configfile)
+
+    log.basicConfig(format='%(asctime)s %(message)s', level=options.verbosity)
+
+    config = appconfig("config:%s" % os.path.abspath(options.configfile))
+    init_scheduler_model(engine_from_config(config,
+                                            'sqlalchemy.scheduler_db.'))
+    init_buildapi_model(engine_from_config(config,
+                                           'sqlalchemy.buildapi_db.'))
+
+    log.info("Reclassified %i builders", reclassifyBuilders())
+    update(options.batch)
+    if options.once:
+        return
+
+    try:
+        while True:
+            time.sleep(options.interval)
+            update(options.batch)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
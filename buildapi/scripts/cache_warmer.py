@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+"""cache_warmer.py [options] -f config.ini
+
+Keeps buildapi's cache warm, so that the first visitors after a deploy or a
+cache flush don't pay for the scheduler DB queries behind /self-serve.  Every
+interval seconds, the builds for today and yesterday are recomputed for every
+branch, followed by the builds for the most recent revisions pushed to each
+branch.  Only entries that are missing or no longer fresh are recomputed;
+days that won't change any more are left alone.
+
+config.ini is the buildapi web application's configuration file."""
+import os
+import time
+from multiprocessing.pool import ThreadPool
+
+import logging as log
+
+from buildapi.lib.times import now, oneday
+
+
+def recent_revisions(builds, count):
+    """Returns the count most recently submitted revisions in builds"""
+    latest = {}
+    for b in builds:
+        if 'requests' in b:
+            submittimes = [r['submittime'] for r in b['requests']]
+        else:
+            submittimes = [b['submittime']]
+        rev = b.get('revision')
+        if not rev or not submittimes:
+            continue
+        rev = rev[:12]
+        latest[rev] = max(latest.get(rev, 0), max(submittimes))
+    return sorted(latest, key=latest.get, reverse=True)[:count]
+
+
+class CacheWarmer(object):
+    def __init__(self, buildapi_cache, get_branches, jobs=4, revisions=5):
+        self.buildapi_cache = buildapi_cache
+        self.get_branches = get_branches
+        self.pool = ThreadPool(jobs)
+        self.revisions = revisions
+
+    def _run(self, what, func, *args):
+        start = time.time()
+        try:
+            builds = func(*args)
+        except Exception:
+            log.exception("Couldn't refresh %s", what)
+            return None
+        log.info("Refreshed %s: %i builds in %.2fs", what, len(builds),
+                 time.time() - start)
+        return builds
+
+    def refresh_day(self, job):
+        branch, date = job
+        what = "%s %s" % (branch, date.strftime('%Y-%m-%d'))
+        return self._run(what, self.buildapi_cache.refresh_builds_for_day,
+                         date, branch)
+
+    def refresh_revision(self, job):
+        branch, revision = job
+        what = "%s %s" % (branch, revision)
+        return self._run(what,
+                         self.buildapi_cache.refresh_builds_for_revision,
+                         branch, revision)
+
+    def _cached(self, keys):
+        """Returns the cached values of those of keys whose :fresh key hasn't
+        expired yet, and the cached values of the others if there are any,
+        as two dictionaries"""
+        cache = self.buildapi_cache.cache
+        found = cache.get_many(keys + [cache.fresh_key(k) for k in keys])
+        fresh, stale = {}, {}
+        for key in keys:
+            if key not in found:
+                continue
+            if cache.fresh_key(key) in found:
+                fresh[key] = found[key]
+            else:
+                stale[key] = found[key]
+        return fresh, stale
+
+    def warm(self):
+        """Refreshes whatever needs it once: the days and revisions that
+        aren't cached, or have gone stale, unless the day won't change any
+        more.  Returns the number of cache entries refreshed, the number
+        left alone and the number that couldn't be refreshed."""
+        bc = self.buildapi_cache
+        branches = sorted(self.get_branches())
+        today = now(bc.timezone).replace(
+            hour=0, minute=0, second=0, microsecond=0)
+
+        days = [(branch, date) for branch in branches
+                for date in (today, today - oneday)]
+        day_keys = dict(((branch, date), bc.build_key_for_day(date, branch))
+                        for (branch, date) in days)
+        fresh, stale = self._cached([day_keys[day] for day in days])
+        day_builds = {}
+        refresh = []
+        for (branch, date) in days:
+            key = day_keys[(branch, date)]
+            if key in fresh:
+                day_builds[(branch, date)] = fresh[key]
+            elif key in stale and bc.is_frozen(date, stale[key]):
+                day_builds[(branch, date)] = stale[key]
+            else:
+                refresh.append((branch, date))
+        results = self.pool.map(self.refresh_day, refresh)
+        day_builds.update(zip(refresh, results))
+
+        revisions = []
+        for branch in branches:
+            builds = day_builds.get((branch, today))
+            if builds:
+                revisions.extend((branch, rev) for rev in
+                                 recent_revisions(builds, self.revisions))
+        rev_keys = dict((job, bc.build_key_for_rev(*job))
+                        for job in revisions)
+        fresh, stale = self._cached([rev_keys[job] for job in revisions])
+        refresh_revs = [job for job in revisions if rev_keys[job] not in fresh]
+        results += self.pool.map(self.refresh_revision, refresh_revs)
+
+        failed = results.count(None)
+        skipped = len(days) + len(revisions) - len(results)
+        return len(results) - failed, skipped, failed
+
+    def run(self, interval):
+        while True:
+            start = time.time()
+            refreshed, skipped, failed = self.warm()
+            elapsed = time.time() - start
+            log.info("Refreshed %i cache entries (%i fresh, %i failed) in "
+                     "%.2fs", refreshed, skipped, failed, elapsed)
+            time.sleep(max(0, interval - elapsed))
+
+
+def main():
+    from optparse import OptionParser
+
+    from paste.deploy import appconfig
+    import pylons
+    from sqlalchemy import engine_from_config
+
+    from buildapi.lib.app_globals import Globals
+    from buildapi.lib.helpers import get_branches
+    from buildapi.model import init_scheduler_model
+
+    parser = OptionParser(__doc__)
+    parser.set_defaults(
+        configfile=None,
+        interval=50,
+        jobs=4,
+        revisions=5,
+        once=False,
+        verbosity=log.INFO,
+    )
+    parser.add_option("-f", "--config-file", dest="configfile")
+    parser.add_option("-i", "--interval", dest="interval", type="int",
+                      help="seconds between refreshes")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int",
+                      help="number of queries to run against the scheduler "
+                           "DB at once")
+    parser.add_option("-r", "--revisions", dest="revisions", type="int",
+                      help="number of recent revisions to refresh per branch")
+    parser.add_option("--once", dest="once", action="store_true",
+                      help="refresh everything once and exit")
+    parser.add_option("-v", dest="verbosity", action="store_const",
+                      const=log.DEBUG, help="be verbose")
+    parser.add_option("-q", dest="verbosity", action="store_const",
+                      const=log.WARN, help="be quiet")
+
+    options, args = parser.parse_args()
+
+    if not options.configfile or not os.path.exists(options.configfile):
+        parser.error("Config file %s does not exist" % options.configfile)
+
+    log.basicConfig(format='%(asctime)s %(message)s', level=options.verbosity)
+
+    config = appconfig("config:%s" % os.path.abspath(options.configfile))
+    engine = engine_from_config(config, 'sqlalchemy.scheduler_db.')
+    init_scheduler_model(engine)
+
+    # get_branches() looks up where to find the branches via app_globals
+    g = Globals(config)
+    pylons.app_globals._push_object(g)
+
+    warmer = CacheWarmer(g.buildapi_cache, get_branches, jobs=options.jobs,
+                         revisions=options.revisions)
+    if options.once:
+        refreshed, skipped, failed = warmer.warm()
+        log.info("Refreshed %i cache entries (%i fresh, %i failed)",
+                 refreshed, skipped, failed)
+    else:
+        try:
+            warmer.run(options.interval)
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == '__main__':
+    main()
@@ -16,6 +16,7 @@ from sqlalchemy import text
 from sqlalchemy.exc import TimeoutError
 
 from buildapi.lib import json
+from buildapi.model.branches import BranchIndex
 
 HOSTNAME = socket.gethostname()
 
@@ -89,6 +90,10 @@ class BuildAPIAgent:
         self.publisher = publisher
         self.branches = {}
         self.masters = []
+        self.sourcestamp_branches = BranchIndex(db, 'sourcestamps')
+        # Read the branches in the background rather than on the first
+        # cancel_revision
+        self.sourcestamp_branches.ready()
 
         self._last_refresh = 0
 
@@ -607,8 +612,26 @@ class BuildAPIAgent:
         who = message_data['who']
         branch = message_data['body']['branch']
         revision = "%s%%" % message_data['body']['revision'][:12]
-        prefixbranch = "%s%%" % branch
-        suffixbranch = "%%%s" % branch
+
+        # Pick up any sourcestamps created since the last refresh (e.g. by
+        # do_new_build_for_builder), then match the branch strings starting
+        # or ending with branch.  If none do, or the branches haven't been
+        # read yet, fall back to LIKE.
+        params = {'revision': revision}
+        names = []
+        if self.sourcestamp_branches.ready():
+            self.sourcestamp_branches.refresh()
+            names = self.sourcestamp_branches.affixed(branch)
+        if names:
+            for i, name in enumerate(names):
+                params['branch%i' % i] = name
+            branch_filter = "sourcestamps.branch IN (%s)" % ", ".join(
+                    ":branch%i" % i for i in range(len(names)))
+        else:
+            params['prefixbranch'] = "%s%%" % branch
+            params['suffixbranch'] = "%%%s" % branch
+            branch_filter = """(sourcestamps.branch LIKE :prefixbranch OR
+                         sourcestamps.branch LIKE :suffixbranch)"""
 
         q = text("""SELECT buildrequests.*
                     FROM
@@ -618,10 +641,9 @@ class BuildAPIAgent:
                         buildsets.sourcestampid = sourcestamps.id AND
                         sourcestamps.revision LIKE :revision AND
                         buildrequests.complete = 0 AND
-                        (sourcestamps.branch LIKE :prefixbranch OR
-                         sourcestamps.branch LIKE :suffixbranch)
-                """)
-        requests = self.db.execute(q, revision=revision, prefixbranch=prefixbranch, suffixbranch=suffixbranch)
+                        %s
+                """ % branch_filter)
+        requests = self.db.execute(q, **params)
 
         msgs = []
         errors = False
@@ -150,20 +150,25 @@
 
 <%def name="builders_table_filters_menu(id)">
   <%! from buildapi.model.util import PLATFORMS_BUILDERNAME, BUILD_TYPE_BUILDERNAME, JOB_TYPE_BUILDERNAME, BUILDERS_DETAIL_LEVELS %>
+  <%
+  # Only offer the classes the branch's builders have, if the builder
+  # catalog knows them
+  classes = c.builder_classes or dict(
+      platform=sorted(PLATFORMS_BUILDERNAME.keys()),
+      build_type=sorted(BUILD_TYPE_BUILDERNAME.keys()),
+      job_type=sorted(JOB_TYPE_BUILDERNAME.keys()))
+  %>
   <div id="${id}">
     <p>
       <b>Filters:</b>
       <br/><i>Platform:</i>
-      <% platforms = sorted(PLATFORMS_BUILDERNAME.keys()) %>
-      ${checkbox_menu('platform', platforms, [])}
+      ${checkbox_menu('platform', classes['platform'], [])}
 
       <br/><i>Build Type:</i>
-      <% build_type = sorted(BUILD_TYPE_BUILDERNAME.keys()) %>
-      ${checkbox_menu('build_type', build_type, [])}
+      ${checkbox_menu('build_type', classes['build_type'], [])}
 
       <br/><i>Job Type:</i>
-      <% job_type = sorted(JOB_TYPE_BUILDERNAME.keys()) %>
-      ${checkbox_menu('job_type', job_type, [])}
+      ${checkbox_menu('job_type', classes['job_type'], [])}
     <br/></p>
     <p>
       <b>Detail level:</b>
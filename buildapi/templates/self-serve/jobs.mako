@@ -14,12 +14,16 @@ $(document).ready(function()
 </script>
 </%def>
 <%def name="body()">\
+<%
+    # paged=1 gets the jobs along with the cursor for the next page
+    jobs = c.data['jobs'] if isinstance(c.data, dict) else c.data
+%>
 <table id="jobs">
 <thead>
 <tr><th>Who</th><th>What</th><th>When</th><th>Completed at</th><th>Results</th></tr>
 </thead>
 <tbody>
-% for job in c.data:
+% for job in jobs:
     <tr><td>${job['who']}</td>
         <td>${job['action']} <pre>${job['what']}</pre></td>
         <td>${self.attr.formattime(job['when'])}</td>
@@ -29,4 +33,7 @@ $(document).ready(function()
 % endfor
 </tbody>
 </table>
+% if isinstance(c.data, dict) and c.data['next']:
+<a href="${h.url('jobs', cursor=c.data['next'], num=c.num_jobs)}">Next page</a>
+% endif
 </%def>
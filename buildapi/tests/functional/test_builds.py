@@ -69,10 +69,26 @@ class TestBuildsController(TestController):
             response = self.app.get(url('branch', branch='branch2', format='json')).json
             self.assertEquals(len(response), 1)
 
+    def test_branch_properties(self):
+        with mock.patch.object(time, 'time', return_value=1285855044):
+            response = self.app.get(url('branch', branch='branch1', format='json', properties=1)).json
+            self.assertEquals(len(response), 3)
+            for build in response:
+                if 'requests' in build:
+                    for r in build['requests']:
+                        self.assertEquals(r['properties'], {'scheduler': 'branch1'})
+                else:
+                    self.assertEquals(build['properties'], {'scheduler': 'branch1'})
+
+            # The cached builds are left alone
+            response = self.app.get(url('branch', branch='branch1', format='json')).json
+            self.assert_('properties' not in response[0]['requests'][0])
+
     def test_build(self):
         response = self.app.get(url('build', branch='branch1', build_id=1, format='json')).json
         self.assertEquals(response['branch'], 'branch1')
         self.assertEquals(len(response['requests']), 1)
+        self.assertEquals(response['requests'][0]['properties'], {'scheduler': 'branch1'})
 
     def test_no_build(self):
         response = self.app.get(url('build', branch='branch1', build_id=2, format='json'), status=404)
@@ -82,11 +98,17 @@ class TestBuildsController(TestController):
     def test_request(self):
         response = self.app.get(url('request', branch='branch1', request_id=1, format='json')).json
         self.assertEquals(response['revision'], '123456789')
+        self.assertEquals(response['properties'], {'scheduler': 'branch1'})
+        self.assertEquals(response['build_ids'], [1])
 
     def test_revision(self):
         response = self.app.get(url('revision', branch='branch1', revision='123456789', format='json')).json
         self.assertEquals(len(response), 1)
 
+    def test_revision_properties(self):
+        response = self.app.get(url('revision', branch='branch1', revision='123456789', format='json', properties=1)).json
+        self.assertEquals(response[0]['requests'][0]['properties'], {'scheduler': 'branch1'})
+
     def test_reprioritize(self):
         self.g.mq._clock = mock.Mock(return_value=543221)
         p = self.engine.execute('select priority from buildrequests where id=3').scalar()
@@ -101,6 +123,23 @@ class TestBuildsController(TestController):
         self.assertEquals(r.who, 'me')
         self.assertEquals(json.loads(r.what), {'priority': 1, 'brid': 3})
 
+    def test_reprioritize_watches_job(self):
+        with mock.patch.object(self.g.buildapi_cache, 'watch_job') as watch_job:
+            self.app.put(url('reprioritize', branch='branch1', request_id=3), {'priority': 1}, extra_environ=dict(REMOTE_USER='me'))
+        revision = self.engine.execute('select revision from sourcestamps, buildsets, buildrequests where buildrequests.id=3 and buildsets.id=buildrequests.buildsetid and sourcestamps.id=buildsets.sourcestampid').scalar()
+        r = self.get_jobrequests()[0]
+        watch_job.assert_called_once_with(r.id, 'branch1', revision)
+
+    def test_job_watched_before_sending(self):
+        # The job may well be done before send() returns
+        def send(message_data):
+            self.assertEquals(
+                self.g.buildapi_cache.cache.get_many(['jobs:1']),
+                {'jobs:1': ['branch1', '1234567']})
+        self.g.mq.send.side_effect = send
+        self.app.delete(url('cancel_revision', branch='branch1', revision='1234567'), extra_environ=dict(REMOTE_USER='me'))
+        self.assertEquals(self.g.mq.send.call_count, 1)
+
     def test_reprioritize_bad_priority(self):
         response = self.app.put(url('reprioritize', branch='branch1', request_id=1), {'priority': 'a'}, extra_environ=dict(REMOTE_USER='me'), status=400)
         self.assertEquals(response.status_int, 400)
@@ -284,3 +323,73 @@ class TestBuildsController(TestController):
             response = method_func(url(name, branch='badbranch', format='json', **params), status=404, **extra)
             self.assertEquals(response.status_int, 404)
             self.assert_("not found" in response.body)
+
+    def test_cache_stats(self):
+        self.app.get(url('branches', format='json'))
+        stats = self.app.get(url('cache_stats')).json
+        self.assert_(isinstance(stats, dict))
+
+    def test_cache_stats_reset(self):
+        self.app.get(url('branches', format='json'))
+        # Resetting needs a POST
+        self.app.get(url('cache_stats', reset=1), status=405)
+        self.assertNotEqual(self.app.get(url('cache_stats')).json, {})
+        self.app.post(url('cache_stats'), {'reset': 1})
+        self.assertEqual(self.app.get(url('cache_stats')).json, {})
+
+    def add_jobrequests(self, whens):
+        for i, when in enumerate(whens):
+            self.engine.execute("insert into jobrequests "
+                    "(id, action, who, \"when\", what) values (?, ?, ?, ?, ?)",
+                    i + 1, 'cancel_request', 'me', when, '{}')
+
+    def test_jobs(self):
+        self.add_jobrequests([100, 300, 200])
+        response = self.app.get(url('jobs', format='json')).json
+        self.assertEquals([j['when'] for j in response], [300, 200, 100])
+
+    def test_jobs_paged(self):
+        # Jobs requested at the same time are still paged through in order
+        self.add_jobrequests([100, 200, 200, 200, 300])
+        seen = []
+        params = {'paged': 1}
+        for i in range(4):
+            response = self.app.get(url('jobs', format='json', num=2, **params)).json
+            seen.extend(response['jobs'])
+            if not response['next']:
+                break
+            params = {'cursor': response['next']}
+        self.assertEquals([j['when'] for j in seen], [300, 200, 200, 200, 100])
+        self.assertEquals(i, 2)
+
+        response = self.app.get(url('jobs', format='html', num=2, paged=1))
+        self.assert_("Next page" in response.body)
+
+    def test_jobs_paged_from_mq(self):
+        # Jobs recorded by the publisher, at fractional times
+        self.g.mq._clock = mock.Mock(side_effect=[1000.25, 1000.75, 1001.5])
+        for brid in (1, 2, 3):
+            self.g.mq.send_msg('cancel_request', 'me', brid=brid)
+        response = self.app.get(url('jobs', format='json', num=2, paged=1)).json
+        self.assertEquals([j['what']['brid'] for j in response['jobs']], [3, 2])
+        response = self.app.get(url('jobs', format='json', num=2,
+            cursor=response['next'], offset=1)).json
+        self.assertEquals([j['what']['brid'] for j in response['jobs']], [1])
+        self.assertEquals(response['next'], None)
+
+    def test_jobs_bad_cursor(self):
+        response = self.app.get(url('jobs', format='json', cursor='junk'), status=400)
+        self.assertEquals(response.status_int, 400)
+
+    def test_branch_builds(self):
+        response = self.app.get(url('branch_builds', branch='branch1', format='json', num=1)).json
+        self.assertEquals([b['build_id'] for b in response['builds']], [1])
+        self.assert_(response['next'])
+
+        response = self.app.get(url('branch_builds', branch='branch1', format='json', num=1, cursor=response['next'])).json
+        self.assertEquals(response, {'builds': [], 'next': None})
+
+    def test_user(self):
+        response = self.app.get(url('user', branch='branch1', user='sendchange', format='json')).json
+        self.assertEquals([b['build_id'] for b in response['builds'] + response['running']], [1])
+        self.assertEquals(response['next'], None)
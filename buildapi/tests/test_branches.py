@@ -0,0 +1,101 @@
+import os
+import tempfile
+import time
+import mock
+import sqlalchemy
+from unittest import TestCase
+
+from buildapi.model.branches import BranchIndex
+
+class TestBranchIndex(TestCase):
+
+    def setUp(self):
+        # A file, so that the index can be read from another thread
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.engine = sqlalchemy.create_engine("sqlite:///%s" % self.path)
+        self.engine.execute('create table sourcestamps '
+                '(id integer primary key, branch text)')
+        self.add('mozilla-central', 'releases/mozilla-central',
+                'mozilla-central-android', 'mozilla-centralish-x',
+                'projects/ash', None, 'mozilla-central')
+        self.index = BranchIndex(self.engine, 'sourcestamps')
+        self.t = sqlalchemy.Table('sourcestamps', sqlalchemy.MetaData(),
+                sqlalchemy.Column('id', sqlalchemy.Integer, primary_key=True),
+                sqlalchemy.Column('branch', sqlalchemy.Text))
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def add(self, *branches):
+        for branch in branches:
+            self.engine.execute('insert into sourcestamps (branch) values (?)',
+                    branch)
+
+    def test_affixed(self):
+        self.assertEqual(self.index.affixed('mozilla-central'),
+                ['mozilla-central', 'mozilla-central-android',
+                 'mozilla-centralish-x', 'releases/mozilla-central'])
+        self.assertEqual(self.index.affixed('ash'), ['projects/ash'])
+
+    def test_containing(self):
+        self.assertEqual(self.index.containing('central-'),
+                ['mozilla-central-android'])
+
+    def test_no_match(self):
+        self.assertEqual(self.index.affixed('cedar'), [])
+
+    def branches(self, clause):
+        q = sqlalchemy.select([self.t.c.branch], clause).distinct()
+        return sorted(row[0] for row in self.engine.execute(q))
+
+    def test_filter_loads_in_background(self):
+        t = self.t
+        # Not read yet, so LIKE is used while it's read in the background
+        self.assertFalse(self.index.ready())
+        self.assertEqual(str(self.index.containing_filter(t.c.branch, 'ash')),
+                str(t.c.branch.contains('ash')))
+        for i in range(100):
+            if self.index.ready():
+                break
+            time.sleep(0.05)
+        self.assert_(self.index.ready())
+        self.assertEqual(self.branches(self.index.containing_filter(
+            t.c.branch, 'central-')), ['mozilla-central-android'])
+
+    def test_filter_sees_new_branches(self):
+        t = self.t
+        self.index.refresh()
+        self.assertEqual(self.branches(self.index.affixed_filter(t.c.branch,
+                'ash')), ['projects/ash'])
+        # New branch strings show up right away, for known short names...
+        self.add('projects/ash-selfserve')
+        self.assertEqual(self.branches(self.index.containing_filter(
+            t.c.branch, 'ash')), ['projects/ash', 'projects/ash-selfserve'])
+        # ...and short names that match nothing use LIKE
+        self.assertEqual(self.branches(self.index.containing_filter(
+            t.c.branch, 'elm')), [])
+        self.assertEqual(str(self.index.containing_filter(t.c.branch, 'elm')),
+                str(t.c.branch.contains('elm')))
+
+    def test_filter_past_period(self):
+        self.index.refresh()
+        with mock.patch.object(self.index, 'refresh') as refresh:
+            self.index.affixed_filter(self.t.c.branch, 'ash',
+                    self.index.refreshed_at - 60)
+            refresh.assert_called_once_with(
+                    since=self.index.refreshed_at - 60)
+        # Nothing to read for periods over before the last refresh
+        last_id = self.index.last_id
+        self.add('projects/ash-old')
+        self.index.refresh(since=self.index.refreshed_at - 60)
+        self.assertEqual(self.index.last_id, last_id)
+
+    def test_refresh(self):
+        self.assertEqual(self.index.affixed('cedar'), [])
+        self.add('projects/cedar')
+        # Not refreshed yet
+        self.assertEqual(self.index.affixed('cedar'), [])
+        self.index.refresh()
+        self.assertEqual(self.index.affixed('cedar'), ['projects/cedar'])
+        self.assertEqual(self.index.last_id, 8)
@@ -0,0 +1,334 @@
+import datetime
+import os
+import shutil
+import tempfile
+import mock
+import pytz
+import sqlalchemy
+from unittest import TestCase
+
+from buildapi.lib import cacher
+from buildapi.lib.cache import BuildapiCache, getBuilds, getBuildsIncremental
+from buildapi.lib.times import dt2ts
+from buildapi.model import init_scheduler_model, replicas
+
+class TestInvalidation(TestCase):
+
+    def setUp(self):
+        self.tz = pytz.timezone('US/Pacific')
+        self.c = BuildapiCache(cacher.LocalCache(), self.tz)
+        self.today = self.tz.localize(datetime.datetime(2012, 6, 20, 12))
+        self.lastweek = self.tz.localize(datetime.datetime(2012, 6, 13, 12))
+        self.keys = [
+            'builds:b1:2012-06-20',
+            'builds:b1:2012-06-13',
+            'builds:b1:2012-06-10',
+            'builds:b1:abcdef123456',
+            'builds:b2:abcdef123456',
+        ]
+        for key in self.keys:
+            self.c.cache.put(key, [])
+        self.c.cache.put('builds:b1:abcdef123456', [
+            {'buildername': 'build', 'starttime': dt2ts(self.lastweek)},
+            {'buildername': 'pending', 'submittime': dt2ts(self.today)},
+        ])
+
+    def cached(self):
+        return sorted(self.c.cache.get_many(self.keys))
+
+    def test_invalidate(self):
+        with mock.patch('time.time', return_value=dt2ts(self.today)):
+            self.c.invalidate('b1', 'abcdef1234567890')
+        self.assertEqual(self.cached(), [
+            'builds:b1:2012-06-10',
+            'builds:b2:abcdef123456',
+        ])
+
+    def test_job_done(self):
+        with mock.patch('time.time', return_value=dt2ts(self.today)):
+            self.c.watch_job(7, 'b1', 'abcdef123456')
+            self.c.job_done(8)
+            self.assertEqual(len(self.cached()), 5)
+            self.c.job_done(7)
+            self.assertEqual(len(self.cached()), 2)
+            self.assertEqual(self.c.cache.get_many(['jobs:7']), {})
+
+class TestStaleDays(TestCase):
+
+    def setUp(self):
+        self.tz = pytz.timezone('US/Pacific')
+        self.c = BuildapiCache(cacher.LocalCache(), self.tz)
+        self.today = self.tz.localize(datetime.datetime(2012, 6, 20))
+
+    def test_range_refreshes_stale_days(self):
+        key = 'builds:b1:2012-06-20'
+        self.c.cache.put(key, ['old'])
+        with mock.patch('time.time', return_value=dt2ts(self.today) + 3600):
+            with mock.patch.object(self.c, 'get_builds_for_day') as day:
+                day.return_value = ['stale']
+                builds = self.c.get_builds_for_date_range(self.today,
+                        self.today + datetime.timedelta(days=1), 'b1')
+        self.assertEqual(builds, ['stale'])
+        day.assert_called_once_with(self.today, 'b1')
+
+        self.c.cache.put(self.c.cache.fresh_key(key), True)
+        with mock.patch('time.time', return_value=dt2ts(self.today) + 3600):
+            builds = self.c.get_builds_for_date_range(self.today,
+                    self.today + datetime.timedelta(days=1), 'b1')
+        self.assertEqual(builds, ['old'])
+
+class TestParallelRange(TestCase):
+
+    def setUp(self):
+        self.tz = pytz.timezone('US/Pacific')
+        self.c = BuildapiCache(cacher.LocalCache(), self.tz)
+        self.start = self.tz.localize(datetime.datetime(2012, 6, 18))
+
+    def test_fetches_missing_days(self):
+        self.c.cache.put_many({'builds:b1:2012-06-19': [{'day': 'cached'}],
+            'builds:b1:2012-06-19:fresh': True})
+
+        def getBuilds(branch, starttime, endtime):
+            return [{'day': self.tz.normalize(datetime.datetime.fromtimestamp(
+                starttime, pytz.utc)).strftime('%d')}]
+
+        with mock.patch('time.time', return_value=dt2ts(self.start) + 4*86400):
+            with mock.patch('buildapi.lib.cache.getBuilds', getBuilds):
+                builds = self.c.get_builds_for_date_range(self.start,
+                        self.start + datetime.timedelta(days=3), 'b1',
+                        method=2)
+            self.assertEqual([b['day'] for b in builds],
+                    ['18', 'cached', '20'])
+            self.assertEqual(sorted(self.c.cache.get_many([
+                'builds:b1:2012-06-18', 'builds:b1:2012-06-20'])),
+                ['builds:b1:2012-06-18', 'builds:b1:2012-06-20'])
+
+class TestRevisionIndex(TestCase):
+
+    def setUp(self):
+        self.tz = pytz.timezone('US/Pacific')
+        self.c = BuildapiCache(cacher.LocalCache(), self.tz)
+        self.today = self.tz.localize(datetime.datetime(2012, 6, 20))
+        builds = [{'revision': 'abcdef1234567890'}, {'revision': None},
+                {'revision': 'abcdff0000000000'}]
+        with mock.patch('time.time', return_value=dt2ts(self.today) + 3600):
+            with mock.patch('buildapi.lib.cache.getBuilds') as getBuilds:
+                getBuilds.return_value = builds
+                self.c.get_builds_for_day(self.today, 'b1')
+
+    def canonical_revision(self, revision):
+        with mock.patch('time.time', return_value=dt2ts(self.today) + 3660):
+            return self.c.canonical_revision('b1', revision)
+
+    def test_canonical_revision(self):
+        with mock.patch('time.time', return_value=dt2ts(self.today) + 3660):
+            self.assertEqual(
+                self.c.cache.get_many(['builds:b1:2012-06-20:revs']),
+                {'builds:b1:2012-06-20:revs': ['abcdef123456', 'abcdff000000']})
+        self.assertEqual(self.canonical_revision('abcdef1'), 'abcdef123456')
+        self.assertEqual(self.canonical_revision('abcdef1234567890'),
+                'abcdef123456')
+        # Ambiguous, too short or unknown
+        self.assertEqual(self.canonical_revision('abcdf'), 'abcdf')
+        self.assertEqual(self.canonical_revision('abcdef'), 'abcdef')
+        self.assertEqual(self.canonical_revision('1234567'), '1234567')
+
+    def test_get_builds_for_revision(self):
+        with mock.patch('time.time', return_value=dt2ts(self.today) + 3660):
+            with mock.patch('buildapi.lib.cache.getRevision') as getRevision:
+                getRevision.return_value = ['new']
+                self.c.get_builds_for_revision('b1', 'abcdef12')
+                self.c.get_builds_for_revision('b1', 'abcdef123456')
+                getRevision.assert_called_once_with('b1', 'abcdef123456')
+
+class TestRefresh(TestCase):
+
+    def setUp(self):
+        self.tz = pytz.timezone('US/Pacific')
+        self.c = BuildapiCache(cacher.LocalCache(), self.tz)
+        self.today = self.tz.localize(datetime.datetime(2012, 6, 20))
+
+    def test_refresh_builds_for_day(self):
+        self.c.cache.put('builds:b1:2012-06-20', ['old'])
+        with mock.patch('time.time', return_value=dt2ts(self.today) + 3600):
+            with mock.patch('buildapi.lib.cache.getBuilds') as getBuilds:
+                getBuilds.return_value = [{'revision': None}]
+                self.assertEqual(
+                    self.c.refresh_builds_for_day(self.today, 'b1'),
+                    [{'revision': None}])
+            self.assertEqual(self.c.cache.get_many([
+                'builds:b1:2012-06-20', 'builds:b1:2012-06-20:fresh']),
+                {'builds:b1:2012-06-20': [{'revision': None}],
+                 'builds:b1:2012-06-20:fresh': True})
+
+    def test_refresh_builds_for_revision(self):
+        with mock.patch('buildapi.lib.cache.getRevision') as getRevision:
+            getRevision.return_value = ['new']
+            self.c.refresh_builds_for_revision('b1', 'abcdef1234567890')
+            getRevision.assert_called_once_with('b1', 'abcdef123456')
+        self.assertEqual(self.c.cache.get_many(['builds:b1:abcdef123456']),
+                {'builds:b1:abcdef123456': ['new']})
+
+class TestFrozenDays(TestCase):
+
+    def setUp(self):
+        self.tz = pytz.timezone('US/Pacific')
+        self.c = BuildapiCache(cacher.LocalCache(), self.tz)
+        self.yesterday = self.tz.localize(datetime.datetime(2012, 6, 19))
+        self.today = self.yesterday + datetime.timedelta(days=1)
+        self.builds = [self.build(dt2ts(self.yesterday) + 3600)]
+
+    def build(self, endtime):
+        return {'build_id': 1, 'endtime': endtime,
+                'requests': [{'complete': 1, 'complete_at': endtime}]}
+
+    def is_frozen(self, t, builds):
+        with mock.patch('time.time', return_value=t):
+            return self.c.is_frozen(self.yesterday, builds)
+
+    def test_is_frozen(self):
+        t = dt2ts(self.today) + 3600
+        self.assert_(self.is_frozen(t, self.builds))
+        self.assert_(self.is_frozen(t, []))
+        self.assertFalse(self.is_frozen(dt2ts(self.today) - 60, self.builds))
+        # Something's still pending or running
+        self.assertFalse(self.is_frozen(t, self.builds + [{'request_id': 2}]))
+        self.assertFalse(self.is_frozen(t, [self.build(None)]))
+        # Something completed too recently
+        self.assertFalse(self.is_frozen(t, [self.build(t - 60)]))
+        # Anything that old is done, unless it's still pending or running
+        self.assert_(self.is_frozen(t + 3*86400, [self.build(t + 3*86400)]))
+        self.assertFalse(self.is_frozen(t + 3*86400, [self.build(None)]))
+
+    def test_old_day_with_pending_build(self):
+        t = dt2ts(self.today) + 30*86400
+        builds = self.builds + [{'request_id': 2}]
+        self.assertFalse(self.is_frozen(t, builds))
+        path = tempfile.mkdtemp()
+        try:
+            c = BuildapiCache(cacher.LocalCache(), self.tz,
+                    frozen_store=cacher.DiskStore(path))
+            with mock.patch('time.time', return_value=t):
+                with mock.patch('buildapi.lib.cache.getBuilds') as getBuilds:
+                    getBuilds.return_value = builds
+                    c.refresh_builds_for_day(self.yesterday, 'b1')
+            # Not frozen, so it expires and isn't kept on disk
+            with mock.patch('time.time', return_value=t + 86400):
+                self.assertEqual(c.cache.get_many(['builds:b1:2012-06-19']),
+                        {})
+            self.assertEqual(os.listdir(path), [])
+        finally:
+            shutil.rmtree(path)
+
+    def test_frozen_day_never_expires(self):
+        t = dt2ts(self.today) + 7200
+        with mock.patch('time.time', return_value=t):
+            with mock.patch('buildapi.lib.cache.getBuilds') as getBuilds:
+                getBuilds.return_value = self.builds
+                self.c.get_builds_for_day(self.yesterday, 'b1')
+                self.c.get_builds_for_day(self.today, 'b1')
+        with mock.patch('time.time', return_value=t + 30*86400):
+            self.assertEqual(sorted(self.c.cache.get_many([
+                'builds:b1:2012-06-19', 'builds:b1:2012-06-19:fresh',
+                'builds:b1:2012-06-20', 'builds:b1:2012-06-20:fresh'])),
+                ['builds:b1:2012-06-19', 'builds:b1:2012-06-19:fresh'])
+
+    def test_frozen_store(self):
+        path = tempfile.mkdtemp()
+        try:
+            store = cacher.DiskStore(path)
+            t = dt2ts(self.today) + 7200
+            with mock.patch('time.time', return_value=t):
+                c = BuildapiCache(cacher.LocalCache(), self.tz,
+                        frozen_store=store)
+                with mock.patch('buildapi.lib.cache.getBuilds') as getBuilds:
+                    getBuilds.return_value = self.builds
+                    c.refresh_builds_for_day(self.yesterday, 'b1')
+                    c.refresh_builds_for_day(self.today, 'b1')
+
+                # Survives the cache being flushed
+                c = BuildapiCache(cacher.LocalCache(), self.tz,
+                        frozen_store=store)
+                with mock.patch('buildapi.lib.cache.getBuilds') as getBuilds:
+                    getBuilds.side_effect = AssertionError
+                    self.assertEqual(
+                        c.get_builds_for_day(self.yesterday, 'b1'),
+                        self.builds)
+            self.assertEqual(os.listdir(path), ['builds%3Ab1%3A2012-06-19'])
+        finally:
+            shutil.rmtree(path)
+
+class TestIncremental(TestCase):
+
+    def setUp(self):
+        self.engine = self.load_state()
+        init_scheduler_model(self.engine)
+
+    def tearDown(self):
+        replicas._replica_sets.clear()
+
+    def load_state(self):
+        engine = sqlalchemy.create_engine("sqlite:///:memory:")
+        sql = open(os.path.join(os.path.dirname(__file__), "state.sql")).read().split(";")
+        for line in sql:
+            line = line.strip()
+            engine.execute(line)
+        return engine
+
+    def test_replicas(self):
+        before = getBuilds('branch1', 0, 2**31)
+        replicas.add_replicas(self.engine, [self.load_state()],
+                read_max_lag=60)
+        self.engine.execute('insert into buildrequests values (5, 1, "branch1-build", 0, 1285844071, "m", "i", 1, 0, 1285844070, 1285844100)')
+        self.engine.execute('insert into builds values (3, 1, 5, 1285844072, 1285844100)')
+        # Reads go to the replica, except for the incremental builds query
+        self.assertEqual(getBuilds('branch1', 0, 2**31), before)
+        builds, state = getBuildsIncremental('branch1', 0, 2**31)
+        self.assertEqual(len(builds), len(before) + 1)
+
+    def test_first_time(self):
+        for branch in ('branch1', 'branch2'):
+            builds, state = getBuildsIncremental(branch, 0, 2**31)
+            self.assertEqual(builds, getBuilds(branch, 0, 2**31))
+
+    def test_merges_changes(self):
+        builds, state = getBuildsIncremental('branch2', 0, 2**31)
+        self.assertEqual(builds[0]['endtime'], None)
+
+        # Build 2 finishes, and another starts
+        self.engine.execute('update builds set finish_time=1285844070 where id=2')
+        self.engine.execute('update buildrequests set complete=1, results=0, complete_at=1285844070 where id=2')
+        self.engine.execute('insert into buildrequests values (5, 2, "branch2-build", 0, 1285844071, "m", "i", 0, NULL, 1285844070, NULL)')
+        self.engine.execute('insert into builds values (3, 1, 5, 1285844072, NULL)')
+
+        builds, state = getBuildsIncremental('branch2', 0, 2**31, state)
+        self.assertEqual(builds, getBuilds('branch2', 0, 2**31))
+        self.assertEqual(len(builds), 2)
+        self.assertEqual(state['max_build_id'], 3)
+        self.assertEqual(state['complete_at'], 1285844070)
+
+    def test_skips_completed_builds(self):
+        # A build that completed after build 1
+        self.engine.execute('insert into buildrequests values (5, 1, "branch1-build", 0, 1285844071, "m", "i", 1, 0, 1285844070, 1285844100)')
+        self.engine.execute('insert into builds values (3, 1, 5, 1285844072, 1285844100)')
+        builds, state = getBuildsIncremental('branch1', 0, 2**31)
+        self.engine.execute('update buildrequests set buildername="renamed" where id=1')
+        builds, state = getBuildsIncremental('branch1', 0, 2**31, state)
+        self.assertEqual([b['buildername'] for b in builds[:2]],
+                ['branch1-build', 'branch1-build'])
+
+    def test_ignores_old_state(self):
+        builds, state = getBuildsIncremental('branch1', 0, 2**31)
+        state['columns'] = ['build_id']
+        state['rows'] = [[99]]
+        builds, state = getBuildsIncremental('branch1', 0, 2**31, state)
+        self.assertEqual(builds, getBuilds('branch1', 0, 2**31))
+
+    def test_buildapi_cache(self):
+        c = BuildapiCache(cacher.LocalCache(), pytz.timezone('US/Pacific'),
+                incremental=True)
+        date = c.timezone.localize(datetime.datetime(2010, 9, 30))
+        with mock.patch('time.time', return_value=1285855044):
+            self.assertEqual(c.get_builds_for_day(date, 'branch1'),
+                    getBuilds('branch1', dt2ts(date), dt2ts(date) + 86400))
+            self.assert_(c.cache.get_many(['builds:branch1:2010-09-30:state']))
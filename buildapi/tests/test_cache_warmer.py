@@ -0,0 +1,51 @@
+import datetime
+import mock
+import pytz
+from unittest import TestCase
+
+from buildapi.lib import cacher
+from buildapi.lib.cache import BuildapiCache
+from buildapi.lib.times import dt2ts
+from buildapi.scripts.cache_warmer import CacheWarmer
+
+class TestCacheWarmer(TestCase):
+
+    def setUp(self):
+        self.tz = pytz.timezone('US/Pacific')
+        self.c = BuildapiCache(cacher.LocalCache(), self.tz)
+        self.today = self.tz.localize(datetime.datetime(2012, 6, 20))
+        self.t = dt2ts(self.today) + 12*3600
+        self.warmer = CacheWarmer(self.c, lambda: ['b1'], jobs=1)
+        self.getBuilds = mock.Mock(side_effect=self.builds)
+        self.getRevision = mock.Mock(return_value=[])
+
+    def builds(self, branch, starttime, endtime):
+        if starttime == dt2ts(self.today):
+            # Still running
+            return [{'request_id': 1, 'revision': 'abcdef123456',
+                     'submittime': self.t - 60}]
+        return [{'build_id': 1, 'endtime': starttime + 3600,
+                 'requests': [{'complete': 1, 'complete_at': starttime + 3600,
+                               'submittime': starttime}]}]
+
+    def warm(self, t):
+        with mock.patch('time.time', return_value=t):
+            with mock.patch('buildapi.lib.cache.getBuilds', self.getBuilds):
+                with mock.patch('buildapi.lib.cache.getRevision',
+                        self.getRevision):
+                    return self.warmer.warm()
+
+    def test_refreshes_only_stale_entries(self):
+        self.assertEqual(self.warm(self.t), (3, 0, 0))
+        self.assertEqual(self.getBuilds.call_count, 2)
+        self.getRevision.assert_called_once_with('b1', 'abcdef123456')
+
+        # Everything is still fresh
+        self.assertEqual(self.warm(self.t + 10), (0, 3, 0))
+        self.assertEqual(self.getBuilds.call_count, 2)
+
+        # Today and the revision have gone stale; yesterday is frozen
+        self.assertEqual(self.warm(self.t + self.c.recent_fresh + 10),
+                (2, 1, 0))
+        self.assertEqual(self.getBuilds.call_count, 3)
+        self.assertEqual(self.getRevision.call_count, 2)
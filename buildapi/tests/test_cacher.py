@@ -1,6 +1,10 @@
+import os
+import shutil
+import tempfile
 import threading
+import time
 import mock
-from buildapi.lib import cacher
+from buildapi.lib import cacher, json
 from unittest import TestCase, SkipTest
 
 class Cases(object):
@@ -12,7 +16,7 @@ class Cases(object):
                 args=(1, 2), kwargs=dict(a='a', b='b')),
             7)
         m.assert_called_with(1, 2, a='a', b='b')
-        m.clear()
+        m.reset_mock()
 
         # and the second time, it's in the cache
         self.assertEqual(self.c.get('not-there', m), 7)
@@ -32,6 +36,34 @@ class Cases(object):
         self.assertFalse(self.c.has_key('not-there'))
         self.assertTrue(self.c.has_key('there'))
 
+    def test_has_keys(self):
+        self.c.put('there', 'there')
+        self.assertEqual(self.c.has_keys(['not-there', 'there']),
+                [False, True])
+
+    def test_get_many(self):
+        self.c.put('there', [1, 2])
+        self.c.put('none', None)
+        self.assertEqual(self.c.get_many(['not-there', 'there', 'none']),
+                {'there': [1, 2], 'none': None})
+        self.assertEqual(self.c.get_many([]), {})
+
+    def test_put_many(self):
+        self.c.put_many({'a': 1, 'b': [2]}, expire=time.time()+60)
+        self.assertEqual(self.c.get_many(['a', 'b']), {'a': 1, 'b': [2]})
+
+    def test_delete_many(self):
+        self.c.put('there', 1)
+        self.c.delete_many(['there', 'not-there'])
+        self.assertEqual(self.c.get_many(['there']), {})
+
+    def test_cached_none(self):
+        # None is a perfectly good value to cache
+        m = mock.Mock(return_value=None)
+        self.assertEqual(self.c.get('not-there', m), None)
+        self.assertEqual(self.c.get('not-there', m), None)
+        self.assertEqual(m.call_count, 1)
+
     def test_parallel_calls(self):
         # test that parallel calls to get in different cachers work and return
         # appropriate results.  Note that generate() may be called once or ten
@@ -51,6 +83,27 @@ class Cases(object):
             thd.join()
         self.assertEqual(results, dict((i, 'result') for i in range(10)))
 
+    def test_single_fill(self):
+        # only the caller holding the fill lock should generate the value;
+        # the others wait for it to appear in the cache
+        calls = []
+        results = {}
+        def generate():
+            calls.append(1)
+            time.sleep(0.5)
+            return 'result'
+        def get(thd):
+            c = self.newCache()
+            results[thd] = c.get('not-there', generate, lock_time=5)
+        thds = [ threading.Thread(target=get, args=(i,))
+                 for i in range(5) ]
+        for thd in thds:
+            thd.start()
+        for thd in thds:
+            thd.join()
+        self.assertEqual(results, dict((i, 'result') for i in range(5)))
+        self.assertEqual(len(calls), 1)
+
     # TODO: lists?
 
 class TestRedisCacher(TestCase, Cases):
@@ -96,3 +149,338 @@ class TestMemcacheCacher(TestCase, Cases):
         self.c.m.delete('there')
         self.c.m.delete('not-there')
 
+
+class TestMemoryCacher(TestCase, Cases):
+
+    # The memory backend is only shared within a process, so every "client"
+    # uses the same instance
+    def newCache(self):
+        return self.c
+
+    def setUp(self):
+        self.c = cacher.LocalCache()
+
+    def test_lock_expires(self):
+        self.assertTrue(self.c._acquire_lock('k:lock', 60))
+        self.assertFalse(self.c._acquire_lock('k:lock', 60))
+        with mock.patch('time.time', return_value=time.time() + 61):
+            self.assertTrue(self.c._acquire_lock('k:lock', 60))
+        self.c._release_lock('k:lock')
+        self.assertEqual(self.c.locks, {})
+
+
+class TestRedisCacherColumnar(TestRedisCacher):
+
+    def newCache(self):
+        return cacher.RedisCache(host='localhost',
+                codec=cacher.get_codec('columnar+zlib'))
+
+class TestMemcacheCacherColumnar(TestMemcacheCacher):
+
+    def newCache(self):
+        return cacher.MemcacheCache(hosts=['localhost'],
+                codec=cacher.get_codec('columnar+zlib'))
+
+class TestCodecs(TestCase):
+
+    value = [
+        {'build_id': 1, 'buildername': u'b\xfcild', 'status': None,
+         'requests': [{'request_id': 2, 'reason': 'x'}], 'props': {}},
+        {'request_id': 3, 'reason': 'y'},
+        [], {}, 'string', 1.5, True,
+    ]
+
+    def test_round_trip(self):
+        for name in cacher.codecs:
+            codec = cacher.get_codec(name)
+            self.assertEqual(cacher.decode(codec.encode(self.value)),
+                    self.value, name)
+
+    def test_decode_plain_json(self):
+        self.assertEqual(cacher.decode('{"a": [1, 2]}'), {'a': [1, 2]})
+
+    def test_zlib_min_size(self):
+        codec = cacher.ZlibCodec(min_size=100)
+        self.assertEqual(codec.encode([1]), '[1]')
+        data = codec.encode(['x' * 100])
+        self.assert_(data.startswith(cacher.ZlibCodec.tag))
+        self.assertEqual(cacher.decode(data), ['x' * 100])
+
+    def test_columnar_is_smaller(self):
+        builds = [{'buildername': 'b', 'build_id': i} for i in range(100)]
+        self.assert_(len(cacher.ColumnarCodec().encode(builds)) <
+                len(cacher.JsonCodec().encode(builds)))
+
+    def test_bad_codec(self):
+        self.assertRaises(RuntimeError, cacher.get_codec, 'pickle')
+
+class TestDiskStore(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.store = cacher.DiskStore(os.path.join(self.path, 'frozen'))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_put_get(self):
+        self.assertEqual(self.store.get('builds:b/1:2012-06-20'),
+                cacher.MISSING)
+        self.store.put('builds:b/1:2012-06-20', [{'build_id': 1}])
+        self.assertEqual(self.store.get('builds:b/1:2012-06-20'),
+                [{'build_id': 1}])
+        self.assertEqual(os.listdir(self.store.path),
+                ['builds%3Ab%2F1%3A2012-06-20'])
+
+    def test_put_keeps_first_value(self):
+        self.store.put('k', 1)
+        self.store.put('k', 2)
+        self.assertEqual(self.store.get('k'), 1)
+
+    def test_corrupt_file(self):
+        open(self.store.filename('k'), 'wb').write('z:garbage')
+        self.assertEqual(self.store.get('k'), cacher.MISSING)
+
+class TestLocalCache(TestCase):
+
+    def setUp(self):
+        self.c = cacher.LocalCache(max_bytes=100)
+
+    def test_expiry(self):
+        with mock.patch('time.time', return_value=1000):
+            self.c.put('k', 'v', expire=1010)
+            self.assertTrue(self.c.has_key('k'))
+        with mock.patch('time.time', return_value=1011):
+            self.assertFalse(self.c.has_key('k'))
+            self.assertEqual(self.c.size, 0)
+
+    def test_lru_eviction(self):
+        # each value is 42 bytes of json
+        self.c.put('a', 'a' * 40)
+        self.c.put('b', 'b' * 40)
+        # touch 'a' so that 'b' is the least recently used
+        self.assertTrue(self.c.has_key('a'))
+        self.c.put('c', 'c' * 40)
+        self.assertTrue(self.c.has_key('a'))
+        self.assertFalse(self.c.has_key('b'))
+        self.assertTrue(self.c.has_key('c'))
+        self.assertEqual(self.c.size, 84)
+
+    def test_too_big(self):
+        self.c.put('a', 'a' * 200)
+        self.assertFalse(self.c.has_key('a'))
+        self.assertEqual(self.c.size, 0)
+
+    def test_estimate_size(self):
+        builds = [{'build_id': i, 'buildername': 'Linux build %i' % i,
+                   'requests': [{'request_id': i, 'complete': 1}]}
+                  for i in range(1000)]
+        for val in (builds, {'rows': builds, 'max_build_id': 999}, 'abc'):
+            size = len(json.dumps(val))
+            estimate = cacher.estimate_size(val)
+            self.assert_(0.9 * size < estimate < 1.1 * size, (size, estimate))
+
+
+class TestCacheStats(TestCase):
+
+    def setUp(self):
+        self.c = cacher.LocalCache()
+        self.c.stats = cacher.CacheStats()
+
+    def test_key_family(self):
+        for key, family in [
+                ('builds:b1:2012-06-20', 'builds:day'),
+                ('builds:b1:2012-06-20:fresh', 'builds:day:fresh'),
+                ('builds:b1:2012-06-20:state', 'builds:day:state'),
+                ('builds:b1:2012-06-20:revs', 'builds:day:revs'),
+                ('builds:b1:abcdef123456', 'builds:revision'),
+                ('builds:b1:abcdef123456:lock', 'builds:revision:lock'),
+                ('jobs:7', 'jobs'),
+                ('reports', 'reports'),
+                ]:
+            self.assertEqual(cacher.key_family(key), family)
+
+    def test_get(self):
+        m = mock.Mock(return_value=1)
+        self.c.get('builds:b1:2012-06-20', m)
+        self.c.get('builds:b1:2012-06-20', m)
+        self.c.get_many(['builds:b1:abcdef123456'])
+        stats = self.c.stats.snapshot()
+        day = stats['builds:day']
+        self.assertEqual((day['hits'], day['misses'], day['errors']),
+                (1, 1, 0))
+        self.assertEqual(day['get']['count'], 2)
+        self.assertEqual(day['fill']['count'], 1)
+        self.assertEqual(sum(day['fill']['buckets'].values()), 1)
+        self.assertEqual(stats['builds:revision']['misses'], 1)
+
+    def test_get_stale(self):
+        m = mock.Mock(return_value=1)
+        self.c.put('k', 1)
+        self.c.refreshing.add('k')
+        self.c.get_stale('k', m)
+        self.assertEqual(self.c.stats.snapshot()['k']['stale'], 1)
+
+    def test_errors(self):
+        self.c._get = mock.Mock(side_effect=IOError)
+        self.assertEqual(self.c.get('k', mock.Mock(return_value=1)), 1)
+        self.assertEqual(self.c.stats.snapshot()['k']['errors'], 1)
+
+    def test_histogram(self):
+        stats = cacher.CacheStats()
+        for seconds in (0.0005, 0.5, 100):
+            stats.timing('k', 'fill', seconds)
+        fill = stats.snapshot()['k']['fill']
+        self.assertEqual(fill['count'], 3)
+        self.assertEqual(fill['buckets']['0.001'], 1)
+        self.assertEqual(fill['buckets']['1'], 1)
+        self.assertEqual(fill['buckets']['inf'], 1)
+
+class TestGetStale(TestCase):
+
+    def setUp(self):
+        self.c = cacher.LocalCache()
+
+    def wait_for_refresh(self, key):
+        for i in range(100):
+            if key not in self.c.refreshing:
+                return
+            time.sleep(0.05)
+        self.fail("refresh of %s didn't finish" % key)
+
+    def test_miss(self):
+        m = mock.Mock(return_value=1)
+        now = time.time()
+        self.assertEqual(self.c.get_stale('k', m, stale_after=now+60,
+            expire=now+600), 1)
+        self.assertEqual(self.c.get_many(['k', 'k:fresh']),
+                {'k': 1, 'k:fresh': True})
+
+        # it's fresh, so the value is served from the cache
+        self.assertEqual(self.c.get_stale_status('k', m, stale_after=now+60,
+            expire=now+600), (1, True))
+        self.assertEqual(m.call_count, 1)
+
+    def test_stale(self):
+        m = mock.Mock(return_value=2)
+        now = time.time()
+        self.c.put('k', 1, now+600)
+        self.assertEqual(self.c.get_stale_status('k', m, stale_after=now+60,
+            expire=now+600), (1, False))
+        self.wait_for_refresh('k')
+        m.assert_called_once_with()
+        self.assertEqual(self.c.get_many(['k', 'k:fresh']),
+                {'k': 2, 'k:fresh': True})
+
+    def test_one_refresh_per_key(self):
+        m = mock.Mock(return_value=2)
+        self.c.put('k', 1)
+        self.c.refreshing.add('k')
+        self.assertEqual(self.c.get_stale('k', m), 1)
+        self.c.refreshing.discard('k')
+        self.assertEqual(m.call_count, 0)
+
+    def test_refresh_error(self):
+        m = mock.Mock(side_effect=RuntimeError)
+        self.c.put('k', 1)
+        self.assertEqual(self.c.get_stale('k', m), 1)
+        self.wait_for_refresh('k')
+        self.assertEqual(self.c.get_many(['k']), {'k': 1})
+
+class TestTieredCache(TestCase):
+
+    def setUp(self):
+        self.shared = mock.Mock()
+        self.c = cacher.TieredCache(self.shared, cacher.LocalCache())
+
+    def test_get_falls_through(self):
+        m = mock.Mock()
+        self.shared.get.return_value = [1, 2]
+        self.assertEqual(self.c.get('k', m, expire=0), [1, 2])
+        self.shared.get.assert_called_once_with('k', m, None, None, 0, 600)
+
+        # second time it's served from memory
+        self.assertEqual(self.c.get('k', m, expire=0), [1, 2])
+        self.assertEqual(self.shared.get.call_count, 1)
+
+    def test_get_honors_expiry(self):
+        m = mock.Mock()
+        self.shared.get.return_value = 7
+        with mock.patch('time.time', return_value=1000):
+            self.c.get('k', m, expire=1060)
+            self.c.get('k', m, expire=1060)
+        self.assertEqual(self.shared.get.call_count, 1)
+        with mock.patch('time.time', return_value=1061):
+            self.c.get('k', m, expire=1121)
+        self.assertEqual(self.shared.get.call_count, 2)
+
+    def test_builds_kept_briefly(self):
+        m = mock.Mock()
+        self.shared.get.return_value = [1]
+        with mock.patch('time.time', return_value=1000):
+            self.c.get('builds:b:2013-01-02', m, expire=1900)
+            self.c.get('other', m, expire=1900)
+            # Frozen days never change
+            self.c.get('builds:b:2013-01-01', m, expire=0)
+        self.assertEqual(self.shared.get.call_count, 3)
+        with mock.patch('time.time', return_value=1004):
+            self.c.get('builds:b:2013-01-02', m, expire=1900)
+        self.assertEqual(self.shared.get.call_count, 3)
+        with mock.patch('time.time', return_value=1006):
+            self.c.get('builds:b:2013-01-02', m, expire=1900)
+            self.c.get('other', m, expire=1900)
+            self.c.get('builds:b:2013-01-01', m, expire=0)
+        self.assertEqual(self.shared.get.call_count, 4)
+
+    def test_has_keys(self):
+        self.c.memory.put('a', 1)
+        self.shared.has_keys.return_value = [True, False]
+        self.assertEqual(self.c.has_keys(['a', 'b', 'c']), [True, True, False])
+        self.shared.has_keys.assert_called_once_with(['b', 'c'])
+
+    def test_put_writes_both(self):
+        self.c.put('k', 'v', expire=0)
+        self.shared._put.assert_called_once_with('k', 'v', 0)
+        self.assertEqual(self.c.memory._get('k'), 'v')
+
+    def test_get_many(self):
+        self.c.memory.put('a', 1)
+        self.shared._get_many.return_value = {'b': 2}
+        self.assertEqual(self.c.get_many(['a', 'b', 'c']), {'a': 1, 'b': 2})
+        self.shared._get_many.assert_called_once_with(['b', 'c'])
+
+    def test_get_many_error(self):
+        self.shared._get_many.side_effect = IOError
+        self.assertEqual(self.c.get_many(['a']), {})
+
+    def test_delete_many(self):
+        self.c.memory.put('a', 1)
+        self.c.delete_many(['a'])
+        self.shared._delete_many.assert_called_once_with(['a'])
+        self.assertEqual(self.c.memory.get_many(['a']), {})
+
+    def test_get_stale(self):
+        m = mock.Mock()
+        self.shared.get_stale_status.return_value = (3, True)
+        with mock.patch('time.time', return_value=1000):
+            self.assertEqual(self.c.get_stale('k', m, stale_after=1060,
+                expire=1600), 3)
+            self.assertEqual(self.c.get_stale('k', m, stale_after=1060,
+                expire=1600), 3)
+        self.shared.get_stale_status.assert_called_once_with('k', m, None,
+                None, 1060, 1600, 600)
+        # Values are only kept in memory until they go stale
+        with mock.patch('time.time', return_value=1061):
+            self.c.get_stale('k', m, stale_after=1121, expire=1661)
+        self.assertEqual(self.shared.get_stale_status.call_count, 2)
+
+    def test_get_stale_not_kept_when_stale(self):
+        m = mock.Mock()
+        self.shared.get_stale_status.return_value = (3, False)
+        with mock.patch('time.time', return_value=1000):
+            self.assertEqual(self.c.get_stale('k', m, stale_after=1060,
+                expire=1600), 3)
+            self.shared.get_stale_status.return_value = (4, True)
+            self.assertEqual(self.c.get_stale('k', m, stale_after=1060,
+                expire=1600), 4)
+        self.assertEqual(self.shared.get_stale_status.call_count, 2)
@@ -0,0 +1,130 @@
+import mock
+import sqlalchemy
+from unittest import TestCase
+
+from buildapi.model import init_scheduler_model, init_buildapi_model, meta
+from buildapi.model import catalog
+from buildapi.model.builds import getBuilders
+
+class TestBuilderCatalog(TestCase):
+
+    def setUp(self):
+        meta.scheduler_db_meta.clear()
+        catalog._catalog_state = None
+        self.engine = sqlalchemy.create_engine("sqlite:///:memory:")
+        self.engine.execute('create table buildrequests '
+                '(id integer primary key, buildername text, '
+                'submitted_at integer)')
+        self.add(('Linux mozilla-central build', 100),
+                ('WINNT 5.2 mozilla-central build', 110),
+                ('Linux mozilla-central build', 120),
+                ('Linux x86-64 try build', 130))
+        init_scheduler_model(self.engine)
+        init_buildapi_model(self.engine)
+
+    def tearDown(self):
+        catalog._catalog_state = None
+        meta.scheduler_db_meta.clear()
+        meta.scheduler_db_meta.bind = None
+
+    def add(self, *requests):
+        for buildername, submitted_at in requests:
+            self.engine.execute('insert into buildrequests '
+                    '(buildername, submitted_at) values (?, ?)',
+                    buildername, submitted_at)
+
+    def catalog(self):
+        return self.engine.execute('select buildername, first_seen, '
+                'last_seen, last_brid, platform, build_type, job_type '
+                'from builder_catalog order by buildername').fetchall()
+
+    def test_update(self):
+        self.assertEqual(catalog.updateBuilderCatalog(batch_size=3), 4)
+        self.assertEqual(self.catalog(), [
+            ('Linux mozilla-central build', 100, 120, 3, 'linux-mock', 'opt',
+             'build'),
+            ('Linux x86-64 try build', 130, 130, 4, 'linux-mock', 'opt',
+             'build'),
+            ('WINNT 5.2 mozilla-central build', 110, 110, 2, 'win2k8', 'opt',
+             'build'),
+            ])
+
+        # Only the new buildrequests are read
+        self.add(('Linux mozilla-central build', 140))
+        self.assertEqual(catalog.updateBuilderCatalog(), 1)
+        self.assertEqual(self.catalog()[0][:4],
+                ('Linux mozilla-central build', 100, 140, 5))
+        self.assertEqual(catalog.updateBuilderCatalog(), 0)
+
+    def test_update_rescans(self):
+        catalog.updateBuilderCatalog()
+        # A buildrequest committed after one with a higher id
+        self.engine.execute('insert into buildrequests '
+                '(id, buildername, submitted_at) values (10, ?, 150)',
+                'Linux mozilla-central build')
+        catalog.updateBuilderCatalog()
+        self.engine.execute('insert into buildrequests '
+                '(id, buildername, submitted_at) values (9, ?, 140)',
+                'Linux x86-64 mozilla-central build')
+        self.assertEqual(catalog.updateBuilderCatalog(), 0)
+        self.assertEqual([b[0] for b in self.catalog()],
+                ['Linux mozilla-central build',
+                 'Linux x86-64 mozilla-central build',
+                 'Linux x86-64 try build',
+                 'WINNT 5.2 mozilla-central build'])
+
+    def test_update_concurrently(self):
+        classify = catalog._classify
+        def add_first(name):
+            # Another update adds the builder after we looked for it
+            if name == 'Linux x86-64 try build' and len(self.catalog()) == 0:
+                self.engine.execute('insert into builder_catalog '
+                        '(buildername, first_seen, last_seen, last_brid) '
+                        'values (?, 50, 500, 7)', name)
+            return classify(name)
+        with mock.patch('buildapi.model.catalog._classify', add_first):
+            catalog.updateBuilderCatalog()
+        self.assertEqual(self.catalog()[1][:4],
+                ('Linux x86-64 try build', 50, 500, 7))
+        self.assertEqual(len(self.catalog()), 3)
+
+    def test_reclassify(self):
+        catalog.updateBuilderCatalog()
+        self.engine.execute("update builder_catalog set platform = 'old'")
+        self.assertEqual(catalog.reclassifyBuilders(), 3)
+        self.assertEqual(catalog.reclassifyBuilders(), 0)
+
+    def test_get_builders(self):
+        # Until the catalog is filled in, buildrequests are searched
+        self.assertEqual(catalog.getCatalogBuilders('mozilla-central', 0, 200),
+                None)
+        self.assertEqual(catalog.getBuilderClasses('mozilla-central'), None)
+        self.assertEqual(sorted(getBuilders('mozilla-central', 0, 200)),
+                ['Linux mozilla-central build',
+                 'WINNT 5.2 mozilla-central build'])
+
+        catalog.updateBuilderCatalog()
+        self.engine.execute('delete from buildrequests')
+        self.assertEqual(getBuilders('mozilla-central', 0, 200),
+                ['Linux mozilla-central build',
+                 'WINNT 5.2 mozilla-central build'])
+        self.assertEqual(getBuilders('mozilla-central', 115, 200),
+                ['Linux mozilla-central build'])
+        with mock.patch('time.time', return_value=200):
+            self.assertEqual(catalog.getBuilderClasses('mozilla-central'),
+                    {'platform': ['linux-mock', 'win2k8'],
+                     'build_type': ['opt'], 'job_type': ['build']})
+            self.assertEqual(catalog.getBuilderClasses('cedar'), None)
+
+    def test_stale_catalog(self):
+        catalog.updateBuilderCatalog()
+        t = 130 + catalog.CATALOG_MAX_AGE + 1
+        with mock.patch('time.time', return_value=t):
+            self.assertEqual(catalog.getCatalogBuilders('mozilla-central', 0,
+                t), None)
+            self.assertEqual(catalog.getBuilderClasses('mozilla-central'),
+                    None)
+            # Older intervals can still come from the catalog
+            self.assertEqual(catalog.getCatalogBuilders('mozilla-central', 0,
+                200), ['Linux mozilla-central build',
+                       'WINNT 5.2 mozilla-central build'])
@@ -0,0 +1,79 @@
+import sqlalchemy
+from unittest import TestCase
+
+from buildapi.model import init_status_model, meta
+from buildapi.model.query import BranchNameResolver, GetHistoricBuilds
+
+class TestBranchNameResolver(TestCase):
+
+    def setUp(self):
+        self.r = BranchNameResolver(['mozilla-central', 'mozilla-beta',
+            'mozilla', 'try', 'try-comm-central'])
+
+    def test_longest_prefix(self):
+        self.assertEqual(self.r.resolve('mozilla-central'), 'mozilla-central')
+        self.assertEqual(self.r.resolve('mozilla-central-android'),
+                'mozilla-central')
+        self.assertEqual(self.r.resolve('mozilla-aurora'), 'mozilla')
+        self.assertEqual(self.r.resolve('releases/mozilla-beta'),
+                'mozilla-beta')
+        self.assertEqual(self.r.resolve('try-comm-central'),
+                'try-comm-central')
+
+    def test_unknown(self):
+        self.assertEqual(self.r.resolve('projects/ash'), 'Unknown')
+        self.assertEqual(self.r.resolve('mozilla-central/'), 'Unknown')
+
+    def test_memo(self):
+        self.r.max_memo = 2
+        for name in ('try', 'mozilla-beta', 'mozilla-central'):
+            self.r.resolve(name)
+        self.assertEqual(self.r.memo, {'mozilla-central': 'mozilla-central'})
+
+class TestGetHistoricBuilds(TestCase):
+
+    def setUp(self):
+        self.engine = sqlalchemy.create_engine("sqlite:///:memory:")
+        for sql in [
+                'create table masters (id integer primary key, name text)',
+                'create table slaves (id integer primary key, name text)',
+                'create table builders (id integer primary key, name text)',
+                'create table builds (id integer primary key, '
+                    'buildnumber integer, builder_id integer, '
+                    'slave_id integer, master_id integer, starttime integer, '
+                    'endtime integer, result integer)',
+                'create table properties (id integer primary key, '
+                    'name text, value text)',
+                'create table build_properties (build_id integer, '
+                    'property_id integer)',
+                'insert into masters values (1, "bm01")',
+                'insert into slaves values (1, "slave-01")',
+                'insert into slaves values (2, "slave-02")',
+                'insert into builders values (1, "builder")',
+                'insert into builds values (1, 1, 1, 1, 1, 100, 200, 0)',
+                'insert into builds values (2, 2, 1, 2, 1, 100, 200, 0)',
+                'insert into builds values (3, 3, 1, 1, 1, 100, 200, 0)',
+                'insert into properties values (1, "buildername", \'"b1"\')',
+                'insert into properties values (2, "buildername", \'"b3"\')',
+                'insert into properties values (3, "slavename", \'"x"\')',
+                'insert into build_properties values (1, 1)',
+                'insert into build_properties values (3, 2)',
+                'insert into build_properties values (3, 3)',
+                ]:
+            self.engine.execute(sql)
+        init_status_model(self.engine)
+
+    def tearDown(self):
+        meta.status_db_meta.clear()
+        meta.status_db_meta.bind = None
+
+    def test_buildernames(self):
+        builds = GetHistoricBuilds('slave-0')
+        self.assertEqual([(b['id'], b['buildername']) for b in builds],
+                [(3, 'b3'), (2, ''), (1, 'b1')])
+        builds = GetHistoricBuilds(None)
+        self.assertEqual([(b['id'], b['buildername']) for b in builds],
+                [(3, 'b3'), (2, ''), (1, 'b1')])
+        builds = GetHistoricBuilds('slave-02', greedy=False)
+        self.assertEqual([(b['id'], b['buildername']) for b in builds],
+                [(2, '')])
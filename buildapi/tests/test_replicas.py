@@ -0,0 +1,57 @@
+import sqlalchemy as sa
+from unittest import TestCase
+
+import mock
+
+from buildapi.model import replicas, util
+
+class TestReplicaSet(TestCase):
+
+    def setUp(self):
+        self.primary = sa.create_engine("sqlite:///:memory:")
+        self.replicas = [sa.create_engine("sqlite:///:memory:")
+            for i in range(2)]
+        self.lags = {self.replicas[0]: 100, self.replicas[1]: 10}
+        self.rs = replicas.add_replicas(self.primary, self.replicas,
+                report_max_lag=300)
+        self.rs.measure_lag = mock.Mock(side_effect=self.lags.get)
+
+    def tearDown(self):
+        replicas._replica_sets.clear()
+
+    def test_least_behind(self):
+        self.assertIs(replicas.report_bind(self.primary), self.replicas[1])
+        self.lags[self.replicas[1]] = 1000
+        # The lag isn't measured again right away
+        self.assertIs(replicas.report_bind(self.primary), self.replicas[1])
+        self.rs.lags.clear()
+        self.assertIs(replicas.report_bind(self.primary), self.replicas[0])
+
+    def test_fallback(self):
+        self.lags[self.replicas[0]] = 301
+        self.rs.measure_lag.side_effect = lambda e: 1 / 0 \
+            if e is self.replicas[1] else self.lags[e]
+        self.assertIs(replicas.report_bind(self.primary), self.primary)
+
+    def test_reads(self):
+        # Reads stay on the primary unless told otherwise
+        self.assertIs(replicas.read_bind(self.primary), self.primary)
+        self.rs.read_max_lag = 50
+        self.assertIs(replicas.read_bind(self.primary), self.replicas[1])
+        self.rs.read_max_lag = 5
+        self.assertIs(replicas.read_bind(self.primary), self.primary)
+
+    def test_no_replicas(self):
+        other = sa.create_engine("sqlite:///:memory:")
+        self.assertIs(replicas.report_bind(other), other)
+        self.assertIs(replicas.read_bind(other), other)
+
+    def test_stream_results(self):
+        for engine, value in [(self.primary, 1), (self.replicas[1], 2)]:
+            engine.execute('create table t (x integer)')
+            engine.execute('insert into t values (%i)' % value)
+        meta = sa.MetaData(bind=self.primary)
+        t = sa.Table('t', meta, sa.Column('x', sa.Integer))
+        self.assertEqual([r.x for r in util.stream_results(t.select())], [2])
+        self.assertEqual([r.x for r in replicas.execute_read(t.select())],
+                [1])
@@ -0,0 +1,147 @@
+import os
+import pickle
+import re
+import tempfile
+from unittest import TestCase
+
+import sqlalchemy as sa
+
+from buildapi.model import util
+from buildapi.model.buildrequest import BuildRequest
+
+class TestClassifier(TestCase):
+
+    names = [
+        'Linux mozilla-central build',
+        'Linux x86-64 mozilla-inbound leak test build',
+        'Ubuntu VM 12.04 x64 mozilla-central opt test mochitest-1',
+        'Android 2.3 Emulator mozilla-inbound opt test crashtest',
+        'Rev5 MacOSX Mountain Lion 10.8 fx-team talos tp5o',
+        'Windows 7 32-bit try debug test reftest',
+        'WINNT 5.2 mozilla-central l10n nightly',
+        'b2g_mozilla-central_emulator_dep',
+        'something else',
+        '',
+    ]
+
+    def loop_classify(self, table, name):
+        for key in table:
+            for pat in table[key]:
+                if pat.match(name):
+                    return key
+        return None
+
+    def test_matches_loop(self):
+        for table in (util.PLATFORMS_BUILDERNAME, util.BUILD_TYPE_BUILDERNAME,
+                util.JOB_TYPE_BUILDERNAME):
+            c = util.Classifier(table)
+            self.assert_(c.combined is not None)
+            for name in self.names:
+                self.assertEqual(c(name), self.loop_classify(table, name),
+                        name)
+
+    def test_first_pattern_wins(self):
+        c = util.Classifier({'a': [re.compile('x(y)?')]})
+        self.assertEqual(c('xy'), 'a')
+        self.assertEqual(c('y'), None)
+
+    def test_bounded(self):
+        c = util.Classifier(util.JOB_TYPE_BUILDERNAME, max_names=2)
+        for name in self.names[:3]:
+            c(name)
+        self.assertEqual(list(c.names), self.names[1:3])
+
+    def test_helpers(self):
+        self.assertEqual(util.get_platform('TB Linux comm-central build'),
+                'linux-mock')
+        self.assertEqual(util.get_platform('something else'), 'other')
+        self.assertEqual(util.get_build_type(self.names[1]), 'debug')
+        self.assertEqual(util.get_job_type(self.names[4]), 'talos')
+        self.assertEqual(util.get_branch_name('Projects/Cedar'), 'cedar')
+        self.assertEqual(util.get_branch_name('Elm'), 'elm')
+        self.assertEqual(util.get_silos('t-w732-ix-017'), 't-w732-ix')
+        self.assertEqual(util.get_silos('mystery'), None)
+
+class TestRecord(TestCase):
+
+    def make(self):
+        return BuildRequest(brid=1, bid=2, buildername='Linux mozilla-central build',
+                branch='mozilla-central', changeid=3, author='me',
+                claimed_at=10, start_time=10)
+
+    def test_slots(self):
+        br = self.make()
+        self.assertFalse(hasattr(br, '__dict__'))
+        self.assertRaises(AttributeError, setattr, br, 'extra', 1)
+
+    def test_lazy(self):
+        br = self.make()
+        self.assertFalse(hasattr(br, '_platform'))
+        self.assertEqual(br.platform, 'linux-mock')
+        self.assertEqual(br._platform, 'linux-mock')
+        self.assertEqual(br.status, util.RUNNING)
+        self.assertEqual(br.branch_name, 'mozilla-central')
+
+    def test_pickle(self):
+        br = self.make()
+        br.platform
+        for protocol in (0, 2):
+            br2 = pickle.loads(pickle.dumps(br, protocol))
+            self.assertEqual(br2.to_dict(), br.to_dict())
+            self.assertEqual(br2._platform, 'linux-mock')
+
+class TestStreamResults(TestCase):
+
+    def setUp(self):
+        # A QueuePool, to be able to count the connections checked out
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        engine = sa.create_engine("sqlite:///%s" % self.path,
+                poolclass=sa.pool.QueuePool)
+        meta = sa.MetaData(bind=engine)
+        self.t = sa.Table('t', meta, sa.Column('id', sa.Integer))
+        meta.create_all()
+        self.t.insert().execute([{'id': i} for i in range(25)])
+        self.pool = engine.pool
+
+    def tearDown(self):
+        self.pool.dispose()
+        os.unlink(self.path)
+
+    def test_batches(self):
+        q = self.t.select().order_by(self.t.c.id)
+        rows = list(util.stream_results(q, batch_size=10))
+        self.assertEqual([r['id'] for r in rows], range(25))
+        self.assertEqual(dict(rows[3]), {'id': 3})
+
+    def test_abandoned(self):
+        # The connection goes back to the pool even if the rows aren't all
+        # read
+        rows = util.stream_results(self.t.select(), batch_size=10)
+        rows.next()
+        rows.close()
+        self.assertEqual(self.pool.checkedout(), 0)
+
+class TestAdaptRows(TestCase):
+
+    def rows(self, columns):
+        engine = sa.create_engine("sqlite:///:memory:")
+        q = sa.select([sa.literal_column(repr(v)).label(k)
+            for (k, v) in columns])
+        return engine.execute(q).fetchall()
+
+    def test_matches_kwargs(self):
+        rows = self.rows([('start_time', 10), ('brid', 1), ('bid', 2),
+            ('buildername', 'Linux mozilla-central build'), ('claimed_at', 10),
+            ('author', 'me'), ('changeid', 3)])
+        br, = list(util.adapt_rows(rows, BuildRequest))
+        expected = BuildRequest(**dict((str(k), v)
+            for (k, v) in dict(rows[0]).items()))
+        self.assertEqual(br.__getstate__(), expected.__getstate__())
+        self.assertEqual(br.authors, set(['me']))
+        self.assertEqual(br.results, util.NO_RESULT)
+
+    def test_unexpected_column(self):
+        rows = self.rows([('brid', 1), ('mystery', 2)])
+        self.assertRaises(TypeError, list,
+            util.adapt_rows(rows, BuildRequest))
@@ -8,3 +8,16 @@ CREATE TABLE jobrequests (
 	complete_data VARCHAR, 
 	PRIMARY KEY (id)
 );
+CREATE INDEX jobrequests_when_id ON jobrequests ("when", id);
+CREATE TABLE builder_catalog (
+	id INTEGER NOT NULL, 
+	buildername VARCHAR(255) NOT NULL, 
+	first_seen INTEGER NOT NULL, 
+	last_seen INTEGER NOT NULL, 
+	last_brid INTEGER NOT NULL, 
+	platform VARCHAR(64), 
+	build_type VARCHAR(64), 
+	job_type VARCHAR(64), 
+	PRIMARY KEY (id)
+);
+CREATE UNIQUE INDEX ix_builder_catalog_buildername ON builder_catalog (buildername);
@@ -42,5 +42,7 @@ setup(
 
     [console_scripts]
     selfserve-agent = buildapi.scripts.selfserve_agent:main
+    buildapi-cache-warmer = buildapi.scripts.cache_warmer:main
+    buildapi-builder-catalog = buildapi.scripts.builder_catalog:main
     """,
 )